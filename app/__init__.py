@@ -96,8 +96,8 @@ def create_app(config_name=None):
         
         return response
     
-    # Inicializar Firebase
-    db = init_firebase(app.config)
+    # Inicializar el almacenamiento (Firestore, memoria o SQLite)
+    db = init_storage(app.config)
     
     # Registrar blueprints
     register_blueprints(app)
@@ -110,6 +110,37 @@ def create_app(config_name=None):
     
     return app, db
 
+def init_storage(config):
+    """
+    Inicializar el almacenamiento de datos según STORAGE_BACKEND
+    
+    Los backends 'memory' y 'sqlite' exponen el mismo API que el cliente de
+    Firestore, así que los servicios no distinguen entre ellos.
+    
+    Args:
+        config: Configuración de la aplicación
+        
+    Returns:
+        Cliente de Firestore, MemoryStore o SQLiteStore (None si Firestore
+        no está disponible)
+    """
+    backend = (config.get('STORAGE_BACKEND') or 'firestore').lower()
+    if backend == 'firestore':
+        return init_firebase(config)
+    
+    # Firebase Admin sigue haciendo falta para verificar los tokens de login
+    init_firebase(config)
+    if backend == 'memory':
+        from app.storage.memory_store import MemoryStore
+        print("✅ Almacenamiento en memoria (los datos se pierden al reiniciar)")
+        return MemoryStore()
+    if backend == 'sqlite':
+        from app.storage.sqlite_store import SQLiteStore
+        sqlite_path = config.get('SQLITE_PATH') or 'huerto.sqlite3'
+        print(f"✅ Almacenamiento SQLite en {sqlite_path}")
+        return SQLiteStore(sqlite_path)
+    raise ValueError(f"STORAGE_BACKEND no válido: {backend} (usa firestore, memory o sqlite)")
+
 def init_firebase(config):
     """
     Inicializar Firebase con manejo de errores robusto
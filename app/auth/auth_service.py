@@ -4,11 +4,52 @@ Manejo de usuarios, sesiones y planes de suscripción - SEGURO
 """
 import jwt
 import datetime
+import hashlib
 import json
+import threading
+import time
 from functools import wraps
 from flask import request, jsonify, session, current_app, g
 from firebase_admin import auth as firebase_auth
 from app.middleware.auth_middleware import get_current_user, get_current_user_uid
+from app.services.cache_service import TTLCache
+
+# Vida máxima de un token ID de Firebase (una hora)
+FIREBASE_TOKEN_MAX_LIFETIME = 3600
+
+# Tokens de Firebase ya verificados, por hash del token, compartidos por el proceso
+_token_cache = None
+_token_cache_lock = threading.Lock()
+_revocation_stats = {'revocation_checks': 0, 'revoked': 0}
+
+def get_token_cache():
+    """
+    Obtener (creando si hace falta) la caché de tokens verificados del proceso
+    
+    Returns:
+        TTLCache: Caché de tokens, o None si AUTH_TOKEN_CACHE_MAX_ENTRIES es 0
+    """
+    global _token_cache
+    if _token_cache is None:
+        from flask import has_app_context
+        app_config = current_app.config if has_app_context() else {}
+        max_entries = int(app_config.get('AUTH_TOKEN_CACHE_MAX_ENTRIES', 5000))
+        if max_entries <= 0:
+            return None
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = TTLCache(max_size=max_entries, ttl_seconds=FIREBASE_TOKEN_MAX_LIFETIME)
+    return _token_cache
+
+def _token_key(id_token):
+    """Clave de caché de un token: su hash, para no guardar el token en memoria"""
+    return hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+
+def _revocation_interval():
+    """Segundos entre comprobaciones de revocación de un token en caché (0 = nunca)"""
+    from flask import has_app_context
+    app_config = current_app.config if has_app_context() else {}
+    return float(app_config.get('AUTH_TOKEN_REVOCATION_CHECK_SECONDS', 0))
 
 class AuthService:
     """Servicio de autenticación centralizado con seguridad mejorada"""
@@ -18,24 +59,100 @@ class AuthService:
         """
         Verificar token de Firebase Authentication
         
+        Un token ya verificado se guarda (por su hash) hasta su caducidad
+        'exp', y las peticiones siguientes con el mismo token no repiten la
+        verificación de la firma. Con AUTH_TOKEN_REVOCATION_CHECK_SECONDS > 0
+        el token se vuelve a verificar contra Firebase, comprobando si se ha
+        revocado o el usuario está deshabilitado, como mucho con esa frecuencia.
+        
+        Args:
+            id_token (str): Token ID de Firebase
+            
+        Returns:
+            dict: Información del usuario o None si es inválido
+        """
+        cache = get_token_cache() if isinstance(id_token, str) and id_token else None
+        if cache is None:
+            return AuthService._verify_and_cache(id_token)
+        
+        clave = _token_key(id_token)
+        encontrado, entrada = cache.get(clave)
+        if encontrado:
+            intervalo = _revocation_interval()
+            if not intervalo or time.monotonic() - entrada['revisado'] < intervalo:
+                return entrada['usuario']
+        return AuthService._verify_and_cache(id_token, cache, clave, en_cache=encontrado)
+    
+    @staticmethod
+    def _verify_and_cache(id_token, cache=None, clave=None, en_cache=False):
+        """
+        Verificar un token con Firebase y guardarlo en la caché hasta su 'exp'
+        
         Args:
             id_token (str): Token ID de Firebase
+            cache (TTLCache): Caché de tokens verificados (None = no guardar)
+            clave (str): Hash del token
+            en_cache (bool): El token estaba en caché y toca comprobar la revocación
             
         Returns:
             dict: Información del usuario o None si es inválido
         """
+        check_revoked = cache is not None and _revocation_interval() > 0
         try:
-            decoded_token = firebase_auth.verify_id_token(id_token)
-            return {
-                'uid': decoded_token['uid'],
-                'email': decoded_token.get('email'),
-                'email_verified': decoded_token.get('email_verified', False),
-                'name': decoded_token.get('name') or decoded_token.get('email', '').split('@')[0],
-                'picture': decoded_token.get('picture')
-            }
+            decoded_token = firebase_auth.verify_id_token(id_token, check_revoked=check_revoked)
         except Exception as e:
-            print(f"Error verificando token Firebase: {e}")
+            if isinstance(e, (firebase_auth.RevokedIdTokenError, firebase_auth.UserDisabledError)):
+                with _token_cache_lock:
+                    _revocation_stats['revocation_checks'] += 1
+                    _revocation_stats['revoked'] += 1
+                print(f"🚫 [Auth] Token Firebase revocado o usuario deshabilitado: {e}")
+            else:
+                print(f"Error verificando token Firebase: {e}")
+            if en_cache:
+                cache.invalidate(clave)
             return None
+        
+        usuario = {
+            'uid': decoded_token['uid'],
+            'email': decoded_token.get('email'),
+            'email_verified': decoded_token.get('email_verified', False),
+            'name': decoded_token.get('name') or decoded_token.get('email', '').split('@')[0],
+            'picture': decoded_token.get('picture')
+        }
+        if cache is not None:
+            if check_revoked:
+                with _token_cache_lock:
+                    _revocation_stats['revocation_checks'] += 1
+            # Caduca con el token; nunca se guarda uno ya caducado
+            vida = decoded_token.get('exp', 0) - time.time()
+            if vida > 0:
+                cache.set(clave, {'usuario': usuario, 'revisado': time.monotonic()}, ttl_seconds=vida)
+        return usuario
+    
+    @staticmethod
+    def forget_firebase_token(id_token):
+        """
+        Quitar un token de la caché de tokens verificados (al cerrar sesión)
+        
+        Args:
+            id_token (str): Token ID de Firebase
+        """
+        cache = get_token_cache() if isinstance(id_token, str) and id_token else None
+        if cache is not None:
+            cache.invalidate(_token_key(id_token))
+    
+    @staticmethod
+    def get_token_cache_stats():
+        """Contadores de la caché de tokens verificados y de las comprobaciones de revocación"""
+        cache = get_token_cache()
+        if cache is None:
+            return {'enabled': False}
+        stats = cache.stats()
+        with _token_cache_lock:
+            stats.update(_revocation_stats)
+        stats['enabled'] = True
+        stats['revocation_check_seconds'] = _revocation_interval()
+        return stats
     
     @staticmethod
     def create_custom_token(user_data):
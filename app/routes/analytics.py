@@ -4,27 +4,40 @@ Gráficas y estadísticas avanzadas
 """
 import datetime
 import json
-import io
 import tempfile
 import os
 import locale
-from flask import Blueprint, render_template, jsonify, make_response
+from flask import Blueprint, render_template, jsonify
 from app.auth.auth_service import login_required, get_current_user, premium_required
 from app.middleware.auth_middleware import require_auth, optional_auth, get_current_user_uid
 from app.services.crop_service import CropService
-
-def format_spanish_number(value, decimals=2):
-    """Formatear número con separador decimal español (coma)"""
-    try:
-        if value is None:
-            return "0"
-        formatted = f"{float(value):.{decimals}f}"
-        return formatted.replace('.', ',')
-    except (ValueError, TypeError):
-        return str(value)
+from app.services.rollup_service import ROLLUP_GRANULARITIES, TEMPORADAS
+from app.services.export_service import ARROW_FORMATS, ARROW_TABLES, BUNDLE_FORMATS, CSV_CROP_HEADER, EXPORT_FORMATS, JOB_DONE, JOB_FAILED, ExportService, chunked, csv_crop_rows, export_filename, get_export_jobs, iter_json, iter_ndjson, json_crop_data, json_export_document, json_production, json_summary, report_format
+from app.services.analytics_service import ProductionIndex, build_series, cached_series, parse_iso_epoch, parse_series_args
+from app.utils.helpers import format_spanish_number
+from app.utils.http_cache import conditional_json
 
 analytics_bp = Blueprint('analytics', __name__)
 
+# Tamaño aproximado de cada bloque enviado al exportar CSV o JSON en streaming
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Segundos entre comentarios de keepalive en el SSE de los trabajos de exportación
+EXPORT_SSE_KEEPALIVE = 15
+
+def _get_snapshot(crop_service, user, include_production=True, projection='summary'):
+    """
+    Instantánea de cultivos (una sola carga) del usuario o de los datos demo
+    
+    Con include_production=False las métricas salen de los agregados de cada
+    cultivo, sin leer el historial de producción, y sólo se leen los campos
+    del preset 'projection' (ver CROP_PROJECTIONS).
+    """
+    if user:
+        return crop_service.get_user_snapshot(user['uid'], include_production=include_production,
+                                              projection=projection)
+    return crop_service.get_demo_snapshot()
+
 @analytics_bp.route('/')
 @require_auth
 def analytics_dashboard():
@@ -38,56 +51,29 @@ def analytics_dashboard():
     from flask import current_app
     crop_service = CropService(current_app.db)
     
-    # Obtener datos del usuario autenticado
-    cultivos = crop_service.get_user_crops(user_uid)
-    total_kilos, total_beneficios = crop_service.get_user_totals(user_uid)
+    # Obtener datos del usuario autenticado (agregados, sin historial)
+    snapshot = crop_service.get_user_snapshot(user_uid, include_production=False)
+    total_kilos = snapshot['total_kilos']
+    total_beneficios = snapshot['total_beneficios']
     
     # Preparar datos detallados para cada cultivo
     cultivos_detallados = []
-    for cultivo in cultivos:
-        # Calcular totales de producción
-        total_kilos_cultivo = sum(p.get('kilos', 0) for p in cultivo.get('produccion_diaria', []))
-        total_unidades_cultivo = sum(p.get('unidades', 0) for p in cultivo.get('produccion_diaria', []))
-        
-        # Calcular peso promedio por unidad
-        peso_por_unidad = (total_kilos_cultivo / total_unidades_cultivo) if total_unidades_cultivo > 0 else 0
-        
-        # Calcular beneficio
-        precio_kilo = cultivo.get('precio_por_kilo', 0)
-        beneficio = total_kilos_cultivo * precio_kilo
-        
-        # Calcular días de cultivo
-        dias_cultivo = None
-        if 'fecha_siembra' in cultivo and cultivo['fecha_siembra']:
-            fecha_inicio = cultivo['fecha_siembra']
-            fecha_fin = cultivo.get('fecha_cosecha', datetime.datetime.now())
-            if hasattr(fecha_inicio, 'date'):
-                fecha_inicio = fecha_inicio.date()
-            if hasattr(fecha_fin, 'date'):
-                fecha_fin = fecha_fin.date()
-            elif isinstance(fecha_fin, datetime.datetime):
-                fecha_fin = fecha_fin.date()
-            
-            try:
-                dias_cultivo = (fecha_fin - fecha_inicio).days
-            except:
-                dias_cultivo = None
-        
-        # Contar abonos
-        total_abonos = len(cultivo.get('abonos', []))
+    for cultivo in snapshot['cultivos']:
+        metricas = snapshot['metricas'][cultivo.get('id')]
         
         cultivos_detallados.append({
+            'id': cultivo.get('id'),
             'nombre': cultivo['nombre'],
             'color_cultivo': cultivo.get('color_cultivo', '#28a745'),  # Incluir color del cultivo
             'activo': cultivo.get('activo', True),
             'numero_plantas': cultivo.get('numero_plantas', 1),
-            'dias_cultivo': dias_cultivo,
-            'total_unidades': total_unidades_cultivo,
-            'total_kilos': total_kilos_cultivo,
-            'peso_por_unidad': peso_por_unidad,
-            'precio_por_kilo': precio_kilo,
-            'beneficio': beneficio,
-            'total_abonos': total_abonos
+            'dias_cultivo': metricas['dias_cultivo'],
+            'total_unidades': metricas['total_unidades'],
+            'total_kilos': metricas['total_kilos'],
+            'peso_por_unidad': metricas['peso_por_unidad'],
+            'precio_por_kilo': metricas['precio_por_kilo'],
+            'beneficio': metricas['beneficio'],
+            'total_abonos': metricas['total_abonos']
         })
     
     # Preparar datos para gráficas (compatibilidad)
@@ -118,27 +104,28 @@ def advanced():
     from flask import current_app
     crop_service = CropService(current_app.db)
     
-    # Obtener datos del usuario autenticado
-    cultivos = crop_service.get_user_crops(user_uid)
-    total_kilos, total_beneficios = crop_service.get_user_totals(user_uid)
+    # Cabeceras y agregados de los cultivos (sin historial de producción)
+    snapshot = crop_service.get_user_snapshot(user_uid, include_production=False)
+    cultivos = snapshot['cultivos']
+    total_kilos = snapshot['total_kilos']
+    total_beneficios = snapshot['total_beneficios']
     
     # Verificar plan del usuario
     plan = user.get('plan', 'gratuito')
     
     # Preparar datos avanzados para analytics
-    # 1. Análisis temporal por meses
-    monthly_data = {}
-    for cultivo in cultivos:
-        for produccion in cultivo.get('produccion_diaria', []):
-            fecha = produccion['fecha']
-            month_key = f"{fecha.year}-{fecha.month:02d}"
-            if month_key not in monthly_data:
-                monthly_data[month_key] = {'kilos': 0, 'beneficio': 0}
-            monthly_data[month_key]['kilos'] += produccion['kilos']
-            monthly_data[month_key]['beneficio'] += produccion['kilos'] * cultivo['precio_por_kilo']
+    # 1. Series por mes y temporada desde los rollups (coste por periodo, no por registro)
+    precios = {c.get('id'): c.get('precio_por_kilo', 0) for c in cultivos}
+    monthly_data = {
+        p['periodo']: {'kilos': p['kilos'], 'beneficio': p['beneficio']}
+        for p in crop_service.rollups.get_rollups(user_uid, 'mes', precios=precios)
+    }
+    season_data = {temporada: 0 for temporada in TEMPORADAS}
+    for periodo in crop_service.rollups.get_rollups(user_uid, 'temporada', precios=precios):
+        season_data[periodo['periodo'].split('-', 1)[1]] += periodo['kilos']
     
     # 2. Ranking de cultivos más rentables
-    cultivos_ranking = sorted(cultivos, key=lambda x: x.get('beneficio_total', 0), reverse=True)
+    cultivos_ranking = snapshot['ranking']
     
     # 3. Proyecciones (simuladas para demo)
     proyeccion_anual = total_beneficios * 2.5  # Proyección optimista
@@ -146,6 +133,7 @@ def advanced():
     return render_template('analytics/advanced.html', 
                          cultivos=cultivos,
                          monthly_data=monthly_data,
+                         season_data=season_data,
                          cultivos_ranking=cultivos_ranking[:5],  # Top 5
                          total_kilos=total_kilos,
                          total_beneficios=total_beneficios,
@@ -155,18 +143,27 @@ def advanced():
 
 @analytics_bp.route('/api/chart-data')
 @require_auth
+@conditional_json
 def api_chart_data():
-    """API para datos de gráficas - funciona en modo demo"""
-    from flask import current_app
+    """
+    API para datos de gráficas - funciona en modo demo
+    
+    Con ?desde=&hasta= (fechas ISO) los kilos y beneficios de cada cultivo
+    son los de ese rango, calculados con el índice de rangos de cada cultivo.
+    """
+    from flask import current_app, request
     
     user = get_current_user()
     crop_service = CropService(current_app.db)
+    try:
+        desde = parse_iso_epoch(request.args.get('desde'))
+        hasta = parse_iso_epoch(request.args.get('hasta'), fin_de_dia=True)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     # Obtener datos según si está autenticado o en modo demo
-    if user:
-        cultivos = crop_service.get_user_crops(user['uid'])
-    else:
-        cultivos = crop_service.get_demo_crops()
+    # (sólo nombre, color, precio y agregados de cada cultivo)
+    snapshot = _get_snapshot(crop_service, user, include_production=False, projection='chart')
     
     # Preparar datos para Chart.js
     labels = []
@@ -174,14 +171,18 @@ def api_chart_data():
     beneficios_data = []
     colors = []  # Array de colores de cultivos
     
-    for cultivo in cultivos:
+    for cultivo in snapshot['cultivos']:
+        metricas = snapshot['metricas'][cultivo.get('id')]
+        if desde is not None or hasta is not None:
+            if user:
+                indice = crop_service.get_production_index(user['uid'], cultivo.get('id'))
+            else:
+                indice = ProductionIndex(cultivo.get('produccion_diaria') or [], cultivo.get('precio_por_kilo', 0))
+            metricas = indice.range_totals(desde, hasta) if indice else {'kilos': 0, 'beneficio': 0}
+            metricas = {'total_kilos': metricas['kilos'], 'beneficio': metricas['beneficio']}
         labels.append(cultivo['nombre'])
-        
-        kilos_total = sum(p.get('kilos', 0) for p in cultivo.get('produccion_diaria', []))
-        precio_kilo = cultivo.get('precio_por_kilo', 0)
-        
-        kilos_data.append(kilos_total)
-        beneficios_data.append(kilos_total * precio_kilo)
+        kilos_data.append(metricas['total_kilos'])
+        beneficios_data.append(metricas['beneficio'])
         colors.append(cultivo.get('color_cultivo', '#28a745'))  # Color específico del cultivo
     
     return jsonify({
@@ -205,544 +206,532 @@ def api_chart_data():
         ]
     })
 
-@analytics_bp.route('/export/csv')
+@analytics_bp.route('/api/rollups')
 @require_auth
-def export_csv():
-    """Exportar datos detallados a CSV - funciona en modo demo"""
-    from flask import current_app
-    import csv
-    import io
+@conditional_json
+def api_rollups():
+    """
+    Series de producción por periodo para las gráficas de tendencia
+    
+    Parámetros: granularidad ('dia', 'semana', 'mes' o 'temporada') y
+    cultivo (opcional, ID de un cultivo). Lee los rollups del usuario, no
+    su historial de producción.
+    """
+    from flask import current_app, request
     
     user = get_current_user()
     crop_service = CropService(current_app.db)
+    granularidad = request.args.get('granularidad', 'mes')
+    crop_id = request.args.get('cultivo') or None
+    if granularidad not in ROLLUP_GRANULARITIES:
+        return jsonify({'success': False, 'error': f"granularidad debe ser una de {', '.join(ROLLUP_GRANULARITIES)}"}), 400
     
-    # Obtener datos según si está autenticado o en modo demo
+    snapshot = _get_snapshot(crop_service, user, include_production=False, projection='chart')
+    precios = {c.get('id'): c.get('precio_por_kilo', 0) for c in snapshot['cultivos']}
     if user:
-        cultivos = crop_service.get_user_crops(user['uid'])
-        filename = f"huerto_detallado_{user['uid'][:8]}.csv"
+        periodos = crop_service.rollups.get_rollups(user['uid'], granularidad, crop_id, precios=precios)
     else:
-        cultivos = crop_service.get_demo_crops()
-        filename = "huerto_detallado_demo.csv"
-    
-    # Crear CSV en memoria
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Cabeceras con todos los datos disponibles
-    writer.writerow([
-        'Cultivo', 'Estado', 'Fecha Siembra', 'Fecha Cosecha', 'Días Cultivo',
-        'Número Plantas', 'Precio/kg (€)', 'Total Unidades', 'Total Kilos',
-        'Peso/Unidad (kg)', 'Beneficio Total (€)', 'Total Abonos', 'Rentabilidad (%)'
-    ])
-    
-    # Calcular totales para rentabilidad
-    total_beneficios = sum(
-        sum(p.get('kilos', 0) for p in cultivo.get('produccion_diaria', [])) * cultivo.get('precio_por_kilo', 0)
-        for cultivo in cultivos
-    )
-    
-    # Datos detallados
-    for cultivo in cultivos:
-        # Calcular métricas
-        total_kilos = sum(p.get('kilos', 0) for p in cultivo.get('produccion_diaria', []))
-        total_unidades = sum(p.get('unidades', 0) for p in cultivo.get('produccion_diaria', []))
-        peso_por_unidad = (total_kilos / total_unidades) if total_unidades > 0 else 0
-        beneficio = total_kilos * cultivo.get('precio_por_kilo', 0)
-        rentabilidad = (beneficio / total_beneficios * 100) if total_beneficios > 0 else 0
-        
-        # Calcular días de cultivo
-        dias_cultivo = ""
-        if cultivo.get('fecha_siembra') and cultivo.get('fecha_cosecha'):
-            delta = cultivo['fecha_cosecha'] - cultivo['fecha_siembra']
-            dias_cultivo = delta.days
-        elif cultivo.get('fecha_siembra'):
-            delta = datetime.datetime.now() - cultivo['fecha_siembra']
-            dias_cultivo = delta.days
-        
-        writer.writerow([
-            cultivo['nombre'],
-            'Activo' if cultivo.get('activo', True) else 'Finalizado',
-            cultivo['fecha_siembra'].strftime('%Y-%m-%d') if cultivo.get('fecha_siembra') else '',
-            cultivo['fecha_cosecha'].strftime('%Y-%m-%d') if cultivo.get('fecha_cosecha') else '',
-            dias_cultivo,
-            cultivo.get('numero_plantas', 1),
-            format_spanish_number(cultivo.get('precio_por_kilo', 0), 2),
-            total_unidades,
-            format_spanish_number(total_kilos, 1),
-            format_spanish_number(peso_por_unidad, 3) if peso_por_unidad > 0 else "0",
-            format_spanish_number(beneficio, 2),
-            len(cultivo.get('abonos', [])),
-            format_spanish_number(rentabilidad, 1)
-        ])
-    
-    # Crear respuesta HTTP
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        # Modo demo: los cultivos de ejemplo llevan su historial
+        registros = [dict(r, cultivo_id=c['id']) for c in snapshot['cultivos'] for r in c.get('produccion_diaria', [])]
+        periodos = crop_service.rollups.merge_series(
+            list(crop_service.rollups.build_rollups(registros).values()), granularidad, precios, crop_id
+        )
+    
+    return jsonify({
+        'success': True,
+        'granularidad': granularidad,
+        'zona_horaria': crop_service.rollups.zona_horaria,
+        'labels': [p['periodo'] for p in periodos],
+        'kilos': [p['kilos'] for p in periodos],
+        'beneficios': [p['beneficio'] for p in periodos],
+        'periodos': periodos
+    })
+
+@analytics_bp.route('/api/series')
+@require_auth
+@conditional_json
+def api_series():
+    """
+    Serie diaria reducida para las gráficas de producción
+    
+    Parámetros: desde/hasta (fechas ISO), puntos, metodo ('lttb' o
+    'minmax'), campo ('kilos', 'unidades' o 'beneficio') y cultivo
+    (opcional). Parte de los rollups diarios, así que el coste no depende del
+    número de registros; devuelve también el resumen del rango y de los días
+    omitidos. Las series se cachean por versión de datos del usuario.
+    """
+    from flask import current_app, request
+    import numpy as np
+    
+    user = get_current_user()
+    crop_service = CropService(current_app.db)
+    crop_id = request.args.get('cultivo') or None
+    try:
+        opciones = parse_series_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    def construir():
+        snapshot = _get_snapshot(crop_service, user, include_production=False, projection='chart')
+        precios = {c.get('id'): c.get('precio_por_kilo', 0) for c in snapshot['cultivos']}
+        if user:
+            dias = crop_service.rollups.get_rollups(user['uid'], 'dia', crop_id, precios=precios)
+        else:
+            registros = [dict(r, cultivo_id=c['id']) for c in snapshot['cultivos'] for r in c.get('produccion_diaria', [])]
+            dias = crop_service.rollups.merge_series(
+                list(crop_service.rollups.build_rollups(registros).values()), 'dia', precios, crop_id
+            )
+        # Cada día en la medianoche UTC de su fecha local: las etiquetas son las de los rollups
+        fechas = np.array([datetime.datetime.strptime(d['periodo'], '%Y-%m-%d')
+                           .replace(tzinfo=datetime.timezone.utc).timestamp() for d in dias], dtype=np.float64)
+        columnas = {campo: np.array([d[campo] for d in dias], dtype=np.float64)
+                    for campo in ('kilos', 'unidades', 'beneficio')}
+        return build_series(fechas, columnas, opciones, formato='%Y-%m-%d')
+    
+    try:
+        if user:
+            clave = (user['uid'], 'dia', crop_id, tuple(sorted(opciones.items())),
+                     crop_service.get_data_version(user['uid']))
+            serie = cached_series(clave, construir)
+        else:
+            serie = construir()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({'success': True, 'zona_horaria': crop_service.rollups.zona_horaria, **serie})
+
+@analytics_bp.route('/export/csv')
+@require_auth
+def export_csv():
+    """
+    Exportar datos detallados a CSV - funciona en modo demo
+    
+    El fichero se genera mientras se envía: la cabecera sale de inmediato y
+    las filas se escriben en bloques según se calculan, sin construir el CSV
+    en memoria. Parámetros opcionales: desde/hasta (fechas ISO) para limitar
+    los totales a un rango y detalle=1 para una fila por registro de
+    producción en lugar de una por cultivo.
+    """
+    from flask import current_app, request, stream_with_context
     
+    user = get_current_user()
+    crop_service = CropService(current_app.db)
+    try:
+        desde = parse_iso_epoch(request.args.get('desde'))
+        hasta = parse_iso_epoch(request.args.get('hasta'), fin_de_dia=True)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    detalle = request.args.get('detalle') in ('1', 'true')
+    
+    nombre = f"huerto_{'registros' if detalle else 'detallado'}_{user['uid'][:8] if user else 'demo'}.csv"
+    if detalle:
+        filas = _csv_production_rows(crop_service, user, desde, hasta)
+    else:
+        filas = _csv_crop_rows(crop_service, user, desde, hasta)
+    
+    response = current_app.response_class(stream_with_context(_stream_csv(filas)), mimetype='text/csv')
+    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    response.headers['Content-Disposition'] = f'attachment; filename={nombre}'
     return response
 
+def _stream_csv(filas, tamano_bloque=STREAM_CHUNK_BYTES):
+    """
+    Texto CSV de 'filas' en bloques de unos tamano_bloque bytes
+    
+    La primera fila (cabecera) se envía sola para que la descarga empiece
+    antes de leer ningún dato; sólo el bloque en curso está en memoria.
+    """
+    import csv
+    import io
+    
+    salida = io.StringIO()
+    writer = csv.writer(salida)
+    primera = True
+    for fila in filas:
+        writer.writerow(fila)
+        if primera or salida.tell() >= tamano_bloque:
+            yield salida.getvalue()
+            salida.seek(0)
+            salida.truncate(0)
+            primera = False
+    if salida.tell():
+        yield salida.getvalue()
+
+def _csv_crop_rows(crop_service, user, desde=None, hasta=None):
+    """Cabecera y una fila por cultivo, con los totales del rango si se indica"""
+    yield CSV_CROP_HEADER
+    
+    # Métricas precalculadas en la instantánea (agregados, sin historial)
+    snapshot = _get_snapshot(crop_service, user, include_production=False)
+    cultivos = snapshot['cultivos']
+    metricas = [snapshot['metricas'][cultivo.get('id')] for cultivo in cultivos]
+    if desde is not None or hasta is not None:
+        # Totales del rango con el índice de rangos de cada cultivo (búsqueda binaria)
+        rango = []
+        for cultivo, metrica in zip(cultivos, metricas):
+            if user:
+                indice = crop_service.get_production_index(user['uid'], cultivo.get('id'))
+            else:
+                indice = ProductionIndex(cultivo.get('produccion_diaria') or [], cultivo.get('precio_por_kilo', 0))
+            totales = indice.range_totals(desde, hasta) if indice else {'kilos': 0, 'unidades': 0, 'beneficio': 0}
+            rango.append(dict(
+                metrica,
+                total_kilos=totales['kilos'],
+                total_unidades=totales['unidades'],
+                peso_por_unidad=totales['kilos'] / totales['unidades'] if totales['unidades'] > 0 else 0,
+                beneficio=totales['beneficio']
+            ))
+        total_beneficios = sum(m['beneficio'] for m in rango)
+        for m in rango:
+            m['rentabilidad'] = m['beneficio'] / total_beneficios * 100 if total_beneficios > 0 else 0
+        metricas = rango
+    
+    yield from csv_crop_rows(cultivos, metricas)
+
+def _csv_production_rows(crop_service, user, desde=None, hasta=None):
+    """Cabecera y una fila por registro de producción, cultivo a cultivo y en orden de fecha"""
+    yield ['Cultivo', 'Fecha', 'Hora', 'Unidades', 'Kilos', 'Precio/kg (€)', 'Beneficio (€)']
+    
+    def en_rango(registro):
+        epoch = CropService._to_epoch(registro.get('fecha'))
+        if epoch is None:
+            return desde is None and hasta is None
+        return (desde is None or epoch >= desde) and (hasta is None or epoch < hasta)
+    
+    fecha_desde = datetime.datetime.fromtimestamp(desde, tz=datetime.timezone.utc) if desde is not None else None
+    fecha_hasta = datetime.datetime.fromtimestamp(hasta, tz=datetime.timezone.utc) if hasta is not None else None
+    snapshot = _get_snapshot(crop_service, user, include_production=False, projection='chart')
+    for cultivo in snapshot['cultivos']:
+        precio = float(cultivo.get('precio_por_kilo', 0) or 0)
+        if user:
+            registros = crop_service.iter_crop_productions(user['uid'], cultivo.get('id'), fecha_desde, fecha_hasta)
+        else:
+            registros = (r for r in cultivo.get('produccion_diaria') or [] if en_rango(r))
+        for registro in registros:
+            fecha = registro.get('fecha')
+            kilos = float(registro.get('kilos', 0) or 0)
+            yield [
+                cultivo['nombre'],
+                fecha.strftime('%Y-%m-%d') if fecha else '',
+                fecha.strftime('%H:%M') if fecha else '',
+                int(registro.get('unidades', 0) or 0),
+                format_spanish_number(kilos, 3),
+                format_spanish_number(precio, 2),
+                format_spanish_number(kilos * precio, 2)
+            ]
+
 @analytics_bp.route('/export/json')
 @require_auth
 def export_json():
-    """Exportar datos completos a JSON - funciona en modo demo"""
-    from flask import current_app
+    """
+    Exportar datos completos a JSON - funciona en modo demo
+    
+    El JSON se genera mientras se envía, en bloques: los registros de
+    producción se leen cultivo a cultivo y se codifican según llegan, sin
+    construir el documento en memoria. Con formato=ndjson se envía un
+    documento por línea, con 'tipo' resumen, cultivo, produccion o abono
+    (los registros llevan el cultivo_id de su cultivo).
+    """
+    from flask import current_app, request, stream_with_context
     
     user = get_current_user()
     crop_service = CropService(current_app.db)
-    
-    # Obtener datos según si está autenticado o en modo demo
-    if user:
-        cultivos = crop_service.get_user_crops(user['uid'])
-        total_kilos, total_beneficios = crop_service.get_user_totals(user['uid'])
+    formato = request.args.get('formato', 'json')
+    if formato not in ('json', 'ndjson'):
+        return jsonify({'success': False, 'error': 'formato debe ser json o ndjson'}), 400
+    
+    # Obtener datos según si está autenticado o en modo demo (sin historial)
+    snapshot = _get_snapshot(crop_service, user, include_production=False)
+    resumen = json_summary(snapshot, user)
+    
+    def produccion_de(cultivo):
+        if user:
+            registros = crop_service.iter_crop_productions(user['uid'], cultivo.get('id'))
+        else:
+            registros = cultivo.get('produccion_diaria') or []
+        return map(json_production, registros)
+    
+    if formato == 'ndjson':
+        partes = iter_ndjson(_ndjson_documents(resumen, snapshot, produccion_de))
+        extension, mimetype = 'ndjson', 'application/x-ndjson'
     else:
-        cultivos = crop_service.get_demo_crops()
-        total_kilos, total_beneficios = crop_service.get_demo_totals()
-    
-    # Preparar datos completos para exportar
-    export_data = {
-        'resumen': {
-            'total_cultivos': len(cultivos),
-            'total_kilos': total_kilos,
-            'total_beneficios': total_beneficios,
-            'fecha_exportacion': datetime.datetime.now().isoformat(),
-            'usuario': user['uid'] if user else 'demo'
-        },
-        'cultivos_detallados': []
-    }
+        partes = iter_json(json_export_document(resumen, snapshot, produccion_de), indent=2)
+        extension, mimetype = 'json', 'application/json'
     
-    for cultivo in cultivos:
-        # Calcular métricas detalladas
-        total_kilos_cultivo = sum(p.get('kilos', 0) for p in cultivo.get('produccion_diaria', []))
-        total_unidades_cultivo = sum(p.get('unidades', 0) for p in cultivo.get('produccion_diaria', []))
-        peso_por_unidad = (total_kilos_cultivo / total_unidades_cultivo) if total_unidades_cultivo > 0 else 0
-        beneficio = total_kilos_cultivo * cultivo.get('precio_por_kilo', 0)
-        
-        # Calcular días de cultivo
-        dias_cultivo = None
-        if cultivo.get('fecha_siembra'):
-            fecha_fin = cultivo.get('fecha_cosecha', datetime.datetime.now())
-            try:
-                dias_cultivo = (fecha_fin - cultivo['fecha_siembra']).days
-            except:
-                dias_cultivo = None
-        
-        cultivo_data = {
-            'informacion_basica': {
-                'nombre': cultivo['nombre'],
-                'activo': cultivo.get('activo', True),
-                'numero_plantas': cultivo.get('numero_plantas', 1),
-                'precio_por_kilo': cultivo.get('precio_por_kilo', 0)
-            },
-            'fechas': {
-                'fecha_siembra': cultivo['fecha_siembra'].isoformat() if cultivo.get('fecha_siembra') else None,
-                'fecha_cosecha': cultivo['fecha_cosecha'].isoformat() if cultivo.get('fecha_cosecha') else None,
-                'dias_cultivo': dias_cultivo
-            },
-            'produccion': {
-                'total_kilos': total_kilos_cultivo,
-                'total_unidades': total_unidades_cultivo,
-                'peso_por_unidad': peso_por_unidad,
-                'beneficio_total': beneficio,
-                'produccion_diaria': [
-                    {
-                        'fecha': p['fecha'].isoformat(),
-                        'kilos': p.get('kilos', 0),
-                        'unidades': p.get('unidades', 0),
-                        'peso_unitario': p.get('kilos', 0) / p.get('unidades', 1) if p.get('unidades', 0) > 0 else 0
-                    } for p in cultivo.get('produccion_diaria', [])
-                ]
-            },
-            'mantenimiento': {
-                'total_abonos': len(cultivo.get('abonos', [])),
-                'abonos_detallados': [
-                    {
-                        'fecha': a['fecha'].isoformat() if 'fecha' in a else None,
-                        'descripcion': a.get('descripcion', '')
-                    } for a in cultivo.get('abonos', [])
-                ]
-            },
-            'estadisticas': {
-                'rentabilidad_porcentaje': (beneficio / total_beneficios * 100) if total_beneficios > 0 else 0,
-                'productividad_por_planta': total_kilos_cultivo / cultivo.get('numero_plantas', 1),
-                'beneficio_por_dia': beneficio / dias_cultivo if dias_cultivo and dias_cultivo > 0 else 0
-            }
-        }
-        export_data['cultivos_detallados'].append(cultivo_data)
-    
-    filename = f"huerto_completo_{'demo' if not user else user['uid'][:8]}.json"
+    filename = f"huerto_completo_{'demo' if not user else user['uid'][:8]}.{extension}"
     
-    # Crear respuesta HTTP
-    response = make_response(json.dumps(export_data, indent=2, ensure_ascii=False))
-    response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    response = current_app.response_class(stream_with_context(chunked(partes, STREAM_CHUNK_BYTES)), mimetype=mimetype)
+    response.headers['Content-Type'] = f'{mimetype}; charset=utf-8'
     response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+def _ndjson_documents(resumen, snapshot, produccion_de):
+    """Documentos del export NDJSON: resumen y, por cultivo, el cultivo, sus registros y sus abonos"""
+    yield {'tipo': 'resumen', **resumen}
+    for cultivo in snapshot['cultivos']:
+        cultivo_id = cultivo.get('id')
+        datos = json_crop_data(cultivo, snapshot['metricas'][cultivo_id], None)
+        del datos['produccion']['produccion_diaria']
+        abonos = datos['mantenimiento'].pop('abonos_detallados')
+        yield {'tipo': 'cultivo', 'cultivo_id': cultivo_id, **datos}
+        for registro in produccion_de(cultivo):
+            yield {'tipo': 'produccion', 'cultivo_id': cultivo_id, **registro}
+        for abono in abonos:
+            yield {'tipo': 'abono', 'cultivo_id': cultivo_id, **abono}
+
+@analytics_bp.route('/export/bundle')
+@require_auth
+def export_bundle():
+    """
+    Exportar varios formatos en un ZIP - funciona en modo demo
+    
+    ?formatos=csv,json,excel,pdf (por defecto todos). Los datos se leen una
+    vez y cada formato se genera a la vez en un pool de procesos; el ZIP se
+    envía según terminan (ver ExportService.iter_bundle).
+    """
+    from flask import current_app, request, stream_with_context
     
+    user = get_current_user()
+    formatos = [f.strip() for f in request.args.get('formatos', ','.join(BUNDLE_FORMATS)).split(',') if f.strip()]
+    if not formatos or any(f not in BUNDLE_FORMATS for f in formatos):
+        return jsonify({'success': False, 'error': f"formatos debe ser una lista de {', '.join(BUNDLE_FORMATS)}"}), 400
+    formatos = list(dict.fromkeys(formatos))
+    
+    export_service = ExportService(current_app.db)
+    datos = export_service.bundle_data(user, formatos)
+    partes = export_service.iter_bundle(datos, formatos, STREAM_CHUNK_BYTES,
+                                        timeout=current_app.config.get('EXPORT_BUNDLE_TIMEOUT_SECONDS', 300))
+    
+    response = current_app.response_class(stream_with_context(partes), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename=huerto_exportacion_{user['uid'][:8] if user else 'demo'}.zip"
     return response
 
-@analytics_bp.route('/export/excel')
+@analytics_bp.route('/export/parquet')
 @require_auth
-def export_excel():
-    """Exportar datos a Excel con múltiples hojas - funciona en modo demo"""
-    from flask import current_app
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.chart import BarChart, Reference
+def export_parquet():
+    """
+    Exportar una tabla con tipos en Parquet - funciona en modo demo
+    
+    Parámetro tabla: produccion (por defecto, una fila por registro),
+    cultivos o abonos. Ver arrow_table en export_service.
+    """
+    return _export_columnar('parquet')
+
+@analytics_bp.route('/export/arrow')
+@require_auth
+def export_arrow():
+    """Exportar una tabla con tipos como fichero Arrow IPC (Feather v2) - funciona en modo demo"""
+    return _export_columnar('arrow')
+
+def _export_columnar(formato):
+    """Descargar la tabla pedida (?tabla=) en Parquet o Arrow IPC"""
+    from flask import current_app, request, send_file
     
     user = get_current_user()
-    crop_service = CropService(current_app.db)
+    tabla = request.args.get('tabla', 'produccion')
+    if tabla not in ARROW_TABLES:
+        return jsonify({'success': False, 'error': f"tabla debe ser una de {', '.join(ARROW_TABLES)}"}), 400
     
-    # Obtener datos según si está autenticado o en modo demo
-    if user:
-        cultivos = crop_service.get_user_crops(user['uid'])
-        total_kilos, total_beneficios = crop_service.get_user_totals(user['uid'])
-        filename = f"huerto_analisis_{user['uid'][:8]}.xlsx"
-    else:
-        cultivos = crop_service.get_demo_crops()
-        total_kilos, total_beneficios = crop_service.get_demo_totals()
-        filename = "huerto_demo_analisis.xlsx"
-    
-    # Crear libro Excel
-    wb = Workbook()
-    
-    # === HOJA 1: RESUMEN ===
-    ws1 = wb.active
-    ws1.title = "Resumen General"
-    
-    # Estilo para encabezados
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="198754", end_color="198754", fill_type="solid")
-    
-    # Título principal
-    ws1['A1'] = "🌱 HuertoRentable - Análisis Completo"
-    ws1['A1'].font = Font(bold=True, size=16, color="198754")
-    ws1.merge_cells('A1:D1')
-    
-    # Resumen general
-    ws1['A3'] = "Resumen General"
-    ws1['A3'].font = header_font
-    ws1['A3'].fill = header_fill
-    ws1.merge_cells('A3:B3')
-    
-    ws1['A4'] = "Total Cultivos:"
-    ws1['B4'] = len(cultivos)
-    ws1['A5'] = "Producción Total:"
-    ws1['B5'] = f"{total_kilos:.1f} kg"
-    ws1['A6'] = "Beneficios Totales:"
-    ws1['B6'] = f"{format_spanish_number(total_beneficios, 2)} €"
-    ws1['A7'] = "Fecha Reporte:"
-    ws1['B7'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
-    
-    # === HOJA 2: DETALLE CULTIVOS COMPLETO ===
-    ws2 = wb.create_sheet(title="Detalle Cultivos Completo")
-    
-    # Encabezados expandidos con todos los datos
-    headers = ['Cultivo', 'Estado', 'Fecha Siembra', 'Fecha Cosecha', 'Días Cultivo',
-               'Número Plantas', 'Precio/kg (€)', 'Total Unidades', 'Total Kilos', 
-               'Peso/Unidad (kg)', 'Beneficio Total (€)', 'Total Abonos', 'Rentabilidad (%)']
-    
-    for col, header in enumerate(headers, 1):
-        cell = ws2.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Datos detallados de cultivos
-    for row, cultivo in enumerate(cultivos, 2):
-        # Calcular métricas
-        total_kilos_cultivo = sum(p.get('kilos', 0) for p in cultivo.get('produccion_diaria', []))
-        total_unidades_cultivo = sum(p.get('unidades', 0) for p in cultivo.get('produccion_diaria', []))
-        peso_por_unidad = (total_kilos_cultivo / total_unidades_cultivo) if total_unidades_cultivo > 0 else 0
-        beneficio = total_kilos_cultivo * cultivo.get('precio_por_kilo', 0)
-        rentabilidad = (beneficio / total_beneficios * 100) if total_beneficios > 0 else 0
-        
-        # Calcular días de cultivo
-        dias_cultivo = ""
-        if cultivo.get('fecha_siembra'):
-            fecha_fin = cultivo.get('fecha_cosecha', datetime.datetime.now())
-            try:
-                dias_cultivo = (fecha_fin - cultivo['fecha_siembra']).days
-            except:
-                dias_cultivo = ""
-        
-        # Llenar datos
-        ws2.cell(row=row, column=1, value=cultivo['nombre'])
-        ws2.cell(row=row, column=2, value='Activo' if cultivo.get('activo', True) else 'Finalizado')
-        ws2.cell(row=row, column=3, value=cultivo['fecha_siembra'].strftime('%Y-%m-%d') if cultivo.get('fecha_siembra') else '')
-        ws2.cell(row=row, column=4, value=cultivo['fecha_cosecha'].strftime('%Y-%m-%d') if cultivo.get('fecha_cosecha') else '')
-        ws2.cell(row=row, column=5, value=dias_cultivo)
-        ws2.cell(row=row, column=6, value=cultivo.get('numero_plantas', 1))
-        ws2.cell(row=row, column=7, value=cultivo.get('precio_por_kilo', 0))
-        ws2.cell(row=row, column=8, value=total_unidades_cultivo)
-        ws2.cell(row=row, column=9, value=total_kilos_cultivo)
-        ws2.cell(row=row, column=10, value=peso_por_unidad)
-        ws2.cell(row=row, column=11, value=beneficio)
-        ws2.cell(row=row, column=12, value=len(cultivo.get('abonos', [])))
-        ws2.cell(row=row, column=13, value=rentabilidad)
-    
-    # Ajustar anchos de columna
-    for col in ws2.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 20)
-        ws2.column_dimensions[column].width = adjusted_width
-    
-    # === HOJA 3: PRODUCCIÓN DETALLADA ===
-    if cultivos and any(cultivo.get('produccion_diaria', []) for cultivo in cultivos):
-        ws3 = wb.create_sheet(title="Producción Diaria")
-        
-        ws3['A1'] = "Producción Detallada por Día"
-        ws3['A1'].font = header_font
-        ws3['A1'].fill = header_fill
-        ws3.merge_cells('A1:E1')
-        
-        headers_prod = ['Cultivo', 'Fecha', 'Kilos', 'Unidades', 'Peso/Unidad (kg)']
-        for col, header in enumerate(headers_prod, 1):
-            cell = ws3.cell(row=2, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-        
-        row = 3
-        for cultivo in cultivos:
-            for produccion in cultivo.get('produccion_diaria', []):
-                kilos = produccion.get('kilos', 0)
-                unidades = produccion.get('unidades', 0)
-                peso_unitario = (kilos / unidades) if unidades > 0 else 0
-                
-                ws3.cell(row=row, column=1, value=cultivo['nombre'])
-                ws3.cell(row=row, column=2, value=produccion['fecha'].strftime('%Y-%m-%d'))
-                ws3.cell(row=row, column=3, value=kilos)
-                ws3.cell(row=row, column=4, value=unidades)
-                ws3.cell(row=row, column=5, value=peso_unitario)
-                row += 1
-                
-        # Ajustar anchos de esta hoja también
-        for col in ws3.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 20)
-            ws3.column_dimensions[column].width = adjusted_width
-    
-    # === HOJA 4: HISTORIAL DE ABONOS ===
-    if cultivos and any(cultivo.get('abonos', []) for cultivo in cultivos):
-        ws4 = wb.create_sheet(title="Historial Abonos")
-        
-        ws4['A1'] = "Historial de Abonos y Mantenimiento"
-        ws4['A1'].font = header_font
-        ws4['A1'].fill = header_fill
-        ws4.merge_cells('A1:C1')
-        
-        headers_abonos = ['Cultivo', 'Fecha', 'Descripción']
-        for col, header in enumerate(headers_abonos, 1):
-            cell = ws4.cell(row=2, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-        
-        row = 3
-        for cultivo in cultivos:
-            for abono in cultivo.get('abonos', []):
-                ws4.cell(row=row, column=1, value=cultivo['nombre'])
-                ws4.cell(row=row, column=2, value=abono['fecha'].strftime('%Y-%m-%d') if 'fecha' in abono else '')
-                ws4.cell(row=row, column=3, value=abono.get('descripcion', ''))
-                row += 1
-                
-        # Ajustar anchos
-        for col in ws4.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 30)  # Un poco más ancho para descripciones
-            ws4.column_dimensions[column].width = adjusted_width
-    
-    # Guardar en memoria
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    # Crear respuesta HTTP
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    try:
+        archivo = ExportService(current_app.db).columnar_file(formato, tabla, user)
+    except ImportError:
+        print(f"❌ Exportación {formato} no disponible: falta pyarrow")
+        return jsonify({'success': False, 'error': f'Exportación {formato} no disponible en este servidor'}), 501
+    
+    info = ARROW_FORMATS[formato]
+    nombre = f"huerto_{tabla}_{user['uid'][:8] if user else 'demo'}.{info['extension']}"
+    return send_file(archivo, mimetype=info['mimetype'], as_attachment=True, download_name=nombre)
+
+@analytics_bp.route('/export/excel')
+@require_auth
+def export_excel():
+    """
+    Exportar datos a Excel con múltiples hojas - funciona en modo demo
     
-    return response
+    El libro se genera en modo sólo escritura (ver write_excel); con usuario
+    y Firestore pasa por la cola de trabajos (ver _export_report).
+    """
+    return _export_report('excel')
 
 @analytics_bp.route('/export/pdf')
 @require_auth
 def export_pdf():
-    """Exportar reporte completo a PDF con reportlab - funciona en modo demo"""
+    """
+    Exportar reporte completo a PDF - funciona en modo demo
+    
+    ?motor=reportlab|weasyprint elige el motor (por defecto PDF_ENGINE).
+    """
+    from flask import request
+    
+    try:
+        formato = _report_format('pdf', request.args.get('motor'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return _export_report(formato)
+
+def _report_format(formato, motor):
+    """Formato de informe con el motor pedido o el configurado (ver report_format)"""
     from flask import current_app
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.lib import colors
-    from reportlab.lib.units import inch
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.graphics.shapes import Drawing
-    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    return report_format(formato, motor or current_app.config.get('PDF_ENGINE', 'reportlab'))
+
+def _engine_unavailable(formato):
+    """Respuesta 501 si el formato necesita WeasyPrint y no está instalado"""
+    from app.services.pdf_service import weasyprint_available
+    
+    if formato == 'pdf_weasyprint' and not weasyprint_available():
+        return jsonify({'success': False, 'error': 'Motor PDF weasyprint no disponible en este servidor'}), 501
+    return None
+
+def _export_report(formato):
+    """
+    Descargar un informe Excel o PDF
+    
+    Con usuario y Firestore se pide a la cola de trabajos: si ya existe el
+    fichero de la versión de datos actual se envía sin generar nada, y si
+    hay un trabajo igual en marcha se espera a ese. Si no termina en
+    EXPORT_JOB_WAIT_SECONDS se responde 202 con el trabajo para seguirlo.
+    En modo demo o con datos en sesión (que no salen de la petición) el
+    informe se genera en la propia petición.
+    """
+    from flask import current_app, send_file
+    
+    no_disponible = _engine_unavailable(formato)
+    if no_disponible:
+        return no_disponible
     
     user = get_current_user()
-    crop_service = CropService(current_app.db)
+    if not user or not current_app.db:
+        archivo = ExportService(current_app.db).report_file(formato, user)
+        return send_file(archivo, mimetype=EXPORT_FORMATS[formato]['mimetype'], as_attachment=True,
+                         download_name=export_filename(formato, user))
+    
+    jobs = get_export_jobs()
+    job = jobs.submit(user, formato, CropService(current_app.db).get_data_version(user['uid']))
+    if not jobs.wait_done(job, current_app.config.get('EXPORT_JOB_WAIT_SECONDS', 120)):
+        return jsonify(_job_payload(job)), 202
+    if job.estado != JOB_DONE:
+        return jsonify({'success': False, 'error': job.error}), 500
+    return _send_job_file(job)
+
+def _job_payload(job, estado=None):
+    """Estado de un trabajo de exportación con las URLs para seguirlo y descargarlo"""
+    from flask import url_for
+    
+    return {
+        'success': True,
+        **(estado or job.to_dict()),
+        'url_estado': url_for('analytics.export_job_status', job_id=job.id),
+        'url_eventos': url_for('analytics.export_job_events', job_id=job.id),
+        'url_descarga': url_for('analytics.export_job_download', job_id=job.id)
+    }
+
+def _send_job_file(job):
+    """Enviar el fichero de un trabajo terminado (con ETag y Last-Modified del fichero)"""
+    from flask import send_file
     
-    # Obtener datos según si está autenticado o en modo demo
-    if user:
-        cultivos = crop_service.get_user_crops(user['uid'])
-        total_kilos, total_beneficios = crop_service.get_user_totals(user['uid'])
-        filename = f"huerto_reporte_{user['uid'][:8]}.pdf"
-        titulo_usuario = f"Usuario: {user.get('email', 'Premium')}"
-    else:
-        cultivos = crop_service.get_demo_crops()
-        total_kilos, total_beneficios = crop_service.get_demo_totals()
-        filename = "huerto_demo_reporte.pdf"
-        titulo_usuario = "Modo Demo"
-    
-    # Crear PDF en memoria
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Preparar estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        textColor=colors.HexColor('#198754'),
-        alignment=1  # Center
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=16,
-        spaceAfter=12,
-        textColor=colors.HexColor('#198754')
-    )
-    
-    # Contenido del PDF
-    story = []
-    
-    # Título principal
-    story.append(Paragraph("🌱 HuertoRentable", title_style))
-    story.append(Paragraph("Reporte Completo de Análisis", styles['Heading2']))
-    story.append(Spacer(1, 12))
-    
-    # Información del usuario y fecha
-    story.append(Paragraph(f"<b>{titulo_usuario}</b>", styles['Normal']))
-    story.append(Paragraph(f"Fecha: {datetime.datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
-    story.append(Spacer(1, 20))
-    
-    # Resumen ejecutivo
-    story.append(Paragraph("📊 Resumen Ejecutivo", heading_style))
-    
-    # Tabla de resumen
-    resumen_data = [
-        ['Métrica', 'Valor'],
-        ['Total de Cultivos', str(len(cultivos))],
-        ['Producción Total', f"{total_kilos:.1f} kg"],
-        ['Beneficios Totales', f"{format_spanish_number(total_beneficios, 2)} €"],
-        ['Beneficio Promedio', f"{format_spanish_number((total_beneficios/len(cultivos) if cultivos else 0), 2)} € por cultivo"]
-    ]
-    
-    resumen_table = Table(resumen_data, colWidths=[3*inch, 2*inch])
-    resumen_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#198754')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    story.append(resumen_table)
-    story.append(Spacer(1, 20))
-    
-    # Detalle de cultivos
-    if cultivos:
-        story.append(Paragraph("🌱 Detalle de Cultivos", heading_style))
-        
-        # Tabla de cultivos
-        cultivos_data = [['Cultivo', 'Fecha Siembra', 'Plantas', 'Precio/kg', 'Kilos', 'Beneficio', 'Estado']]
-        
-        for cultivo in cultivos:
-            cultivos_data.append([
-                cultivo['nombre'],
-                cultivo['fecha_siembra'].strftime('%d/%m/%Y'),
-                str(cultivo.get('plantas_sembradas', 0)),
-                f"{format_spanish_number(cultivo.get('precio_por_kilo', 0), 2)} €",
-                f"{cultivo.get('kilos_totales', 0):.1f} kg",
-                f"{format_spanish_number(cultivo.get('beneficio_total', 0), 2)} €",
-                'Activo' if cultivo.get('activo', True) else 'Cosechado'
-            ])
-        
-        cultivos_table = Table(cultivos_data, colWidths=[0.8*inch, 0.8*inch, 0.6*inch, 0.7*inch, 0.7*inch, 0.8*inch, 0.7*inch])
-        cultivos_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#198754')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
-        ]))
-        
-        story.append(cultivos_table)
-        story.append(Spacer(1, 20))
-        
-        # Análisis de rentabilidad
-        story.append(Paragraph("💹 Análisis de Rentabilidad", heading_style))
-        
-        if cultivos:
-            cultivo_top = max(cultivos, key=lambda x: x.get('beneficio_total', 0))
-            story.append(Paragraph(f"<b>🏆 Cultivo Más Rentable:</b> {cultivo_top['nombre']}", styles['Normal']))
-            story.append(Paragraph(f"Beneficio: {format_spanish_number(cultivo_top.get('beneficio_total', 0), 2)} €", styles['Normal']))
-            story.append(Paragraph(f"Producción: {cultivo_top.get('kilos_totales', 0):.1f} kg", styles['Normal']))
-            story.append(Spacer(1, 12))
-            
-            activos = len([c for c in cultivos if c.get('activo', True)])
-            cosechados = len(cultivos) - activos
-            story.append(Paragraph(f"<b>📊 Estadísticas:</b>", styles['Normal']))
-            story.append(Paragraph(f"• Cultivos activos: {activos}", styles['Normal']))
-            story.append(Paragraph(f"• Cultivos cosechados: {cosechados}", styles['Normal']))
-            if total_kilos > 0:
-                story.append(Paragraph(f"• Rentabilidad: {format_spanish_number((total_beneficios/total_kilos), 2)} €/kg", styles['Normal']))
-    else:
-        story.append(Paragraph("No hay cultivos registrados", styles['Normal']))
+    response = send_file(job.ruta, mimetype=EXPORT_FORMATS[job.formato]['mimetype'], as_attachment=True,
+                         download_name=export_filename(job.formato, job.user), conditional=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _get_export_job(job_id):
+    """Trabajo del usuario actual, o None si no existe o es de otro usuario"""
+    from flask import current_app
     
-    # Pie de página
-    story.append(Spacer(1, 30))
-    story.append(Paragraph("🌱 <b>HuertoRentable</b> - Gestión inteligente de huertos rentables", styles['Normal']))
-    story.append(Paragraph(f"Reporte generado el {datetime.datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
+    user_uid = get_current_user_uid()
+    if not user_uid or not current_app.db:
+        return None
+    return get_export_jobs().get(job_id, user_uid)
+
+@analytics_bp.route('/export/jobs', methods=['POST'])
+@require_auth
+def export_job_submit():
+    """
+    Encolar la exportación de un informe y devolver el trabajo al momento
     
-    # Generar PDF
-    doc.build(story)
-    buffer.seek(0)
+    Acepta {"formato": "excel" | "pdf", "motor": "reportlab" | "weasyprint"}
+    (JSON o formulario; el motor sólo para PDF). Responde 202
+    con el trabajo en cola, o 200 si el fichero de la versión actual ya
+    existe. Dos peticiones iguales seguidas reciben el mismo trabajo.
+    """
+    from flask import current_app, request
     
-    # Crear respuesta HTTP
-    response = make_response(buffer.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    user = get_current_user()
+    if not user or not current_app.db:
+        return jsonify({'success': False, 'error': 'Exportación en segundo plano no disponible en modo demo o local'}), 400
     
+    datos = request.get_json(silent=True) or request.form
+    try:
+        formato = _report_format(datos.get('formato', ''), datos.get('motor'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if formato not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': "formato debe ser uno de excel, pdf"}), 400
+    no_disponible = _engine_unavailable(formato)
+    if no_disponible:
+        return no_disponible
+    
+    job = get_export_jobs().submit(user, formato, CropService(current_app.db).get_data_version(user['uid']))
+    return jsonify(_job_payload(job)), 200 if job.estado == JOB_DONE else 202
+
+@analytics_bp.route('/export/jobs/<job_id>')
+@require_auth
+def export_job_status(job_id):
+    """Estado y progreso de un trabajo de exportación (para consultar periódicamente)"""
+    job = _get_export_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    response = jsonify(_job_payload(job))
+    response.headers['Cache-Control'] = 'no-store'
     return response
+
+@analytics_bp.route('/export/jobs/<job_id>/events')
+@require_auth
+def export_job_events(job_id):
+    """
+    Progreso de un trabajo de exportación como Server-Sent Events
+    
+    Envía un evento 'progreso' por cada cambio y termina con 'completado'
+    (con la URL de descarga) o 'fallo' (no 'error', que EventSource reserva
+    para errores de conexión). Sin cambios, cada EXPORT_SSE_KEEPALIVE
+    segundos se envía un comentario para mantener viva la conexión.
+    """
+    from flask import current_app
     
+    job = _get_export_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    jobs = get_export_jobs()
+    limite = current_app.config.get('EXPORT_JOB_WAIT_SECONDS', 120)
+    # Las URLs se calculan aquí, dentro de la petición
+    urls = {k: v for k, v in _job_payload(job).items() if k.startswith('url_')}
+    
+    def eventos():
+        cambios = -1
+        inicio = datetime.datetime.now()
+        while (datetime.datetime.now() - inicio).total_seconds() < limite:
+            estado = jobs.wait(job, cambios, timeout=EXPORT_SSE_KEEPALIVE)
+            if estado['cambios'] == cambios and not job.terminal:
+                yield ": keepalive\n\n"
+                continue
+            cambios = estado.pop('cambios')
+            evento = {JOB_DONE: 'completado', JOB_FAILED: 'fallo'}.get(estado['estado'], 'progreso')
+            yield f"event: {evento}\ndata: {json.dumps({**urls, **estado})}\n\n"
+            if evento != 'progreso':
+                return
+    
+    response = current_app.response_class(eventos(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Sin búfer en proxies nginx
     return response
+
+@analytics_bp.route('/export/jobs/<job_id>/download')
+@require_auth
+def export_job_download(job_id):
+    """Descargar el fichero de un trabajo de exportación terminado"""
+    job = _get_export_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    if job.estado != JOB_DONE:
+        return jsonify(_job_payload(job)), 409
+    return _send_job_file(job)
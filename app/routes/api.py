@@ -4,7 +4,9 @@ Endpoints RESTful para interacción con frontend con autenticación Firebase
 """
 from flask import Blueprint, request, jsonify
 from app.middleware.auth_middleware import require_auth, get_current_user, get_current_user_uid, optional_auth
-from app.services.crop_service import CropService
+from app.services.crop_service import CropService, PRODUCTION_BATCH_MAX_RECORDS, CROPS_PAGE_SIZE, HISTORY_PAGE_SIZE
+from app.services.analytics_service import parse_iso_epoch
+from app.utils.http_cache import conditional_json
 
 api_bp = Blueprint('api', __name__)
 
@@ -31,25 +33,56 @@ def status():
         }
     })
 
+@api_bp.route('/cache/stats')
+@require_auth
+def cache_stats():
+    """Contadores de las cachés de cultivos y de tokens de esta instancia (para dimensionarlas)"""
+    from flask import current_app
+    from app.auth.auth_service import AuthService
+    # Son datos de todo el proceso: sólo en modo debug o para administradores
+    if not current_app.debug and get_current_user_uid() not in current_app.config.get('ADMIN_UIDS', []):
+        return jsonify({'success': False, 'error': 'Acceso restringido a administradores'}), 403
+    return jsonify({
+        'success': True,
+        'crop_cache': CropService.get_cache_stats(),
+        'auth_token_cache': AuthService.get_token_cache_stats()
+    })
+
 @api_bp.route('/crops', methods=['GET'])
 @optional_auth
+@conditional_json
 def get_crops():
-    """Obtener cultivos del usuario - SEGURO (modo demo disponible)"""
+    """
+    Obtener cultivos del usuario - SEGURO (modo demo disponible)
+    
+    Paginado: ?limit=N&cursor=... con el 'next_cursor' de la respuesta
+    anterior. Los cultivos llevan sus agregados; el historial de producción
+    se pide aparte en GET /api/crops/<crop_id>/production.
+    """
     from flask import current_app
     
     user = get_current_user()
     user_uid = get_current_user_uid()
     crop_service = CropService(current_app.db)
+    limit = request.args.get('limit', CROPS_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor') or None
     
-    if user_uid:
-        cultivos = crop_service.get_user_crops(user_uid)
-    else:
-        cultivos = crop_service.get_demo_crops()
+    try:
+        if user_uid:
+            pagina = crop_service.get_user_crops_page(user_uid, limit=limit, cursor=cursor)
+            cultivos, siguiente = pagina['cultivos'], pagina['siguiente']
+        else:
+            cultivos, siguiente = crop_service.paginate_list(
+                crop_service.get_demo_crops(), 'fecha_siembra', max(1, limit), cursor
+            )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     return jsonify({
         'success': True,
         'crops': cultivos,
-        'count': len(cultivos)
+        'count': len(cultivos),
+        'next_cursor': siguiente
     })
 
 @api_bp.route('/crops', methods=['POST'])
@@ -90,12 +123,115 @@ def update_production(crop_id):
     
     if kilos <= 0:
         return jsonify({'error': 'Kilos debe ser positivo'}), 400
+    # Fecha opcional (ISO 8601) para registros atrasados
+    try:
+        fecha = crop_service.parse_production_date(data.get('fecha'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    if crop_service.update_production(user_uid, crop_id, kilos):
+    if crop_service.update_production(user_uid, crop_id, kilos, fecha=fecha):
         return jsonify({'success': True, 'message': 'Producción actualizada'})
     else:
         return jsonify({'error': 'Error actualizando producción'}), 400
 
+@api_bp.route('/crops/<crop_id>/production', methods=['GET'])
+@require_auth
+@conditional_json
+def get_production(crop_id):
+    """
+    Historial de producción de un cultivo, paginado del más reciente al más antiguo
+    
+    Parámetros ?limit=N&cursor=... con el 'next_cursor' de la respuesta anterior.
+    """
+    from flask import current_app
+    
+    user_uid = get_current_user_uid()
+    crop_service = CropService(current_app.db)
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor') or None
+    
+    cultivo = crop_service.get_crop(user_uid, crop_id, include_production=False)
+    if not cultivo:
+        return jsonify({'success': False, 'error': 'Cultivo no encontrado'}), 404
+    try:
+        pagina = crop_service.get_crop_productions_page(user_uid, crop_id, limit=limit, cursor=cursor, cultivo=cultivo)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'registros': pagina['registros'],
+        'count': len(pagina['registros']),
+        'next_cursor': pagina['siguiente']
+    })
+
+@api_bp.route('/crops/<crop_id>/production/range', methods=['GET'])
+@require_auth
+@conditional_json
+def get_production_range(crop_id):
+    """
+    Totales de producción de un cultivo entre dos fechas
+    
+    Parámetros ?from=...&to=... en ISO 8601, ambos opcionales; 'to' se
+    excluye, salvo que sea una fecha sin hora, que incluye el día entero.
+    Se responde con búsqueda binaria sobre el índice de rangos del cultivo.
+    """
+    from flask import current_app
+    
+    user_uid = get_current_user_uid()
+    crop_service = CropService(current_app.db)
+    try:
+        desde = parse_iso_epoch(request.args.get('from'))
+        hasta = parse_iso_epoch(request.args.get('to'), fin_de_dia=True)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    indice = crop_service.get_production_index(user_uid, crop_id)
+    if indice is None:
+        return jsonify({'success': False, 'error': 'Cultivo no encontrado'}), 404
+    
+    return jsonify({
+        'success': True,
+        'cultivo_id': crop_id,
+        'from': request.args.get('from'),
+        'to': request.args.get('to'),
+        **indice.range_totals(desde, hasta)
+    })
+
+@api_bp.route('/production/batch', methods=['POST'])
+@require_auth
+def production_batch():
+    """
+    Registrar muchas producciones en una sola petición - REQUIERE AUTENTICACIÓN SEGURA
+    
+    Acepta {"registros": [{crop_id, kilos, unidades, fecha}, ...]} (o la lista
+    directamente) y devuelve el resultado de cada registro en el mismo orden.
+    Lo usa la sincronización de datos pendientes (huerto_pending_sync).
+    """
+    from flask import current_app
+    
+    user_uid = get_current_user_uid()
+    crop_service = CropService(current_app.db)
+    
+    data = request.get_json(silent=True)
+    registros = data.get('registros') if isinstance(data, dict) else data
+    if not isinstance(registros, list) or not registros:
+        return jsonify({'success': False, 'error': 'Se requiere una lista de registros'}), 400
+    if len(registros) > PRODUCTION_BATCH_MAX_RECORDS:
+        return jsonify({
+            'success': False,
+            'error': f'Máximo {PRODUCTION_BATCH_MAX_RECORDS} registros por petición'
+        }), 400
+    
+    resultados = crop_service.add_productions_batch(user_uid, registros)
+    guardados = sum(1 for r in resultados if r['success'])
+    return jsonify({
+        'success': guardados == len(resultados),
+        'guardados': guardados,
+        'errores': len(resultados) - guardados,
+        'resultados': resultados
+    })
+
 @api_bp.route('/crops/update-color', methods=['POST'])
 @require_auth
 def update_crop_color():
@@ -117,11 +253,8 @@ def update_crop_color():
             return jsonify({'success': False, 'error': 'cultivo_id y color requeridos'}), 400
         
         if current_app.db:
-            crop_ref = current_app.db.collection('usuarios').document(user_uid).collection('cultivos').document(cultivo_id)
-            crop_ref.update({
-                'color_cultivo': color,
-                'actualizado_en': __import__('datetime').datetime.utcnow()
-            })
+            if not CropService(current_app.db).update_crop(user_uid, cultivo_id, {'color_cultivo': color}):
+                return jsonify({'success': False, 'error': 'No se pudo actualizar el color'}), 500
             return jsonify({'success': True, 'color': color})
         else:
             return jsonify({'success': False, 'error': 'Base de datos no disponible'}), 500
@@ -131,6 +264,7 @@ def update_crop_color():
 
 @api_bp.route('/user/totals')
 @optional_auth
+@conditional_json
 def user_totals():
     """Obtener totales del usuario - SEGURO (modo demo disponible)"""
     from flask import current_app
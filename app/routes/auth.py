@@ -527,6 +527,9 @@ def logout():
     """Cerrar sesión"""
     print("🔓 [Logout] Cerrando sesión del usuario")
     
+    # Olvidar el token verificado de la cookie para que no reconstruya la sesión
+    AuthService.forget_firebase_token(request.cookies.get('firebase_id_token'))
+    
     # Limpiar sesión Flask
     session.clear()
     
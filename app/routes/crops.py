@@ -2,10 +2,13 @@
 Rutas de gestión de cultivos - SEGURAS
 CRUD de cultivos con verificación de autenticación Firebase real
 """
+import itertools
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
 from app.middleware.auth_middleware import require_auth, get_current_user, get_current_user_uid, optional_auth
-from app.services.crop_service import CropService
+from app.services.crop_service import CropService, HISTORY_PAGE_SIZE
+from app.services.analytics_service import build_records_series, cached_series, parse_series_args
 from app.utils.helpers import get_plan_limits
+from app.utils.http_cache import conditional_json
 
 crops_bp = Blueprint('crops', __name__)
 
@@ -23,12 +26,16 @@ def list_crops():
     
     if demo_mode:
         # Modo demo: cultivos de ejemplo
-        cultivos = crop_service.get_demo_crops()
+        cultivos = crop_service.get_demo_snapshot()['cultivos']
         return render_template('crops.html', cultivos=cultivos, demo_mode=True, user_uid=None)
     else:
-        # Usuario autenticado: usar get_user_crops (incluye búsqueda en Firebase)
-        cultivos = crop_service.get_user_crops(user_uid)
-        return render_template('crops.html', cultivos=cultivos, demo_mode=False, user_uid=user_uid)
+        # Usuario autenticado: página de cultivos con sus agregados (?cursor= para las siguientes)
+        try:
+            pagina = crop_service.get_user_crops_page(user_uid, cursor=request.args.get('cursor') or None)
+        except ValueError:
+            return redirect(url_for('crops.list_crops'))
+        return render_template('crops.html', cultivos=pagina['cultivos'], demo_mode=False, user_uid=user_uid,
+                               siguiente_cursor=pagina['siguiente'], pagina_inicial=not request.args.get('cursor'))
 
 @crops_bp.route('/create', methods=['GET', 'POST'])
 @require_auth
@@ -109,10 +116,12 @@ def update_production(crop_id):
     # Obtener kilos y unidades desde form o JSON
     kilos_raw = request.form.get('kilos')
     unidades_raw = request.form.get('unidades')
+    fecha_raw = request.form.get('fecha')
     if request.is_json:
         body = request.get_json(silent=True) or {}
         kilos_raw = body.get('kilos', kilos_raw)
         unidades_raw = body.get('unidades', unidades_raw)
+        fecha_raw = body.get('fecha', fecha_raw)
 
     kilos = None
     unidades = None
@@ -131,7 +140,14 @@ def update_production(crop_id):
         flash('Indica kilos o unidades válidos (> 0)', 'error')
         return redirect(url_for('main.dashboard'))
 
-    ok = crop_service.update_production_generic(user_uid, crop_id, kilos=kilos, unidades=unidades)
+    # Fecha opcional para registros atrasados
+    try:
+        fecha = crop_service.parse_production_date(fecha_raw)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    ok = crop_service.update_production_generic(user_uid, crop_id, kilos=kilos, unidades=unidades, fecha=fecha)
     if ok:
         flash('Producción registrada', 'success')
     else:
@@ -139,6 +155,67 @@ def update_production(crop_id):
 
     return redirect(url_for('main.dashboard'))
 
+@crops_bp.route('/import', methods=['POST'])
+@require_auth
+def import_productions():
+    """
+    Importar historial de producción desde un CSV o Excel - SEGURO
+    
+    Acepta el fichero en 'archivo' con las columnas de las exportaciones
+    (Cultivo, Fecha, Hora opcional, Kilos y/o Unidades) y, opcionalmente,
+    'crop_id' para asignar todas las filas a un cultivo. El fichero se lee
+    en streaming y se escribe por lotes (ver ImportService.import_rows).
+    Con Accept: application/x-ndjson (o ?progreso=1) la respuesta es una
+    línea JSON por lote escrito y el resumen al final; con Accept:
+    application/json, sólo el resumen; desde el formulario, un aviso y
+    vuelta a la lista de cultivos.
+    """
+    from flask import current_app, stream_with_context
+    from app.services.import_service import ImportService
+    
+    user_uid = get_current_user_uid()
+    aceptado = request.headers.get('Accept', '')
+    progreso = request.args.get('progreso') == '1' or 'application/x-ndjson' in aceptado
+    como_json = progreso or 'application/json' in aceptado
+    
+    archivo = request.files.get('archivo')
+    try:
+        if not archivo or not archivo.filename:
+            raise ValueError('Selecciona un fichero .csv o .xlsx')
+        import_service = ImportService(current_app.db)
+        columnas, filas = import_service.read_rows(archivo.stream, archivo.filename)
+        avisos = import_service.import_rows(user_uid, columnas, filas, crop_id=request.form.get('crop_id') or None)
+        primero = next(avisos)
+    except ValueError as e:
+        if como_json:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('crops.list_crops'))
+    
+    avisos = itertools.chain([primero], avisos)
+    if progreso:
+        import json
+        if not current_app.db:
+            # Con datos en sesión hay que terminar antes de responder: la
+            # sesión se guarda con las cabeceras
+            avisos = list(avisos)
+        lineas = (json.dumps(aviso, ensure_ascii=False) + '\n' for aviso in avisos)
+        return current_app.response_class(stream_with_context(lineas), mimetype='application/x-ndjson')
+    
+    for resumen in avisos:
+        pass
+    if como_json:
+        return jsonify({'success': True, **resumen})
+    
+    mensaje = f"Importados {resumen['importados']} registros"
+    if resumen['duplicados']:
+        mensaje += f", {resumen['duplicados']} repetidos omitidos"
+    if resumen['errores']:
+        primeros = '; '.join(f"fila {e['fila']}: {e['error']}" for e in resumen['detalle_errores'][:3])
+        mensaje += f", {resumen['errores']} filas con errores ({primeros})"
+    flash(mensaje, 'warning' if resumen['errores'] else 'success')
+    return redirect(url_for('crops.list_crops'))
+
 @crops_bp.route('/<crop_id>/production/undo', methods=['POST'])
 @require_auth
 def undo_last_production(crop_id):
@@ -285,6 +362,7 @@ def finish_crop(crop_id):
     return redirect(url_for('crops.list_crops'))
 
 @crops_bp.route('/api/user-crops')
+@conditional_json
 def api_user_crops():
     """API para obtener cultivos del usuario (modo demo disponible)"""
     from flask import current_app
@@ -294,19 +372,19 @@ def api_user_crops():
     crop_service = CropService(current_app.db)
     
     if user and user_uid:
-        cultivos = crop_service.get_user_crops(user_uid)
+        snapshot = crop_service.get_user_snapshot(user_uid, include_production=False, projection='chart')
     else:
-        cultivos = crop_service.get_demo_crops()
+        snapshot = crop_service.get_demo_snapshot()
     
     # Serializar cultivos para JSON
     cultivos_json = []
-    for cultivo in cultivos:
+    for cultivo in snapshot['cultivos']:
         cultivo_data = {
             'id': cultivo['id'],
             'nombre': cultivo['nombre'],
             'precio_por_kilo': cultivo['precio_por_kilo'],
             'activo': cultivo['activo'],
-            'total_kilos': sum(p.get('kilos', 0) for p in cultivo.get('produccion_diaria', []))
+            'total_kilos': snapshot['metricas'][cultivo['id']]['total_kilos']
         }
         cultivos_json.append(cultivo_data)
     
@@ -315,7 +393,12 @@ def api_user_crops():
 @crops_bp.route('/<crop_id>/history')
 @require_auth
 def crop_history(crop_id):
-    """Vista de historial completo de un cultivo con gráfica y lista de registros."""
+    """
+    Vista de historial de un cultivo con gráfica y lista de registros.
+    
+    Muestra la página más reciente; con ?format=json&cursor=... devuelve las
+    filas de la página siguiente (más antigua) para cargarlas bajo demanda.
+    """
     from flask import current_app, session
     crop_service = CropService(current_app.db)
 
@@ -343,38 +426,115 @@ def crop_history(crop_id):
                 if demo_crop.get('id') == crop_id:
                     cultivo = demo_crop
                     break
-        elif current_app.db:
-            doc_ref = current_app.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
-            doc = doc_ref.get()
-            if doc.exists:
-                cultivo = doc.to_dict()
-                cultivo['id'] = doc.id
-                # Normalizar fechas como hace el servicio
-                try:
-                    cultivo = crop_service._process_cultivo_dates(cultivo)  # noqa: SLF001 uso intencional
-                except Exception:
-                    pass
         else:
-            # Local: desde sesión
-            cultivos = session.get(f'crops_{user_uid}', [])
-            for c in cultivos:
-                if c.get('id') == crop_id:
-                    cultivo = c
-                    break
+            # Firestore o sesión local; el historial se lee por páginas
+            cultivo = crop_service.get_crop(user_uid, crop_id, include_production=False)
     except Exception as e:
         print('Error obteniendo historial de cultivo:', e)
 
     if not cultivo:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'error': 'Cultivo no encontrado'}), 404
         flash('Cultivo no encontrado o sin acceso.', 'error')
         return redirect(url_for('main.dashboard', uid=user_uid))
 
-    # Preparar datos para la gráfica y listado: fechas vs unidades y filas formateadas
-    registros_raw = sorted((cultivo.get('produccion_diaria') or []), key=lambda r: r.get('fecha') or 0)
-    labels: list[str] = []
-    unidades: list[int] = []
-    kilos_list: list[float] = []
+    # Página de registros, del más reciente al más antiguo (?cursor= para las anteriores)
+    cursor = request.args.get('cursor') or None
+    try:
+        if demo_mode:
+            registros = cultivo.get('produccion_diaria') or []
+            for indice, registro in enumerate(registros):
+                registro.setdefault('id', f'demo-{indice}')
+            registros, siguiente = crop_service.paginate_list(registros, 'fecha', HISTORY_PAGE_SIZE, cursor)
+        else:
+            pagina = crop_service.get_crop_productions_page(user_uid, crop_id, cursor=cursor, cultivo=cultivo)
+            registros, siguiente = pagina['registros'], pagina['siguiente']
+    except ValueError as e:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'error': str(e)}), 400
+        return redirect(url_for('crops.crop_history', crop_id=crop_id))
+    
+    registros_view = _format_history_rows(registros)
+    
+    if request.args.get('format') == 'json':
+        # Páginas anteriores que pide la vista al pulsar "Cargar registros anteriores"
+        return jsonify({'success': True, 'registros': registros_view, 'next_cursor': siguiente})
+    
+    # Gráfica: historial completo reducido en el servidor (unidades, puntos por defecto)
+    chart_data = _history_series(crop_service, user_uid, crop_id, cultivo, demo_mode,
+                                 parse_series_args({'campo': 'unidades'}))
+    
+    return render_template(
+        'crop_history.html',
+        cultivo=cultivo,
+        chart_data=chart_data,
+        registros_view=registros_view,
+        siguiente_cursor=siguiente,
+        uid=user_uid
+    )
+
+@crops_bp.route('/<crop_id>/history/series')
+@require_auth
+@conditional_json
+def crop_history_series(crop_id):
+    """
+    Serie reducida del historial de producción de un cultivo para gráficas
+    
+    Query: desde/hasta (ISO 8601), puntos (máximo SERIES_MAX_POINTS),
+    metodo (lttb o minmax) y campo (kilos o unidades) con el que se eligen
+    los puntos. Además de la serie devuelve el resumen del rango y el de los
+    registros omitidos.
+    """
+    from flask import current_app, session
+    crop_service = CropService(current_app.db)
+    
+    demo_mode = request.args.get('demo') == 'true' or session.get('demo_mode_chosen', False)
+    user_uid = get_current_user_uid()
+    if demo_mode and not user_uid:
+        user_uid = 'demo-user'
+    if not user_uid:
+        return jsonify({'success': False, 'error': 'Usuario no autenticado'}), 401
+    
+    try:
+        opciones = parse_series_args(request.args)
+        if demo_mode:
+            cultivo = next((c for c in crop_service.get_demo_crops() if c.get('id') == crop_id), None)
+        else:
+            cultivo = crop_service.get_crop(user_uid, crop_id, include_production=False)
+        if not cultivo:
+            return jsonify({'success': False, 'error': 'Cultivo no encontrado'}), 404
+        serie = _history_series(crop_service, user_uid, crop_id, cultivo, demo_mode, opciones)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ Error obteniendo serie del cultivo {crop_id}: {e}")
+        return jsonify({'success': False, 'error': 'Error obteniendo la serie'}), 500
+    
+    return jsonify({'success': True, **serie})
+
+def _history_series(crop_service, user_uid, crop_id, cultivo, demo_mode, opciones):
+    """
+    Serie reducida del historial de un cultivo, cacheada por versión de datos
+    
+    La clave de caché incluye la versión de datos del usuario, así que un
+    registro nuevo produce otra clave sin invalidar nada. Los cultivos demo
+    se generan en cada petición y no se cachean.
+    """
+    if demo_mode:
+        return build_records_series(cultivo.get('produccion_diaria') or [], opciones)
+    
+    def construir():
+        registros = crop_service.get_crop_productions(user_uid, crop_id, cultivo=cultivo)
+        return build_records_series(registros, opciones)
+    
+    clave = (user_uid, 'historial', crop_id, tuple(sorted(opciones.items())),
+             crop_service.get_data_version(user_uid))
+    return cached_series(clave, construir)
+
+def _format_history_rows(registros):
+    """Filas del historial con fecha y hora legibles, en el mismo orden que 'registros'"""
     registros_view = []
-    for r in registros_raw:
+    for r in registros:
         fecha = r.get('fecha')
         try:
             if hasattr(fecha, 'to_datetime') and callable(getattr(fecha, 'to_datetime')):
@@ -390,32 +550,14 @@ def crop_history(crop_id):
             etiqueta = str(fecha)
             fecha_str = etiqueta
             hora_str = ''
-        labels.append(etiqueta)
-        unidades_val = int(r.get('unidades', 0) or 0)
-        unidades.append(unidades_val)
-        kilos_val = float(r.get('kilos', 0) or 0)
-        kilos_list.append(kilos_val)
         registros_view.append({
+            'etiqueta': etiqueta,
             'fecha_str': fecha_str,
             'hora_str': hora_str,
-            'unidades': unidades_val,
-            'kilos': kilos_val
+            'unidades': int(r.get('unidades', 0) or 0),
+            'kilos': float(r.get('kilos', 0) or 0)
         })
-
-    # Construir objeto chart_data al estilo analytics para robustez en front
-    chart_data = {
-        'labels': labels,
-        'unidades': unidades,
-        'kilos': kilos_list,
-    }
-
-    return render_template(
-        'crop_history.html',
-        cultivo=cultivo,
-        chart_data=chart_data,
-        registros_view=registros_view,
-        uid=user_uid
-    )
+    return registros_view
 
 # Endpoints básicos de edición y borrado (POST para simplicidad)
 @crops_bp.route('/<crop_id>/edit', methods=['POST'])
@@ -439,16 +581,15 @@ def edit_crop(crop_id):
             flash('Datos inválidos', 'error')
             return redirect(url_for('crops.list_crops'))
         # Actualizar en Firestore
-        if current_app.db:
-            crop_ref = current_app.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
-            crop_ref.update({
-                'nombre': nombre.strip(),
-                'precio_por_kilo': precio,
-                'numero_plantas': numero_plantas,
-                'peso_promedio': peso_promedio,
-                'color_cultivo': color_cultivo,
-                'actualizado_en': __import__('datetime').datetime.utcnow()
-            })
+        if current_app.db and not crop_service.update_crop(user_uid, crop_id, {
+            'nombre': nombre.strip(),
+            'precio_por_kilo': precio,
+            'numero_plantas': numero_plantas,
+            'peso_promedio': peso_promedio,
+            'color_cultivo': color_cultivo
+        }):
+            flash('Error editando cultivo', 'error')
+            return redirect(url_for('crops.list_crops'))
         flash('Cultivo actualizado', 'success')
     except Exception as e:
         print('Error editando cultivo:', e)
@@ -471,11 +612,8 @@ def update_crop_color(crop_id):
             return jsonify({'success': False, 'error': 'Color requerido'}), 400
         
         if current_app.db:
-            crop_ref = current_app.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
-            crop_ref.update({
-                'color_cultivo': color,
-                'actualizado_en': __import__('datetime').datetime.utcnow()
-            })
+            if not CropService(current_app.db).update_crop(user_uid, crop_id, {'color_cultivo': color}):
+                return jsonify({'success': False, 'error': 'No se pudo actualizar el color'}), 500
             return jsonify({'success': True, 'color': color})
         else:
             return jsonify({'success': False, 'error': 'Base de datos no disponible'}), 500
@@ -493,12 +631,9 @@ def delete_crop(crop_id):
         return redirect(url_for('auth.login', next=url_for('crops.list_crops')))
     from flask import current_app
     try:
-        if current_app.db:
-            crop_ref = current_app.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
-            crop_ref.update({
-                'activo': False,
-                'actualizado_en': __import__('datetime').datetime.utcnow()
-            })
+        if current_app.db and not CropService(current_app.db).delete_crop(user_uid, crop_id):
+            flash('Error eliminando cultivo', 'error')
+            return redirect(url_for('crops.list_crops'))
         flash('Cultivo eliminado', 'success')
     except Exception as e:
         print('Error eliminando cultivo:', e)
@@ -467,71 +467,34 @@ def dashboard():
     crop_service = CropService(current_app.db)
     
     try:
-        # 1. Obtener cultivos del usuario
-        crops = crop_service.get_user_crops(user_uid)
-        
-        # 2. Calcular métricas para cada cultivo y añadir campos calculados
-        total_kilos = 0
-        total_beneficios = 0
+        # 1. Cabeceras de cultivos con sus agregados (sin historial de producción)
+        snapshot = crop_service.get_user_snapshot(user_uid, include_production=False)
+        crops = snapshot['cultivos']
+        total_kilos = snapshot['total_kilos']
+        total_beneficios = snapshot['total_beneficios']
         
+        # 2. Añadir campos de compatibilidad para la plantilla
         for crop in crops:
-            produccion = crop.get('produccion_diaria', [])
-            kilos_cultivo = sum(p.get('kilos', 0) for p in produccion)
-            unidades_cultivo = sum(p.get('unidades', 0) for p in produccion)
-            precio = crop.get('precio_por_kilo', 0)
-            beneficio_cultivo = kilos_cultivo * precio
-            
-            # Añadir campos calculados al cultivo
-            crop['kilos_totales'] = kilos_cultivo
-            crop['unidades_recolectadas'] = unidades_cultivo
-            crop['beneficio_total'] = beneficio_cultivo
+            crop['unidades_recolectadas'] = snapshot['metricas'][crop.get('id')]['total_unidades']
             
             # Asegurar compatibilidad de campos (problemas de naming)
             if 'numero_plantas' in crop and 'plantas_sembradas' not in crop:
                 crop['plantas_sembradas'] = crop['numero_plantas']
             if 'precio' in crop and 'precio_por_kilo' not in crop:
                 crop['precio_por_kilo'] = crop['precio']
-            
-            total_kilos += kilos_cultivo
-            total_beneficios += beneficio_cultivo
         
         # 3. Clasificar cultivos
         active_crops = [c for c in crops if not c.get('fecha_cosecha')]
         finished_crops = [c for c in crops if c.get('fecha_cosecha')]
         
-        # 4. Últimas producciones (últimos 7 días)
-        import datetime
-        
-        recent_productions = []
-        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=7)
-        
-        for crop in crops:
-            for prod in crop.get('produccion_diaria', []):
-                try:
-                    prod_date = prod.get('fecha')
-                    if isinstance(prod_date, str):
-                        # Intentar parsear fecha ISO
-                        try:
-                            prod_date = datetime.datetime.fromisoformat(prod_date.replace('Z', '+00:00'))
-                        except:
-                            continue
-                    elif hasattr(prod_date, 'to_dict'):  # Firestore Timestamp
-                        prod_date = prod_date.to_dict()
-                        prod_date = datetime.datetime.fromtimestamp(prod_date['seconds'])
-                        
-                    if prod_date and prod_date.replace(tzinfo=None) >= cutoff_date:
-                        recent_productions.append({
-                            'crop_name': crop.get('nombre', 'Sin nombre'),
-                            'kilos': prod.get('kilos', 0),
-                            'fecha': prod_date,
-                            'precio': crop.get('precio_por_kilo', 0)
-                        })
-                except:
-                    continue
-        
-        # Ordenar por fecha descendente
-        recent_productions.sort(key=lambda x: x['fecha'], reverse=True)
-        recent_productions = recent_productions[:10]  # Últimas 10
+        # 4. Últimas producciones desde el resumen de estadísticas (una sola lectura)
+        stats = crop_service.stats.get_summary(user_uid)
+        recent_productions = [{
+            'crop_name': entrada['nombre'],
+            'kilos': entrada.get('kilos', 0),
+            'fecha': entrada['fecha'],
+            'precio': entrada['precio_por_kilo']
+        } for entrada in stats['ultimas_producciones']]
         
         # 5. Configuración del plan
         user_plan = user.get('plan', 'gratuito')
@@ -564,6 +527,7 @@ def dashboard():
             total_beneficios=round(total_beneficios, 2),
             total_revenue=round(total_beneficios, 2),  # alias
             recent_productions=recent_productions,
+            stats=stats,
 
             # Configuración de plan (nombres nuevos y alias)
             plan_config=plan_config,
@@ -0,0 +1,466 @@
+"""
+Motor de analytics por columnas
+Historial de producción en columnas NumPy para calcular totales, buckets y rankings
+"""
+import datetime
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from app.services.cache_service import TTLCache
+
+SEGUNDOS_DIA = 86400
+
+# 1970-01-01 fue jueves: desplazamiento (en días) para semanas que empiezan en lunes
+DESFASE_LUNES = 3
+
+# Series reducidas para gráficas: puntos por defecto y máximos, y métodos
+SERIES_DEFAULT_POINTS = 300
+SERIES_MAX_POINTS = 2000
+SERIES_METHODS = ('lttb', 'minmax')
+
+# Caché de series reducidas del proceso (la clave incluye la versión de datos)
+_series_cache = None
+
+class AnalyticsEngine:
+    """
+    Columnas de producción de una lista de cultivos
+
+    El historial se recorre una sola vez al construir el motor y queda en
+    columnas (fecha en epoch, índice de cultivo, kilos, unidades y precio);
+    los registros de cada cultivo son contiguos (ver registros_de). Las
+    métricas por cultivo, los buckets por mes o semana y el ranking se
+    calculan después con operaciones vectorizadas sobre esas columnas.
+
+    Los cultivos con agregados guardados ('num_registros') usan esos totales;
+    el historial sólo se suma para los que no los tienen (sesión, demo o
+    cultivos antiguos).
+    """
+
+    def __init__(self, cultivos: List[Dict]):
+        from app.services.crop_service import CropService
+
+        self.cultivos = cultivos
+        n = len(cultivos)
+        self.precio = np.array([float(c.get('precio_por_kilo', 0) or 0) for c in cultivos], dtype=np.float64)
+        con_agregados = np.array(['num_registros' in c for c in cultivos], dtype=bool)
+
+        # Una pasada por el historial: columnas por registro
+        fechas, kilos, unidades, cantidades = [], [], [], []
+        for cultivo in cultivos:
+            registros = cultivo.get('produccion_diaria') or []
+            cantidades.append(len(registros))
+            for registro in registros:
+                epoch = CropService._to_epoch(registro.get('fecha'))
+                fechas.append(np.nan if epoch is None else epoch)
+                kilos.append(float(registro.get('kilos', 0) or 0))
+                unidades.append(int(registro.get('unidades', 0) or 0))
+
+        self.fecha = np.array(fechas, dtype=np.float64)
+        self.kilos_registro = np.array(kilos, dtype=np.float64)
+        self.unidades_registro = np.array(unidades, dtype=np.int64)
+        self.cultivo = np.repeat(np.arange(n, dtype=np.int64), cantidades)
+        self.precio_registro = self.precio[self.cultivo]
+        # Registros del cultivo i: inicio[i]:inicio[i + 1]
+        self.inicio = np.concatenate(([0], np.cumsum(cantidades, dtype=np.int64)))
+
+        # Totales por cultivo: agregados guardados o suma del historial
+        kilos_historial = np.bincount(self.cultivo, weights=self.kilos_registro, minlength=n)
+        unidades_historial = np.bincount(self.cultivo, weights=self.unidades_registro, minlength=n)
+        kilos_agregados = np.array([float(c.get('kilos_totales') or 0) for c in cultivos], dtype=np.float64)
+        unidades_agregadas = np.array([int(c.get('unidades_totales') or 0) for c in cultivos], dtype=np.int64)
+        self.kilos = np.where(con_agregados, kilos_agregados, kilos_historial)
+        self.unidades = np.where(con_agregados, unidades_agregadas, np.rint(unidades_historial)).astype(np.int64)
+
+        self.beneficio = self.kilos * self.precio
+        self.peso_por_unidad = np.divide(self.kilos, self.unidades, out=np.zeros(n), where=self.unidades > 0)
+        self.total_kilos = float(self.kilos.sum())
+        self.total_beneficios = float(self.beneficio.sum())
+        self.rentabilidad = (self.beneficio / self.total_beneficios * 100) if self.total_beneficios > 0 else np.zeros(n)
+        # Orden estable: a igual beneficio se mantiene el orden de carga
+        self.orden_ranking = np.argsort(-self.beneficio, kind='stable')
+
+    def crop_metrics(self, indice: int) -> Dict:
+        """
+        Métricas de producción del cultivo en la posición 'indice'
+
+        Returns:
+            Dict: total_kilos, total_unidades, peso_por_unidad, precio_por_kilo,
+                  beneficio y rentabilidad (% sobre el beneficio total)
+        """
+        return {
+            'total_kilos': float(self.kilos[indice]),
+            'total_unidades': int(self.unidades[indice]),
+            'peso_por_unidad': float(self.peso_por_unidad[indice]),
+            'precio_por_kilo': self.cultivos[indice].get('precio_por_kilo', 0),
+            'beneficio': float(self.beneficio[indice]),
+            'rentabilidad': float(self.rentabilidad[indice])
+        }
+
+    def ranking(self) -> List[Dict]:
+        """Cultivos ordenados de mayor a menor beneficio"""
+        return [self.cultivos[i] for i in self.orden_ranking]
+
+    def registros_de(self, indice: int) -> slice:
+        """Rango de las columnas por registro que corresponde a un cultivo"""
+        return slice(int(self.inicio[indice]), int(self.inicio[indice + 1]))
+
+    def peso_unitario(self) -> np.ndarray:
+        """Kilos por unidad de cada registro (0 en los registros sin unidades)"""
+        return np.divide(self.kilos_registro, self.unidades_registro,
+                         out=np.zeros(len(self.kilos_registro)), where=self.unidades_registro > 0)
+
+    def monthly(self) -> Dict[str, Dict]:
+        """
+        Kilos y beneficio por mes (UTC)
+
+        Returns:
+            Dict[str, Dict]: {'AAAA-MM': {'kilos', 'beneficio'}} en orden cronológico
+        """
+        validos = ~np.isnan(self.fecha)
+        meses = self.fecha[validos].astype('datetime64[s]').astype('datetime64[M]')
+        return self._agrupar(meses, validos, 'M')
+
+    def weekly(self) -> Dict[str, Dict]:
+        """
+        Kilos y beneficio por semana (de lunes a domingo, UTC)
+
+        Returns:
+            Dict[str, Dict]: {'AAAA-MM-DD' (lunes): {'kilos', 'beneficio'}} en orden cronológico
+        """
+        validos = ~np.isnan(self.fecha)
+        dias = np.floor(self.fecha[validos] / SEGUNDOS_DIA).astype(np.int64)
+        lunes = ((dias + DESFASE_LUNES) // 7) * 7 - DESFASE_LUNES
+        return self._agrupar(lunes.astype('datetime64[D]'), validos, 'D')
+
+    def _agrupar(self, claves: np.ndarray, validos: np.ndarray, unidad: str) -> Dict[str, Dict]:
+        """Sumar kilos y beneficio de los registros válidos agrupando por 'claves'"""
+        if not len(claves):
+            return {}
+        unicas, grupo = np.unique(claves, return_inverse=True)
+        kilos = self.kilos_registro[validos]
+        kilos_grupo = np.bincount(grupo, weights=kilos, minlength=len(unicas))
+        beneficio_grupo = np.bincount(grupo, weights=kilos * self.precio_registro[validos], minlength=len(unicas))
+        etiquetas = np.datetime_as_string(unicas, unit=unidad)
+        return {
+            str(etiqueta): {'kilos': float(k), 'beneficio': float(b)}
+            for etiqueta, k, b in zip(etiquetas, kilos_grupo, beneficio_grupo)
+        }
+
+
+class ProductionIndex:
+    """
+    Registros de producción de un cultivo ordenados por fecha, con sumas acumuladas
+
+    kilos_acumulados[i] y unidades_acumuladas[i] son los totales de los i
+    primeros registros, así los totales entre dos fechas salen de dos
+    búsquedas binarias y una resta: O(log n) sin recorrer el historial. El
+    beneficio es kilos * precio_por_kilo, como en los agregados del cultivo.
+
+    La versión es la versión de datos del usuario de la que sale el índice;
+    CropService.get_production_index lo reconstruye si ya no coincide.
+    """
+
+    def __init__(self, registros: List[Dict], precio_por_kilo: float = 0, version: Optional[int] = None):
+        from app.services.crop_service import CropService
+
+        epochs = [CropService._to_epoch(registro.get('fecha')) for registro in registros]
+        validos = [i for i, epoch in enumerate(epochs) if epoch is not None]
+        fechas = np.array([epochs[i] for i in validos], dtype=np.float64)
+        kilos = np.array([float(registros[i].get('kilos', 0) or 0) for i in validos], dtype=np.float64)
+        unidades = np.array([int(registros[i].get('unidades', 0) or 0) for i in validos], dtype=np.int64)
+        orden = np.argsort(fechas, kind='stable')
+
+        self.fechas = fechas[orden]
+        self.kilos_acumulados = np.concatenate(([0.0], np.cumsum(kilos[orden])))
+        self.unidades_acumuladas = np.concatenate(([0], np.cumsum(unidades[orden]))).astype(np.int64)
+        self.precio = float(precio_por_kilo or 0)
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.fechas)
+
+    def insert(self, registro: Dict, version: Optional[int] = None) -> 'ProductionIndex':
+        """
+        Índice nuevo con un registro más, colocado en su posición por fecha
+
+        Un registro atrasado se inserta tras los de su misma fecha y sólo se
+        suman sus kilos y unidades a las sumas acumuladas posteriores, sin
+        reordenar el historial. El índice original no cambia (puede estar en
+        uso en otra petición).
+        """
+        from app.services.crop_service import CropService
+
+        epoch = CropService._to_epoch(registro.get('fecha'))
+        nuevo = object.__new__(ProductionIndex)
+        nuevo.precio = self.precio
+        nuevo.version = version
+        if epoch is None:
+            nuevo.fechas = self.fechas
+            nuevo.kilos_acumulados = self.kilos_acumulados
+            nuevo.unidades_acumuladas = self.unidades_acumuladas
+            return nuevo
+        posicion = int(np.searchsorted(self.fechas, epoch, side='right'))
+        kilos = float(registro.get('kilos', 0) or 0)
+        unidades = int(registro.get('unidades', 0) or 0)
+        nuevo.fechas = np.insert(self.fechas, posicion, epoch)
+        nuevo.kilos_acumulados = np.concatenate((self.kilos_acumulados[:posicion + 1],
+                                                 self.kilos_acumulados[posicion:] + kilos))
+        nuevo.unidades_acumuladas = np.concatenate((self.unidades_acumuladas[:posicion + 1],
+                                                    self.unidades_acumuladas[posicion:] + unidades))
+        return nuevo
+
+    def range_totals(self, desde: Optional[float] = None, hasta: Optional[float] = None) -> Dict:
+        """
+        Totales de los registros con desde <= fecha < hasta
+
+        Args:
+            desde (Optional[float]): Epoch inicial incluido (None: desde el primero)
+            hasta (Optional[float]): Epoch final excluido (None: hasta el último)
+
+        Returns:
+            Dict: 'registros', 'kilos', 'unidades', 'beneficio' y las fechas
+                  ISO del primer y último registro del rango ('primero', 'ultimo')
+        """
+        inicio = int(np.searchsorted(self.fechas, desde, side='left')) if desde is not None else 0
+        fin = int(np.searchsorted(self.fechas, hasta, side='left')) if hasta is not None else len(self.fechas)
+        fin = max(inicio, fin)
+        kilos = round(float(self.kilos_acumulados[fin] - self.kilos_acumulados[inicio]), 6)
+
+        def fecha_iso(posicion):
+            return datetime.datetime.fromtimestamp(self.fechas[posicion], tz=datetime.timezone.utc).isoformat()
+
+        return {
+            'registros': fin - inicio,
+            'kilos': kilos,
+            'unidades': int(self.unidades_acumuladas[fin] - self.unidades_acumuladas[inicio]),
+            'beneficio': round(kilos * self.precio, 6),
+            'primero': fecha_iso(inicio) if fin > inicio else None,
+            'ultimo': fecha_iso(fin - 1) if fin > inicio else None
+        }
+
+def get_series_cache() -> TTLCache:
+    """Obtener (creando si hace falta) la caché de series reducidas e índices de rango del proceso"""
+    global _series_cache
+    if _series_cache is None:
+        from flask import current_app, has_app_context
+        app_config = current_app.config if has_app_context() else {}
+        _series_cache = TTLCache(
+            max_size=app_config.get('SERIES_CACHE_MAX_ENTRIES', 1000),
+            ttl_seconds=app_config.get('SERIES_CACHE_TTL_SECONDS', 600)
+        )
+    return _series_cache
+
+def cached_series(clave, construir: Callable[[], Dict]) -> Dict:
+    """
+    Serie reducida desde la caché o construida y guardada
+
+    La clave debe incluir la versión de datos del usuario: una escritura
+    cambia la versión y las series anteriores dejan de pedirse.
+    """
+    cache = get_series_cache()
+    encontrada, serie = cache.get(clave)
+    if not encontrada:
+        serie = construir()
+        cache.set(clave, serie)
+    return serie
+
+def parse_iso_epoch(valor: Optional[str], fin_de_dia: bool = False) -> Optional[float]:
+    """
+    Epoch (segundos) de una fecha ISO 8601 de la query string
+
+    Args:
+        valor (Optional[str]): Fecha; sin zona se toma como UTC
+        fin_de_dia (bool): Para límites superiores: una fecha sin hora
+            incluye el día entero (devuelve la medianoche siguiente)
+
+    Returns:
+        Optional[float]: Segundos desde epoch, o None si no se indica
+
+    Raises:
+        ValueError: Si la fecha no es ISO 8601
+    """
+    if not valor:
+        return None
+    try:
+        fecha = datetime.datetime.fromisoformat(valor.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Fecha no válida (ISO 8601): {valor}")
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=datetime.timezone.utc)
+    if fin_de_dia and len(valor) == 10:
+        fecha += datetime.timedelta(days=1)
+    return fecha.timestamp()
+
+def parse_series_args(args) -> Dict:
+    """
+    Leer los parámetros de una serie reducida de la query string
+
+    Args:
+        args: request.args con desde/hasta (ISO 8601; una fecha sin hora en
+            'hasta' incluye el día entero), puntos, metodo y campo
+
+    Returns:
+        Dict: desde y hasta (epoch o None), puntos, metodo y campo
+
+    Raises:
+        ValueError: Si algún parámetro no es válido
+    """
+    try:
+        puntos = int(args.get('puntos', SERIES_DEFAULT_POINTS))
+    except (TypeError, ValueError):
+        raise ValueError('puntos debe ser un número entero')
+    metodo = args.get('metodo', 'lttb')
+    if metodo not in SERIES_METHODS:
+        raise ValueError(f"metodo debe ser uno de {', '.join(SERIES_METHODS)}")
+    return {
+        'desde': parse_iso_epoch(args.get('desde')),
+        'hasta': parse_iso_epoch(args.get('hasta'), fin_de_dia=True),
+        'puntos': max(3, min(puntos, SERIES_MAX_POINTS)),
+        'metodo': metodo,
+        'campo': args.get('campo', 'kilos')
+    }
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, puntos: int) -> np.ndarray:
+    """
+    Índices de los puntos elegidos por Largest-Triangle-Three-Buckets
+
+    Conserva el primero y el último; de cada bucket intermedio elige el punto
+    que forma el triángulo de mayor área con el elegido antes y con la media
+    del bucket siguiente, así se mantienen los picos y la forma de la curva.
+    """
+    n = len(x)
+    if puntos >= n:
+        return np.arange(n)
+    # puntos - 2 buckets entre el primer y el último punto
+    bordes = np.linspace(1, n - 1, puntos - 1).astype(np.int64)
+    indices = np.empty(puntos, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    elegido = 0
+    for i in range(puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        siguiente_inicio, siguiente_fin = (bordes[i + 1], bordes[i + 2]) if i + 2 < len(bordes) else (n - 1, n)
+        media_x = x[siguiente_inicio:siguiente_fin].mean()
+        media_y = y[siguiente_inicio:siguiente_fin].mean()
+        areas = np.abs((x[elegido] - media_x) * (y[inicio:fin] - y[elegido])
+                       - (x[elegido] - x[inicio:fin]) * (media_y - y[elegido]))
+        elegido = inicio + int(np.argmax(areas))
+        indices[i + 1] = elegido
+    return indices
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, puntos: int) -> np.ndarray:
+    """
+    Índices del mínimo y el máximo de cada intervalo de tiempo
+
+    Divide el rango en puntos / 2 intervalos iguales de tiempo (no de
+    registros) y conserva los extremos de cada uno, además del primer y el
+    último punto. Los intervalos sin registros no aportan puntos.
+    """
+    n = len(x)
+    if puntos >= n:
+        return np.arange(n)
+    intervalos = max(1, (puntos - 2) // 2)
+    bordes = np.searchsorted(x, np.linspace(x[0], x[-1], intervalos + 1)[1:-1])
+    elegidos = {0, n - 1}
+    for tramo_x, inicio in zip(np.split(np.arange(n), bordes), np.concatenate(([0], bordes))):
+        if not len(tramo_x):
+            continue
+        tramo = y[tramo_x]
+        elegidos.add(int(inicio + np.argmin(tramo)))
+        elegidos.add(int(inicio + np.argmax(tramo)))
+    return np.array(sorted(elegidos), dtype=np.int64)
+
+def build_series(fechas: np.ndarray, columnas: Dict[str, np.ndarray], opciones: Dict,
+                 etiquetas: Optional[List[str]] = None, formato: str = '%Y-%m-%d %H:%M') -> Dict:
+    """
+    Serie reducida de un rango de tiempo con el resumen de lo omitido
+
+    Args:
+        fechas (np.ndarray): Epoch (segundos) de cada punto, en orden ascendente
+        columnas (Dict[str, np.ndarray]): Valores de cada punto ('kilos', ...)
+        opciones (Dict): desde, hasta, puntos, metodo y campo (parse_series_args)
+        etiquetas (Optional[List[str]]): Etiqueta de cada punto; por defecto
+            la fecha UTC con 'formato'
+        formato (str): Formato de las etiquetas generadas
+
+    Returns:
+        Dict: 'labels', una lista por columna, 'total', 'devueltos',
+              'resumen' del rango completo y 'omitido' (puntos descartados)
+
+    Raises:
+        ValueError: Si 'campo' no es una de las columnas
+    """
+    campo = opciones['campo']
+    if campo not in columnas:
+        raise ValueError(f"campo debe ser uno de {', '.join(columnas)}")
+    fechas = np.asarray(fechas, dtype=np.float64)
+    rango = np.ones(len(fechas), dtype=bool)
+    if opciones.get('desde') is not None:
+        rango &= fechas >= opciones['desde']
+    if opciones.get('hasta') is not None:
+        rango &= fechas < opciones['hasta']
+    x = fechas[rango]
+    valores = {nombre: np.asarray(columna, dtype=np.float64)[rango] for nombre, columna in columnas.items()}
+    if etiquetas is not None:
+        etiquetas = [e for e, dentro in zip(etiquetas, rango) if dentro]
+
+    y = valores[campo]
+    if opciones['metodo'] == 'minmax':
+        indices = minmax_indices(x, y, opciones['puntos'])
+    else:
+        indices = lttb_indices(x, y, opciones['puntos'])
+    omitidos = np.ones(len(x), dtype=bool)
+    omitidos[indices] = False
+
+    def fecha_iso(epoch):
+        return datetime.datetime.fromtimestamp(epoch, tz=datetime.timezone.utc).isoformat()
+
+    def estadisticas(mascara):
+        datos = {'puntos': int(mascara.sum())}
+        for nombre, columna in valores.items():
+            datos[nombre] = float(columna[mascara].sum())
+        if datos['puntos']:
+            datos[f'{campo}_min'] = float(y[mascara].min())
+            datos[f'{campo}_max'] = float(y[mascara].max())
+            datos[f'{campo}_media'] = float(y[mascara].mean())
+            datos['desde'] = fecha_iso(x[mascara][0])
+            datos['hasta'] = fecha_iso(x[mascara][-1])
+        return datos
+
+    if etiquetas is None:
+        etiquetas_serie = [datetime.datetime.fromtimestamp(t, tz=datetime.timezone.utc).strftime(formato) for t in x[indices]]
+    else:
+        etiquetas_serie = [etiquetas[i] for i in indices]
+    serie = {
+        'metodo': opciones['metodo'],
+        'campo': campo,
+        'total': int(len(x)),
+        'devueltos': int(len(indices)),
+        'labels': etiquetas_serie,
+        'resumen': estadisticas(np.ones(len(x), dtype=bool)),
+        'omitido': estadisticas(omitidos)
+    }
+    for nombre, columna in valores.items():
+        serie[nombre] = columna[indices].tolist()
+    return serie
+
+def build_records_series(registros: List[Dict], opciones: Dict) -> Dict:
+    """
+    Serie reducida de los registros de producción de un cultivo
+
+    Args:
+        registros (List[Dict]): Registros con fecha, kilos y unidades (en
+            cualquier orden; los que no tienen fecha válida se ignoran)
+        opciones (Dict): Parámetros de parse_series_args
+
+    Returns:
+        Dict: Serie de build_series con 'kilos' y 'unidades'
+    """
+    from app.services.crop_service import CropService
+
+    epochs = [CropService._to_epoch(registro.get('fecha')) for registro in registros]
+    fechas = np.array([np.nan if epoch is None else epoch for epoch in epochs], dtype=np.float64)
+    kilos = np.array([float(registro.get('kilos', 0) or 0) for registro in registros], dtype=np.float64)
+    unidades = np.array([int(registro.get('unidades', 0) or 0) for registro in registros], dtype=np.float64)
+    validos = np.flatnonzero(~np.isnan(fechas))
+    orden = validos[np.argsort(fechas[validos], kind='stable')]
+    return build_series(fechas[orden], {'kilos': kilos[orden], 'unidades': unidades[orden]}, opciones)
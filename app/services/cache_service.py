@@ -0,0 +1,109 @@
+"""
+Servicio de caché en memoria de proceso
+LRU con caducidad (TTL) y contadores para dimensionarla por instancia
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+class TTLCache:
+    """
+    Caché LRU acotada por tamaño y por tiempo de vida, segura entre hilos
+
+    Por defecto guarda y devuelve copias; con copy_values=False comparte
+    los objetos (sólo para valores que nadie modifica, como gráficas ya
+    construidas).
+    """
+    
+    def __init__(self, max_size: int = 500, ttl_seconds: float = 300, copy_values: bool = True):
+        self.max_size = max(1, int(max_size))
+        self.ttl_seconds = float(ttl_seconds)
+        self.copy_values = copy_values
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Obtener un valor de la caché
+
+        Args:
+            key (Hashable): Clave buscada
+
+        Returns:
+            Tuple[bool, Any]: (encontrado, copia del valor)
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+        # Copia para que el llamador pueda modificar el resultado sin tocar la caché
+        return True, copy.deepcopy(value) if self.copy_values else value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: float = None) -> None:
+        """
+        Guardar un valor, expulsando el menos usado si se supera el tamaño
+        
+        Args:
+            key (Hashable): Clave
+            value (Any): Valor a guardar
+            ttl_seconds (float): Vida de esta entrada si es menor que la de la caché
+        """
+        if self.copy_values:
+            value = copy.deepcopy(value)
+        vida = self.ttl_seconds if ttl_seconds is None else min(float(ttl_seconds), self.ttl_seconds)
+        with self._lock:
+            self._data[key] = (time.monotonic() + vida, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """Eliminar una clave tras una escritura"""
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """Vaciar la caché manteniendo los contadores"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        """
+        Contadores de uso de la caché
+
+        Returns:
+            Dict: Aciertos, fallos, expulsiones, tamaño y ratio de aciertos
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
@@ -2,48 +2,947 @@
 Servicio de gestión de cultivos
 CRUD de cultivos con soporte multi-usuario y planes
 """
+import bisect
 import datetime
-from typing import List, Dict, Optional, Tuple
+import math
+from typing import Any, Iterator, List, Dict, Optional, Tuple
+from firebase_admin import firestore
+from app.services.analytics_service import ProductionIndex, get_series_cache
+from app.services.cache_service import TTLCache
+from app.services.stats_service import StatsService
+from app.services.rollup_service import RollupService
+
+# Máximo de operaciones por WriteBatch (Firestore admite 500)
+BATCH_MAX_OPS = 450
+
+# Máximo de registros aceptados en una ingesta por lotes
+PRODUCTION_BATCH_MAX_RECORDS = 1000
+
+# Proyecciones de campos (Firestore select()) para las consultas de cultivos:
+# cada vista pide sólo lo que muestra. None lee el documento completo.
+CROP_PROJECTIONS = {
+    # Sólo el ID del documento (contar cultivos)
+    'ids': [],
+    # Nombre, color, precio y agregados para gráficas y listados JSON
+    # (fecha_siembra mantiene el mismo orden que el listado completo)
+    'chart': [
+        'nombre', 'color_cultivo', 'precio_por_kilo', 'activo', 'fecha_siembra',
+        'kilos_totales', 'unidades_totales', 'num_registros'
+    ],
+    # Cabecera del cultivo sin el array heredado produccion_diaria; incluye
+    # abonos porque el listado y los informes muestran cuántos hay
+    'summary': [
+        'nombre', 'color_cultivo', 'precio_por_kilo', 'activo',
+        'kilos_totales', 'unidades_totales', 'num_registros',
+        'primer_registro', 'ultimo_registro', 'producciones_migradas',
+        'fecha_siembra', 'fecha_cosecha', 'numero_plantas', 'plantas_sembradas',
+        'peso_promedio_gramos', 'peso_promedio', 'abonos', 'creado_en', 'actualizado_en'
+    ],
+    'full': None,
+}
+
+# Tamaño por defecto y máximo de las páginas de cultivos e historial
+CROPS_PAGE_SIZE = 50
+HISTORY_PAGE_SIZE = 100
+PAGE_MAX_SIZE = 500
+
+# Origen de los cursores de paginación (fechas en microsegundos)
+EPOCH_UTC = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Caché de cultivos compartida por todas las peticiones del proceso
+_crops_cache = None
+
+def get_crops_cache() -> TTLCache:
+    """Obtener (creando si hace falta) la caché de cultivos del proceso"""
+    global _crops_cache
+    if _crops_cache is None:
+        from flask import current_app, has_app_context
+        app_config = current_app.config if has_app_context() else {}
+        # Sin copia profunda: CropService copia sólo el primer nivel (ver _cache_copy)
+        _crops_cache = TTLCache(
+            max_size=app_config.get('CROP_CACHE_MAX_USERS', 500),
+            ttl_seconds=app_config.get('CROP_CACHE_TTL_SECONDS', 300),
+            copy_values=False
+        )
+    return _crops_cache
+
+# Cultivos que ya tienen agregados (num_registros), vistos por este proceso.
+# Un cultivo no los pierde nunca, así que sus producciones en kilos se
+# escriben a ciegas; del resto se lee num_registros en la transacción.
+AGGREGATED_CROPS_MAX_ENTRIES = 20000
+_aggregated_crops = None
+
+def get_aggregated_crops() -> TTLCache:
+    """Obtener (creando si hace falta) el registro de cultivos con agregados del proceso"""
+    global _aggregated_crops
+    if _aggregated_crops is None:
+        _aggregated_crops = TTLCache(max_size=AGGREGATED_CROPS_MAX_ENTRIES, ttl_seconds=86400, copy_values=False)
+    return _aggregated_crops
 
 class CropService:
     """Servicio centralizado para gestión de cultivos"""
     
     def __init__(self, db):
         self.db = db
+        self.stats = StatsService(db)
+        self.rollups = RollupService(db)
     
-    def get_user_crops(self, user_uid: str) -> List[Dict]:
+    def get_user_crops(self, user_uid: str, include_production: bool = True, projection: str = 'full') -> List[Dict]:
         """
         Obtener todos los cultivos de un usuario
         
+        Dentro de una petición se reutiliza la instantánea cargada por
+        get_user_snapshot, de modo que Firestore se consulta una sola vez.
+        
+        Args:
+            user_uid (str): UID del usuario
+            include_production (bool): Adjuntar los registros de producción
+                (subcolección producciones) en 'produccion_diaria'
+            projection (str): Preset de CROP_PROJECTIONS con los campos a
+                leer ('ids', 'chart', 'summary' o 'full'). Con un preset
+                distinto de 'full' nunca se adjunta la producción.
+        
+        Returns:
+            List[Dict]: Lista de cultivos del usuario (vacía si es usuario nuevo)
+        """
+        if include_production and projection == 'full':
+            return self.get_user_snapshot(user_uid)['cultivos']
+        
+        from flask import g, has_app_context
+        if has_app_context():
+            for key, snapshot in g.get('crop_snapshots', {}).items():
+                if self._snapshot_covers(key, user_uid, projection):
+                    return snapshot['cultivos']
+        return self._load_user_crops(user_uid, projection)
+    
+    def get_user_snapshot(self, user_uid: str, include_production: bool = True, projection: str = 'summary') -> Dict:
+        """
+        Obtener la instantánea de cultivos del usuario para la petición actual
+        
+        Los cultivos se cargan una única vez por petición y se guardan en
+        flask.g junto con sus métricas, totales y ranking, para que las vistas
+        de analytics y exportación no repitan la consulta a Firestore.
+        
+        Args:
+            user_uid (str): UID del usuario
+            include_production (bool): Cargar también los registros de
+                producción. Sin ellos las métricas salen de los agregados
+                guardados en cada cultivo (vistas de listado y resumen).
+            projection (str): Preset de CROP_PROJECTIONS cuando no se carga
+                la producción ('chart' o 'summary')
+        
+        Returns:
+            Dict: Instantánea con 'cultivos', 'metricas', 'total_kilos',
+                  'total_beneficios' y 'ranking'
+        """
+        from flask import g, has_app_context
+        
+        if include_production:
+            projection = 'full'
+            loader = self._load_user_crops_with_production
+        else:
+            loader = lambda uid: self._load_user_crops_summary(uid, projection)
+        if not has_app_context():
+            return self.build_snapshot(loader(user_uid))
+        
+        snapshots = g.setdefault('crop_snapshots', {})
+        # Una instantánea con más campos (o la completa) también sirve
+        for key, snapshot in snapshots.items():
+            if self._snapshot_covers(key, user_uid, projection):
+                return snapshot
+        key = user_uid if include_production else (user_uid, projection)
+        snapshots[key] = self.build_snapshot(loader(user_uid))
+        return snapshots[key]
+    
+    @staticmethod
+    def _snapshot_covers(key, user_uid: str, projection: str) -> bool:
+        """Indicar si la instantánea guardada con 'key' tiene los campos de 'projection'"""
+        if key == user_uid:
+            # Instantánea completa, con producción
+            return True
+        if not isinstance(key, tuple) or key[0] != user_uid:
+            return False
+        campos = CROP_PROJECTIONS[key[1]]
+        pedidos = CROP_PROJECTIONS[projection]
+        if campos is None:
+            return True
+        return pedidos is not None and set(pedidos) <= set(campos)
+    
+    def invalidate_user_crops(self, user_uid: str) -> None:
+        """
+        Descartar los cultivos cacheados de un usuario tras una escritura
+        
+        Limpia tanto la instantánea de la petición como la caché de proceso
+        (documentos completos, cada proyección y registros de producción).
+        
+        Args:
+            user_uid (str): UID del usuario
+        """
+        from flask import g, has_app_context, has_request_context, session
+        
+        if has_app_context():
+            snapshots = g.setdefault('crop_snapshots', {})
+            for key in [k for k in snapshots if k == user_uid or (isinstance(k, tuple) and k[0] == user_uid)]:
+                snapshots.pop(key)
+        cache = get_crops_cache()
+        cache.invalidate(user_uid)
+        for projection in CROP_PROJECTIONS:
+            cache.invalidate((user_uid, projection))
+        cache.invalidate((user_uid, 'producciones'))
+        if has_app_context():
+            g.setdefault('data_versions', {}).pop(user_uid, None)
+        if not self.db and has_request_context():
+            # Sesión: la versión de datos se guarda junto a los cultivos
+            session_key = f'version_datos_{user_uid}'
+            session[session_key] = session.get(session_key, 0) + 1
+    
+    def get_data_version(self, user_uid: str) -> int:
+        """
+        Versión de los datos del usuario (crece con cada escritura)
+        
+        Cada escritura de CropService incrementa 'version_datos' en el
+        documento del usuario dentro de su mismo commit, así que dos lecturas
+        con la misma versión devuelven los mismos cultivos. Las rutas JSON la
+        usan para sus ETag (ver app/utils/http_cache.py) y las series
+        reducidas para su clave de caché; dentro de una petición se lee una
+        sola vez.
+        
+        Args:
+            user_uid (str): UID del usuario
+            
+        Returns:
+            int: Versión actual (0 si nunca se ha escrito)
+        """
+        from flask import g, has_app_context
+        
+        versiones = g.setdefault('data_versions', {}) if has_app_context() else {}
+        if user_uid in versiones:
+            return versiones[user_uid]
+        if not self.db:
+            from flask import session
+            version = session.get(f'version_datos_{user_uid}', 0)
+        else:
+            doc = self.db.collection('usuarios').document(user_uid).get(field_paths=['version_datos'])
+            version = int((doc.to_dict() or {}).get('version_datos', 0) or 0) if doc.exists else 0
+        versiones[user_uid] = version
+        return version
+    
+    def _bump_data_version(self, writer, user_uid: str) -> None:
+        """Añadir a un lote o transacción el incremento de la versión de datos del usuario"""
+        writer.set(self.db.collection('usuarios').document(user_uid),
+                   {'version_datos': firestore.Increment(1)}, merge=True)
+    
+    def _update_crop_doc(self, user_uid: str, crop_ref, cambios: Dict) -> None:
+        """Actualizar un cultivo y la versión de datos del usuario en un commit"""
+        batch = self.db.batch()
+        batch.update(crop_ref, cambios)
+        self._bump_data_version(batch, user_uid)
+        batch.commit()
+    
+    def _cache_version(self, user_uid: str) -> Optional[int]:
+        """Versión de datos con la que etiquetar la caché de cultivos (None si no se puede leer)"""
+        try:
+            return self.get_data_version(user_uid)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer la versión de datos de {user_uid}: {e}")
+            return None
+    
+    def _cache_get(self, key, version: Optional[int]) -> Tuple[bool, Any]:
+        """
+        Leer una entrada de la caché de cultivos si es de la versión de datos actual
+        
+        Cada entrada se guarda junto a la versión con la que se leyó. Otro
+        proceso puede haber escrito después sin invalidar esta caché, así
+        que una entrada de otra versión cuenta como fallo y nunca se sirve
+        bajo la ETag de la versión nueva.
+        
+        Args:
+            key: Clave de la caché (uid, (uid, proyección) o (uid, 'producciones'))
+            version (Optional[int]): Versión actual (_cache_version)
+            
+        Returns:
+            Tuple[bool, Any]: (encontrado, valor)
+        """
+        if version is None:
+            return False, None
+        found, entrada = get_crops_cache().get(key)
+        if not found or entrada[0] != version:
+            return False, None
+        return True, self._cache_copy(entrada[1])
+    
+    def _cache_set(self, key, version: Optional[int], valor) -> None:
+        """Guardar en la caché de cultivos un valor leído con la versión de datos dada"""
+        if version is not None:
+            get_crops_cache().set(key, (version, self._cache_copy(valor)))
+    
+    @staticmethod
+    def _cache_copy(valor):
+        """
+        Copia de primer nivel de un valor de la caché de cultivos
+        
+        Las vistas y los servicios añaden o sustituyen claves de cada cultivo
+        (produccion_diaria, métricas...) y reordenan o filtran las listas,
+        pero no modifican los registros ni los abonos de los cultivos
+        cacheados (las escrituras releen el documento). Basta con copiar cada
+        cultivo y cada lista en lugar de copiar en profundidad todo el
+        historial en cada acierto.
+        
+        Args:
+            valor: Lista de cultivos o registros por id de cultivo
+            
+        Returns:
+            Copia con los diccionarios de cultivo y las listas nuevos
+        """
+        if isinstance(valor, dict):
+            return {crop_id: list(registros) for crop_id, registros in valor.items()}
+        cultivos = []
+        for cultivo in valor:
+            cultivo = dict(cultivo)
+            if isinstance(cultivo.get('produccion_diaria'), list):
+                cultivo['produccion_diaria'] = list(cultivo['produccion_diaria'])
+            cultivos.append(cultivo)
+        return cultivos
+    
+    @staticmethod
+    def get_cache_stats() -> Dict:
+        """Contadores de aciertos/fallos/expulsiones de la caché de cultivos"""
+        return get_crops_cache().stats()
+    
+    def _load_user_crops(self, user_uid: str, projection: str = 'full') -> List[Dict]:
+        """
+        Obtener los cultivos activos de un usuario pasando por la caché de proceso
+        
+        Cada proyección se cachea por separado; si los documentos completos
+        ya están en caché se sirven también para cualquier proyección. Las
+        entradas se etiquetan con la versión de datos del usuario (ver
+        _cache_get).
+        
         Args:
             user_uid (str): UID del usuario
+            projection (str): Preset de CROP_PROJECTIONS con los campos a leer
             
         Returns:
             List[Dict]: Lista de cultivos del usuario (vacía si es usuario nuevo)
         """
-        print(f"��� [NUEVA VERSION] ¡FUNCIÓN EJECUTADA! user_uid: {user_uid} 🔥🔥🔥")
-        print(f"🔥🔥🔥 [NUEVA VERSION] TIMESTAMP: {datetime.datetime.now()} ���")
+        if not self.db:
+            # Sin conexión a Firebase, devolver lista vacía para usuarios reales
+            return []
+        
+        # La versión se lee antes que los cultivos: si otra escritura se cuela
+        # entre medias, la entrada queda con una versión vieja y no se sirve
+        version = self._cache_version(user_uid)
+        found, cultivos = self._cache_get(user_uid, version)
+        if found:
+            return cultivos
+        
+        cache_key = user_uid if projection == 'full' else (user_uid, projection)
+        if cache_key != user_uid:
+            found, cultivos = self._cache_get(cache_key, version)
+            if found:
+                return cultivos
+        
+        cultivos = self._query_user_crops(user_uid, CROP_PROJECTIONS[projection])
+        if cultivos is not None:
+            self._cache_set(cache_key, version, cultivos)
+            for cultivo in cultivos:
+                if 'num_registros' in cultivo and cultivo.get('id'):
+                    get_aggregated_crops().set((user_uid, cultivo['id']), True)
+            return cultivos
+        # Para usuarios reales, devolver lista vacía en lugar de datos demo
+        return []
+    
+    def _load_user_crops_summary(self, user_uid: str, projection: str = 'summary') -> List[Dict]:
+        """
+        Cargar los cultivos de un usuario sin su historial de producción
+        
+        Las métricas salen de los agregados del documento (kilos_totales,
+        num_registros...). Si algún cultivo es anterior a los agregados se
+        carga el historial completo para no mostrar totales incorrectos.
+        
+        Args:
+            user_uid (str): UID del usuario
+            projection (str): Preset de CROP_PROJECTIONS (debe incluir
+                'num_registros' para detectar cultivos sin agregados)
+            
+        Returns:
+            List[Dict]: Cultivos del usuario
+        """
+        cultivos = self._load_user_crops(user_uid, projection)
+        if any('num_registros' not in c for c in cultivos):
+            return self._load_user_crops_with_production(user_uid)
+        return cultivos
+    
+    def _load_user_crops_with_production(self, user_uid: str) -> List[Dict]:
+        """
+        Cargar los cultivos de un usuario con sus registros de producción
+        
+        Los registros se leen con una única consulta collection group sobre
+        'producciones' por usuario, en lugar de una consulta por cultivo.
+        
+        Args:
+            user_uid (str): UID del usuario
+            
+        Returns:
+            List[Dict]: Cultivos con 'produccion_diaria' ordenada por fecha
+        """
+        cultivos = self._load_user_crops(user_uid)
+        if not cultivos:
+            return cultivos
+        
+        producciones = {}
+        for source_uid in {c.get('source_uid', user_uid) for c in cultivos}:
+            producciones.update(self._load_user_productions(source_uid))
+        
+        for cultivo in cultivos:
+            cultivo['produccion_diaria'] = self._merge_productions(
+                cultivo, producciones.get(cultivo.get('id'), [])
+            )
+        return cultivos
+    
+    def _load_user_productions(self, user_uid: str) -> Dict[str, List[Dict]]:
+        """
+        Obtener los registros de producción de un usuario agrupados por cultivo
+        
+        Args:
+            user_uid (str): UID del usuario propietario de los registros
+            
+        Returns:
+            Dict[str, List[Dict]]: Registros por id de cultivo
+        """
+        cache_key = (user_uid, 'producciones')
+        version = self._cache_version(user_uid)
+        found, producciones = self._cache_get(cache_key, version)
+        if found:
+            return producciones
+        
+        try:
+            producciones = {}
+            docs = (self.db.collection_group('producciones')
+                    .where('user_uid', '==', user_uid)
+                    .order_by('fecha', direction=firestore.Query.DESCENDING)
+                    .stream())
+            for doc in docs:
+                registro = self._process_production(doc.to_dict(), doc.id)
+                producciones.setdefault(registro.get('cultivo_id'), []).append(registro)
+            self._cache_set(cache_key, version, producciones)
+            return producciones
+        except Exception as e:
+            print(f"❌ Error obteniendo producciones del usuario {user_uid}: {e}")
+            return {}
+    
+    def get_user_history(self, user_uid: str) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Leer todos los cultivos y registros de producción de un usuario
+        
+        Lectura directa, sin caché: la usan las reconstrucciones (resumen de
+        estadísticas y rollups), que no deben guardar datos vacíos si falla.
         
+        Args:
+            user_uid (str): UID del usuario
+            
+        Returns:
+            Tuple[List[Dict], List[Dict]]: (cultivos activos o no, registros
+                con 'id' y 'cultivo_id')
+        """
+        producciones = {}
+        for doc in self.db.collection_group('producciones').where('user_uid', '==', user_uid).stream():
+            registro = self._process_production(doc.to_dict(), doc.id)
+            producciones.setdefault(registro.get('cultivo_id'), []).append(registro)
+        
+        cultivos = []
+        registros = []
+        for doc in self.db.collection('usuarios').document(user_uid).collection('cultivos').stream():
+            cultivo = self._process_cultivo_dates(doc.to_dict())
+            cultivo['id'] = doc.id
+            cultivos.append(cultivo)
+            # Los registros del array heredado llevan el mismo ID que tendrán al migrarse
+            legacy = cultivo.get('produccion_diaria') or []
+            for indice, registro in enumerate(legacy):
+                registro.setdefault('id', self._legacy_production_id(indice))
+            for registro in self._merge_productions(cultivo, producciones.get(doc.id, [])):
+                registros.append(dict(registro, cultivo_id=doc.id))
+        return cultivos, registros
+    
+    def get_crop(self, user_uid: str, crop_id: str, include_production: bool = True) -> Optional[Dict]:
+        """
+        Obtener un cultivo concreto del usuario
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            include_production (bool): Adjuntar sus registros de producción
+            
+        Returns:
+            Optional[Dict]: Cultivo o None si no existe
+        """
         try:
             if not self.db:
-                # Sin conexión a Firebase, devolver lista vacía para usuarios reales
-                return []
+                # Almacenamiento local en sesión
+                from flask import session
+                for c in session.get(f'crops_{user_uid}', []):
+                    if c.get('id') == crop_id:
+                        return c
+                return None
+            
+            doc = self._crop_ref(user_uid, crop_id).get()
+            if not doc.exists:
+                return None
+            cultivo = doc.to_dict()
+            cultivo['id'] = doc.id
+            cultivo = self._process_cultivo_dates(cultivo)
+            if include_production:
+                cultivo['produccion_diaria'] = self.get_crop_productions(user_uid, crop_id, cultivo)
+            return cultivo
+        except Exception as e:
+            print(f"Error obteniendo cultivo {crop_id}: {e}")
+            return None
+    
+    def get_crop_productions(self, user_uid: str, crop_id: str, cultivo: Optional[Dict] = None) -> List[Dict]:
+        """
+        Obtener los registros de producción de un cultivo ordenados por fecha
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            cultivo (Optional[Dict]): Documento del cultivo ya leído, si se tiene
             
-            cultivos = []
+        Returns:
+            List[Dict]: Registros (fecha, kilos, unidades) en orden ascendente
+        """
+        try:
+            if not self.db:
+                cultivo = self.get_crop(user_uid, crop_id, include_production=False) or {}
+                return cultivo.get('produccion_diaria', [])
+            
+            crop_ref = self._crop_ref(user_uid, crop_id)
+            if cultivo is None:
+                doc = crop_ref.get()
+                if not doc.exists:
+                    return []
+                cultivo = self._process_cultivo_dates(doc.to_dict())
+            
+            registros = [
+                self._process_production(doc.to_dict(), doc.id)
+                for doc in crop_ref.collection('producciones').order_by('fecha').stream()
+            ]
+            return self._merge_productions(cultivo, registros)
+        except Exception as e:
+            print(f"Error obteniendo producción del cultivo {crop_id}: {e}")
+            return []
+    
+    def get_user_crops_page(self, user_uid: str, limit: int = CROPS_PAGE_SIZE, cursor: Optional[str] = None,
+                            projection: str = 'summary') -> Dict:
+        """
+        Obtener una página de cultivos activos, de siembra más reciente a más antigua
+        
+        En Firestore se pagina con order_by + start_after sobre
+        (fecha_siembra, ID del documento). Si los cultivos ya están en la caché
+        de proceso se paginan en memoria con el mismo orden y los mismos cursores.
+        
+        Args:
+            user_uid (str): UID del usuario
+            limit (int): Cultivos por página (máximo PAGE_MAX_SIZE)
+            cursor (Optional[str]): Cursor devuelto en la página anterior
+            projection (str): Preset de CROP_PROJECTIONS con los campos a leer
+            
+        Returns:
+            Dict: Instantánea de la página (como build_snapshot, con los totales
+                  sólo de la página) y 'siguiente' con el cursor de la página
+                  siguiente, o None si es la última
+            
+        Raises:
+            ValueError: Si el cursor no es válido
+        """
+        limit = max(1, min(int(limit), PAGE_MAX_SIZE))
+        if cursor:
+            self.decode_cursor(cursor)
+        if not self.db:
+            return dict(self.build_snapshot([]), siguiente=None)
+        
+        version = self._cache_version(user_uid)
+        found, cultivos = self._cache_get(user_uid, version)
+        if not found and projection != 'full':
+            found, cultivos = self._cache_get((user_uid, projection), version)
+        source_uids = self._crop_source_uids(user_uid)
+        
+        if found or len(source_uids) > 1:
+            if not found:
+                cultivos = self._load_user_crops(user_uid, projection)
+            pagina, siguiente = self.paginate_list(cultivos, 'fecha_siembra', limit, cursor)
+        else:
+            query = self.db.collection('usuarios').document(user_uid).collection('cultivos').where('activo', '==', True)
+            fields = CROP_PROJECTIONS[projection]
+            if fields is not None:
+                # fecha_siembra hace falta para construir el cursor
+                query = query.select(list(dict.fromkeys(fields + ['fecha_siembra'])))
+            docs, hay_mas = self._page_query(query, 'fecha_siembra', limit, cursor)
+            pagina = []
+            for doc in docs:
+                cultivo = self._process_cultivo_dates(doc.to_dict())
+                cultivo['id'] = doc.id
+                cultivo['source_uid'] = user_uid
+                pagina.append(cultivo)
+            siguiente = self.encode_cursor(pagina[-1].get('fecha_siembra'), pagina[-1]['id']) if hay_mas else None
+        
+        # Cultivos anteriores a los agregados: sumar su historial (sólo los de la página)
+        pagina = [
+            c if 'num_registros' in c else dict(c, produccion_diaria=self.get_crop_productions(c.get('source_uid', user_uid), c['id']))
+            for c in pagina
+        ]
+        return dict(self.build_snapshot(pagina), siguiente=siguiente)
+    
+    def iter_crop_productions(self, user_uid: str, crop_id: str, desde: Optional[datetime.datetime] = None,
+                              hasta: Optional[datetime.datetime] = None) -> Iterator[Dict]:
+        """
+        Recorrer los registros de producción de un cultivo en orden de fecha
+        
+        En Firestore la subcolección se lee con una consulta ordenada y
+        filtrada por rango que se va consumiendo mientras se recorre, sin
+        cargar el historial entero. Los cultivos con el array heredado
+        'produccion_diaria' (acotado por el tamaño del documento) y los de
+        sesión se combinan y filtran en memoria.
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            desde (Optional[datetime.datetime]): Fecha inicial incluida
+            hasta (Optional[datetime.datetime]): Fecha final excluida
+            
+        Yields:
+            Dict: Registros (fecha, kilos, unidades) en orden ascendente
+        """
+        def en_rango(registro):
+            epoch = self._to_epoch(registro.get('fecha'))
+            if epoch is None:
+                return desde is None and hasta is None
+            return ((desde is None or epoch >= self._to_epoch(desde))
+                    and (hasta is None or epoch < self._to_epoch(hasta)))
+        
+        crop_ref = self._crop_ref(user_uid, crop_id) if self.db else None
+        legacy = None
+        if crop_ref is not None:
+            crop_doc = crop_ref.get(field_paths=['produccion_diaria'])
+            legacy = (crop_doc.to_dict() or {}).get('produccion_diaria') if crop_doc.exists else None
+        if crop_ref is None or legacy:
+            for registro in self.get_crop_productions(user_uid, crop_id):
+                if en_rango(registro):
+                    yield registro
+            return
+        
+        query = crop_ref.collection('producciones')
+        if desde is not None:
+            query = query.where('fecha', '>=', desde)
+        if hasta is not None:
+            query = query.where('fecha', '<', hasta)
+        for doc in query.order_by('fecha').stream():
+            yield self._process_production(doc.to_dict(), doc.id)
+    
+    def get_production_index(self, user_uid: str, crop_id: str) -> Optional[ProductionIndex]:
+        """
+        Índice de rangos (registros ordenados y sumas acumuladas) de un cultivo
+        
+        Se guarda en la caché de proceso junto a la versión de datos del
+        usuario: mientras no cambie, los totales entre dos fechas se
+        responden sin leer Firestore. Si cambia se vuelve a construir, salvo
+        que el cambio sea un único registro escrito por este proceso, que
+        _index_production ya ha insertado en orden.
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            
+        Returns:
+            Optional[ProductionIndex]: Índice del cultivo o None si no existe
+        """
+        version = self.get_data_version(user_uid)
+        cache = get_series_cache()
+        clave = (user_uid, 'indice', crop_id)
+        encontrado, indice = cache.get(clave)
+        if encontrado and indice.version == version:
+            return indice
+        
+        cultivo = self.get_crop(user_uid, crop_id, include_production=False)
+        if cultivo is None:
+            return None
+        registros = self.get_crop_productions(user_uid, crop_id, cultivo=cultivo)
+        indice = ProductionIndex(registros, cultivo.get('precio_por_kilo', 0), version)
+        cache.set(clave, indice)
+        return indice
+    
+    def _index_production(self, user_uid: str, crop_id: str, registro: Dict) -> None:
+        """
+        Insertar en orden un registro recién escrito en el índice de rangos cacheado
+        
+        Sólo si la versión de datos avanzó exactamente en uno desde la del
+        índice (ninguna otra escritura entre medias); si no, se descarta y la
+        próxima lectura lo reconstruye.
+        """
+        cache = get_series_cache()
+        clave = (user_uid, 'indice', crop_id)
+        encontrado, indice = cache.get(clave)
+        if not encontrado:
+            return
+        try:
+            version = self.get_data_version(user_uid)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer la versión de datos de {user_uid}: {e}")
+            version = None
+        if version is not None and indice.version is not None and version == indice.version + 1:
+            cache.set(clave, indice.insert(registro, version))
+        else:
+            cache.invalidate(clave)
+    
+    def get_crop_productions_page(self, user_uid: str, crop_id: str, limit: int = HISTORY_PAGE_SIZE,
+                                  cursor: Optional[str] = None, cultivo: Optional[Dict] = None) -> Dict:
+        """
+        Obtener una página del historial de producción, de más reciente a más antiguo
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            limit (int): Registros por página (máximo PAGE_MAX_SIZE)
+            cursor (Optional[str]): Cursor devuelto en la página anterior
+            cultivo (Optional[Dict]): Documento del cultivo ya leído sin
+                producción (get_crop con include_production=False), si se tiene
+            
+        Returns:
+            Dict: 'registros' de la página y 'siguiente' con el cursor de la
+                  página siguiente, o None si es la última
+            
+        Raises:
+            ValueError: Si el cursor no es válido
+        """
+        limit = max(1, min(int(limit), PAGE_MAX_SIZE))
+        if cursor:
+            self.decode_cursor(cursor)
+        if cultivo is None:
+            cultivo = self.get_crop(user_uid, crop_id, include_production=False)
+            if cultivo is None:
+                return {'registros': [], 'siguiente': None}
+        
+        legacy = cultivo.get('produccion_diaria') or []
+        if not self.db or legacy:
+            # Sesión o cultivo sin migrar: el historial se combina en memoria
+            for indice, registro in enumerate(legacy):
+                registro.setdefault('id', self._legacy_production_id(indice))
+            registros = legacy if not self.db else self.get_crop_productions(user_uid, crop_id, cultivo)
+            pagina, siguiente = self.paginate_list(registros, 'fecha', limit, cursor)
+            return {'registros': pagina, 'siguiente': siguiente}
+        
+        try:
+            query = self._crop_ref(user_uid, crop_id).collection('producciones')
+            docs, hay_mas = self._page_query(query, 'fecha', limit, cursor)
+            pagina = [self._process_production(doc.to_dict(), doc.id) for doc in docs]
+            siguiente = self.encode_cursor(pagina[-1].get('fecha'), pagina[-1]['id']) if hay_mas else None
+            return {'registros': pagina, 'siguiente': siguiente}
+        except Exception as e:
+            print(f"Error obteniendo página de producción del cultivo {crop_id}: {e}")
+            return {'registros': [], 'siguiente': None}
+    
+    def _page_query(self, query, campo: str, limit: int, cursor: Optional[str]) -> Tuple[list, bool]:
+        """
+        Leer una página de una consulta en orden descendente de 'campo'
+        
+        El ID del documento desempata fechas iguales para que el cursor sea
+        estable. Se pide un documento de más para saber si hay otra página.
+        
+        Returns:
+            Tuple[list, bool]: (documentos de la página, hay más páginas)
+        """
+        query = (query.order_by(campo, direction=firestore.Query.DESCENDING)
+                 .order_by('__name__', direction=firestore.Query.DESCENDING))
+        if cursor:
+            micros, doc_id = self.decode_cursor(cursor)
+            query = query.start_after({campo: self._from_micros(micros), '__name__': doc_id})
+        docs = list(query.limit(limit + 1).stream())
+        return docs[:limit], len(docs) > limit
+    
+    @classmethod
+    def paginate_list(cls, elementos: List[Dict], campo: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Paginar en memoria una lista ya cargada (caché, sesión o demo)
+        
+        Usa el mismo orden que _page_query (campo y 'id' descendentes) y los
+        mismos cursores, así el cliente no distingue de dónde sale la página.
+        
+        Args:
+            elementos (List[Dict]): Elementos con 'id' y el campo de fecha
+            campo (str): Campo de fecha por el que se ordena
+            limit (int): Elementos por página
+            cursor (Optional[str]): Cursor de la página anterior
+            
+        Returns:
+            Tuple[List[Dict], Optional[str]]: (página, cursor de la siguiente o None)
+        """
+        def clave(elemento):
+            micros = cls._to_micros(elemento.get(campo))
+            return (micros if micros is not None else float('-inf'), str(elemento.get('id', '')))
+        
+        ordenados = sorted(elementos, key=clave, reverse=True)
+        if cursor:
+            micros, doc_id = cls.decode_cursor(cursor)
+            limite = (micros if micros is not None else float('-inf'), doc_id)
+            ordenados = [e for e in ordenados if clave(e) < limite]
+        pagina = ordenados[:limit]
+        siguiente = cls.encode_cursor(pagina[-1].get(campo), str(pagina[-1].get('id', ''))) if len(ordenados) > limit else None
+        return pagina, siguiente
+    
+    @classmethod
+    def encode_cursor(cls, fecha, doc_id: str) -> str:
+        """
+        Cursor opaco que apunta justo después de un elemento
+        
+        Guarda la fecha en microsegundos enteros (sin pérdida de precisión)
+        y el ID del documento, en JSON codificado en base64 para URL.
+        """
+        import base64
+        import json
+        datos = json.dumps({'t': cls._to_micros(fecha), 'id': doc_id}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(datos.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[Optional[int], str]:
+        """
+        Descodificar un cursor de encode_cursor
+        
+        Returns:
+            Tuple[Optional[int], str]: (fecha en microsegundos, ID del documento)
+            
+        Raises:
+            ValueError: Si el cursor no es válido
+        """
+        import base64
+        import json
+        try:
+            datos = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            micros = datos['t']
+            if micros is not None and not isinstance(micros, int):
+                raise ValueError(micros)
+            return micros, str(datos['id'])
+        except Exception:
+            raise ValueError('Cursor de paginación no válido')
+    
+    @staticmethod
+    def _to_micros(fecha) -> Optional[int]:
+        """Microsegundos desde epoch (exactos) de una fecha; sin zona se toma como UTC"""
+        if isinstance(fecha, datetime.datetime):
+            if fecha.tzinfo is None:
+                fecha = fecha.replace(tzinfo=datetime.timezone.utc)
+            return (fecha - EPOCH_UTC) // datetime.timedelta(microseconds=1)
+        return None
+    
+    @staticmethod
+    def _from_micros(micros: Optional[int]) -> Optional[datetime.datetime]:
+        """Fecha UTC a partir de los microsegundos de _to_micros"""
+        if micros is None:
+            return None
+        return EPOCH_UTC + datetime.timedelta(microseconds=micros)
+    
+    def _merge_productions(self, cultivo: Dict, registros: List[Dict]) -> List[Dict]:
+        """
+        Combinar el array heredado 'produccion_diaria' (cultivos sin migrar)
+        con los registros de la subcolección, en orden ascendente de fecha
+        """
+        legacy = cultivo.get('produccion_diaria') or []
+        if legacy:
+            # Mientras el array exista, las copias de la migración no cuentan
+            registros = [r for r in registros if r.get('origen') != 'migracion']
+        combinados = list(legacy) + list(registros)
+        combinados.sort(key=self._production_sort_key)
+        return combinados
+    
+    @classmethod
+    def _production_sort_key(cls, registro: Dict) -> float:
+        """Clave de orden cronológico tolerante a fechas nulas o sin zona"""
+        epoch = cls._to_epoch(registro.get('fecha'))
+        return epoch if epoch is not None else float('-inf')
+    
+    @staticmethod
+    def _to_epoch(fecha) -> Optional[float]:
+        """Segundos desde epoch de una fecha (las fechas sin zona se toman como UTC)"""
+        if isinstance(fecha, datetime.datetime):
+            if fecha.tzinfo is None:
+                fecha = fecha.replace(tzinfo=datetime.timezone.utc)
+            return fecha.timestamp()
+        return None
+    
+    def _compute_aggregates(self, registros: List[Dict]) -> Dict:
+        """
+        Calcular desde cero los agregados de producción de un cultivo
+        
+        El beneficio no se guarda: es kilos_totales * precio_por_kilo y se
+        calcula al leer, así las escrituras no necesitan conocer el precio.
+        
+        Args:
+            registros (List[Dict]): Historial completo de producción
+            
+        Returns:
+            Dict: Campos de agregados listos para guardar en el documento
+        """
+        fechas = [e for e in (self._to_epoch(r.get('fecha')) for r in registros) if e is not None]
+        return {
+            'kilos_totales': sum(float(r.get('kilos', 0) or 0) for r in registros),
+            'unidades_totales': sum(int(r.get('unidades', 0) or 0) for r in registros),
+            'num_registros': len(registros),
+            'primer_registro': min(fechas) if fechas else None,
+            'ultimo_registro': max(fechas) if fechas else None
+        }
+    
+    def _aggregate_increments(self, registros: List[Dict], signo: int = 1) -> Dict:
+        """
+        Transformaciones atómicas de Firestore para sumar (o restar) registros
+        
+        Al añadir, primer/ultimo_registro (epoch) se mantienen con Minimum y
+        Maximum, así que también valen para registros con fecha atrasada.
+        
+        Args:
+            registros (List[Dict]): Registros de un mismo cultivo añadidos o eliminados
+            signo (int): 1 al añadir, -1 al eliminar
             
-            # 🔍 SOLUCIÓN TEMPORAL: Buscar en múltiples usuarios
-            # Para usuarios locales (danigom11), buscar también en usuario Firebase real
-            user_ids_to_check = [user_uid]
+        Returns:
+            Dict: Campos con firestore.Increment/Minimum/Maximum
+        """
+        agregados = {
+            'kilos_totales': firestore.Increment(signo * sum(float(r.get('kilos', 0) or 0) for r in registros)),
+            'unidades_totales': firestore.Increment(signo * sum(int(r.get('unidades', 0) or 0) for r in registros)),
+            'num_registros': firestore.Increment(signo * len(registros))
+        }
+        fechas = [e for e in (self._to_epoch(r.get('fecha')) for r in registros) if e is not None]
+        if signo > 0 and fechas:
+            agregados['primer_registro'] = firestore.Minimum(min(fechas))
+            agregados['ultimo_registro'] = firestore.Maximum(max(fechas))
+        return agregados
+    
+    def _crop_ref(self, user_uid: str, crop_id: str):
+        """Referencia Firestore al documento de un cultivo"""
+        return self.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
+    
+    def _query_user_crops(self, user_uid: str, fields: Optional[List[str]] = None) -> Optional[List[Dict]]:
+        """
+        Consultar en Firestore los cultivos activos de un usuario
+        
+        Args:
+            user_uid (str): UID del usuario
+            fields (Optional[List[str]]): Campos a leer con select(); None
+                lee el documento completo
             
-            # Si es usuario local de danigom11, incluir también el usuario Firebase real
-            if user_uid == 'local_danigom11_gmail_com':
-                user_ids_to_check.append('CnQVZjC0TPbVWeInNdnBAWpncyI3')
-                print(f"🔍 [CropService] Buscando cultivos para usuario local, incluyendo Firebase real")
+        Returns:
+            Optional[List[Dict]]: Lista de cultivos, o None si la consulta falla
+        """
+        print(f"��� [NUEVA VERSION] ¡FUNCIÓN EJECUTADA! user_uid: {user_uid} 🔥🔥🔥")
+        print(f"🔥🔥🔥 [NUEVA VERSION] TIMESTAMP: {datetime.datetime.now()} ���")
+        
+        try:
+            cultivos = []
             
             # Buscar cultivos en todos los usuarios identificados
-            for uid_to_check in user_ids_to_check:
+            for uid_to_check in self._crop_source_uids(user_uid):
                 crops_ref = self.db.collection('usuarios').document(uid_to_check).collection('cultivos')
-                docs = crops_ref.where('activo', '==', True).stream()
+                query = crops_ref.where('activo', '==', True)
+                if fields is not None:
+                    # Sólo los campos pedidos: sin arrays de historial que descargar ni procesar
+                    query = query.select(fields)
+                docs = query.stream()
                 
                 for doc in docs:
                     cultivo = doc.to_dict()
@@ -68,8 +967,21 @@ class CropService:
             print(f"❌ Error obteniendo cultivos del usuario {user_uid}: {e}")
             import traceback
             traceback.print_exc()
-            # Para usuarios reales, devolver lista vacía en lugar de datos demo
-            return []
+            # No cachear fallos: el llamador devolverá una lista vacía
+            return None
+    
+    @staticmethod
+    def _crop_source_uids(user_uid: str) -> List[str]:
+        """UIDs cuyos cultivos se muestran al usuario"""
+        # 🔍 SOLUCIÓN TEMPORAL: Buscar en múltiples usuarios
+        # Para usuarios locales (danigom11), buscar también en usuario Firebase real
+        user_ids_to_check = [user_uid]
+        
+        # Si es usuario local de danigom11, incluir también el usuario Firebase real
+        if user_uid == 'local_danigom11_gmail_com':
+            user_ids_to_check.append('CnQVZjC0TPbVWeInNdnBAWpncyI3')
+            print(f"🔍 [CropService] Buscando cultivos para usuario local, incluyendo Firebase real")
+        return user_ids_to_check
     
     def create_crop(self, user_uid: str, crop_data: Dict) -> bool:
         """
@@ -100,7 +1012,13 @@ class CropService:
                 'peso_promedio_gramos': float(crop_data.get('peso_promedio', 100)),  # Peso en gramos por unidad
                 'color_cultivo': crop_data.get('color_cultivo', '#28a745'),  # Color por defecto verde
                 'abonos': [],
-                'produccion_diaria': [],
+                # La producción vive en la subcolección 'producciones';
+                # en el documento sólo se guardan sus agregados
+                'kilos_totales': 0,
+                'unidades_totales': 0,
+                'num_registros': 0,
+                'primer_registro': None,
+                'ultimo_registro': None,
                 'activo': True,
                 'creado_en': datetime.datetime.utcnow(),
                 'actualizado_en': datetime.datetime.utcnow()
@@ -118,11 +1036,19 @@ class CropService:
                     'ultimo_acceso': datetime.datetime.utcnow()
                 }, merge=True)
 
-            # Guardar en Firestore
-            crops_ref = user_ref.collection('cultivos')
-            doc_ref = crops_ref.add(cultivo)
+            # Guardar en Firestore junto con el contador del resumen de estadísticas
+            doc_ref = user_ref.collection('cultivos').document()
+            batch = self.db.batch()
+            batch.set(doc_ref, cultivo)
+            batch.set(self.stats.summary_ref(user_uid),
+                      self.stats.crop_delta(doc_ref.id, cultivo['nombre'], cultivo['precio_por_kilo'], activos=1),
+                      merge=True)
+            self._bump_data_version(batch, user_uid)
+            batch.commit()
+            get_aggregated_crops().set((user_uid, doc_ref.id), True)
             
             print(f"✅ Cultivo '{cultivo['nombre']}' creado para usuario {user_uid}")
+            self.invalidate_user_crops(user_uid)
             return True
             
         except Exception as e:
@@ -131,7 +1057,8 @@ class CropService:
             traceback.print_exc()
             return False
     
-    def update_production(self, user_uid: str, crop_id: str, kilos: float) -> bool:
+    def update_production(self, user_uid: str, crop_id: str, kilos: float,
+                          fecha: Optional[datetime.datetime] = None) -> bool:
         """
         Actualizar producción diaria de un cultivo
         
@@ -139,18 +1066,36 @@ class CropService:
             user_uid (str): UID del usuario
             crop_id (str): ID del cultivo
             kilos (float): Kilogramos producidos
+            fecha (Optional[datetime.datetime]): Fecha del registro si es atrasado
             
         Returns:
             bool: True si se actualizó exitosamente
         """
         # Mantener compatibilidad con APIs existentes
-        return self.update_production_generic(user_uid, crop_id, kilos=kilos, unidades=None)
+        return self.update_production_generic(user_uid, crop_id, kilos=kilos, unidades=None, fecha=fecha)
 
-    def update_production_generic(self, user_uid: str, crop_id: str, kilos: float | None = None, unidades: int | None = None) -> bool:
+    def update_production_generic(self, user_uid: str, crop_id: str, kilos: float | None = None, unidades: int | None = None,
+                                  fecha: Optional[datetime.datetime] = None) -> bool:
         """
-        Actualizar producción diaria (kilos y/o unidades) de un cultivo.
+        Registrar una producción (kilos y/o unidades) en un cultivo.
         Si se proporciona uno de los dos, se añade un único registro con los campos presentes.
         Soporta Firestore y almacenamiento local (sesión) cuando no hay DB.
+        
+        En Firestore, con kilos en un cultivo que ya se sabe con agregados
+        (get_aggregated_crops) el registro y los agregados se escriben en un
+        único commit sin lecturas previas. Si no, una transacción lee del
+        cultivo sólo peso_promedio_gramos (para los kilos de un registro con
+        sólo unidades) y num_registros, y escribe en el mismo commit; así se
+        comprueba una vez por cultivo y proceso. Un cultivo anterior a los
+        agregados (sin num_registros) no se incrementa: tras el commit se
+        recalculan con todo su historial (recompute_crop_aggregates), así su
+        produccion_diaria heredada sigue contando sin migrarlo antes.
+        
+        Sin fecha el registro es de ahora; con fecha (registro atrasado) queda
+        en su sitio del historial: la subcolección se lee ordenada por fecha,
+        la lista de sesión se mantiene ordenada y el índice de rangos
+        cacheado lo inserta en orden (ver get_production_index). creado_en
+        guarda el momento del alta, que es lo que sigue undo_last_production.
         """
         try:
             # Validación mínima
@@ -159,24 +1104,12 @@ class CropService:
             if not has_kilos and not has_units:
                 return False
 
-            nueva_produccion = { 'fecha': datetime.datetime.utcnow() }
+            ahora = datetime.datetime.utcnow()
+            nueva_produccion = { 'fecha': fecha or ahora, 'creado_en': ahora }
             if has_kilos:
-                try:
-                    nueva_produccion['kilos'] = float(kilos)
-                except Exception:
-                    pass
+                nueva_produccion['kilos'] = float(kilos)
             if has_units:
-                try:
-                    nueva_produccion['unidades'] = int(unidades)
-                    # Si solo se proporcionan unidades, calcular kilos automáticamente
-                    if not has_kilos:
-                        # Necesitamos obtener el peso promedio del cultivo
-                        peso_promedio = self._get_peso_promedio_cultivo(user_uid, crop_id)
-                        if peso_promedio > 0:
-                            kilos_calculados = (int(unidades) * peso_promedio) / 1000  # gramos a kilos
-                            nueva_produccion['kilos'] = round(kilos_calculados, 2)
-                except Exception:
-                    pass
+                nueva_produccion['unidades'] = int(unidades)
 
             if not self.db:
                 # Almacenamiento local en sesión
@@ -186,71 +1119,306 @@ class CropService:
                 # Buscar cultivo por id
                 for c in cultivos:
                     if c.get('id') == crop_id:
+                        if not has_kilos:
+                            self._set_kilos_from_units(nueva_produccion, c.get('peso_promedio_gramos', 100))
                         produccion = c.get('produccion_diaria', [])
-                        produccion.append(nueva_produccion)
+                        bisect.insort(produccion, nueva_produccion, key=self._production_sort_key)
                         c['produccion_diaria'] = produccion
                         break
                 session[session_key] = cultivos
+                self.invalidate_user_crops(user_uid)
+                self._index_production(user_uid, crop_id, nueva_produccion)
                 return True
 
-            # Firestore
-            crop_ref = self.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
-            crop_doc = crop_ref.get()
-            if not crop_doc.exists:
-                return False
-            cultivo = crop_doc.to_dict()
-
-            produccion_actual = cultivo.get('produccion_diaria', [])
-            produccion_actual.append(nueva_produccion)
-
-            crop_ref.update({
-                'produccion_diaria': produccion_actual,
-                'actualizado_en': datetime.datetime.utcnow()
-            })
-            print(f"✅ Producción actualizada para cultivo {crop_id}: kilos={nueva_produccion.get('kilos')}, unidades={nueva_produccion.get('unidades')}")
+            # Firestore: cada registro es un documento propio en la subcolección
+            crop_ref = self._crop_ref(user_uid, crop_id)
+            registro = dict(nueva_produccion, user_uid=user_uid, cultivo_id=crop_id)
+            if has_kilos and get_aggregated_crops().get((user_uid, crop_id))[0]:
+                # Escritura ciega: si el cultivo no existe, el update falla y el lote entero se descarta
+                batch = self.db.batch()
+                self._write_production(batch, crop_ref, registro)
+                batch.commit()
+            else:
+                @firestore.transactional
+                def registrar(transaction):
+                    crop_doc = crop_ref.get(field_paths=['peso_promedio_gramos', 'num_registros'], transaction=transaction)
+                    if not crop_doc.exists:
+                        return None
+                    datos = crop_doc.to_dict() or {}
+                    if not has_kilos:
+                        self._set_kilos_from_units(registro, datos.get('peso_promedio_gramos', 100))
+                    con_agregados = 'num_registros' in datos
+                    self._write_production(transaction, crop_ref, registro, agregados=con_agregados)
+                    return con_agregados
+                
+                con_agregados = registrar(self.db.transaction())
+                if con_agregados is None:
+                    return False
+                if con_agregados:
+                    get_aggregated_crops().set((user_uid, crop_id), True)
+                else:
+                    self._aggregate_legacy_crop(user_uid, crop_id)
+            print(f"✅ Producción actualizada para cultivo {crop_id}: kilos={registro.get('kilos')}, unidades={registro.get('unidades')}")
+            self.invalidate_user_crops(user_uid)
+            self._index_production(user_uid, crop_id, registro)
             return True
         except Exception as e:
             print(f"Error actualizando producción (genérica): {e}")
             return False
 
-    def _get_peso_promedio_cultivo(self, user_uid: str, crop_id: str) -> float:
+    def _write_production(self, writer, crop_ref, registro: Dict, agregados: bool = True) -> None:
         """
-        Obtener el peso promedio de un cultivo específico
+        Añadir a un lote o transacción el registro, el incremento de agregados,
+        la actualización del resumen de estadísticas y de los rollups y la
+        nueva versión de datos del usuario
+        
+        Args:
+            writer: WriteBatch o Transaction de Firestore
+            crop_ref: Referencia al documento del cultivo
+            registro (Dict): Registro de producción a guardar
+            agregados (bool): False si el cultivo aún no tiene agregados (no
+                se incrementan; hay que recalcularlos tras el commit)
+        """
+        registro_ref = crop_ref.collection('producciones').document()
+        writer.set(registro_ref, registro)
+        cambios = self._aggregate_increments([registro]) if agregados else {}
+        writer.update(crop_ref, dict(cambios, actualizado_en=datetime.datetime.utcnow()))
+        writer.set(self.stats.summary_ref(registro['user_uid']),
+                   self.stats.production_delta([dict(registro, id=registro_ref.id)]), merge=True)
+        self.rollups.write_delta(writer, registro['user_uid'], [registro])
+        self._bump_data_version(writer, registro['user_uid'])
+
+    @staticmethod
+    def _set_kilos_from_units(produccion: Dict, peso_promedio_gramos) -> None:
+        """Calcular los kilos de un registro sólo con unidades a partir del peso medio"""
+        try:
+            peso_promedio = float(peso_promedio_gramos or 0)
+            if peso_promedio > 0:
+                produccion['kilos'] = round((produccion['unidades'] * peso_promedio) / 1000, 2)  # gramos a kilos
+        except Exception:
+            pass
+
+    def add_productions_batch(self, user_uid: str, registros: List[Dict]) -> List[Dict]:
+        """
+        Registrar de una vez muchas producciones de uno o varios cultivos
+        
+        Los registros se validan juntos, el peso medio de los cultivos se
+        resuelve con un único get_all y la escritura va en WriteBatch de como
+        mucho BATCH_MAX_OPS operaciones (registros + un update de agregados por
+        cultivo). Si un lote falla, sólo sus registros se marcan como fallidos.
         
         Args:
             user_uid (str): UID del usuario
-            crop_id (str): ID del cultivo
+            registros (List[Dict]): Registros {crop_id, kilos, unidades, fecha};
+                fecha es opcional, en ISO 8601
+            
+        Returns:
+            List[Dict]: Un resultado por registro y en el mismo orden, con
+                'indice', 'crop_id', 'success' y 'id' o 'error'
+        """
+        resultados = []
+        validos = []
+        for indice, datos in enumerate(registros):
+            registro, error = self._validate_production_record(datos)
+            resultado = {
+                'indice': indice,
+                'crop_id': datos.get('crop_id') if isinstance(datos, dict) else None,
+                'success': error is None
+            }
+            if error:
+                resultado['error'] = error
+            else:
+                validos.append((resultado, registro))
+            resultados.append(resultado)
+        
+        if not validos:
+            return resultados
+        
+        # Momento del alta, distinto por registro para que deshacer siga el orden del lote
+        ahora = datetime.datetime.utcnow()
+        for posicion, (_, registro) in enumerate(validos):
+            registro['creado_en'] = ahora + datetime.timedelta(microseconds=posicion)
+        
+        if not self.db:
+            # Almacenamiento local en sesión
+            from flask import session
+            session_key = f'crops_{user_uid}'
+            cultivos = session.get(session_key, [])
+            por_id = {c.get('id'): c for c in cultivos if c.get('id')}
+            for resultado, registro in validos:
+                cultivo = por_id.get(registro.pop('cultivo_id'))
+                if cultivo is None:
+                    resultado.update(success=False, error='Cultivo no encontrado')
+                    continue
+                if 'kilos' not in registro:
+                    self._set_kilos_from_units(registro, cultivo.get('peso_promedio_gramos', 100))
+                bisect.insort(cultivo.setdefault('produccion_diaria', []), registro, key=self._production_sort_key)
+            session[session_key] = cultivos
+            self.invalidate_user_crops(user_uid)
+            return resultados
+        
+        # Una sola lectura para comprobar los cultivos, su peso medio y si tienen agregados
+        crop_ids = sorted({registro['cultivo_id'] for _, registro in validos})
+        pesos = {}
+        sin_agregados = set()
+        for doc in self.db.get_all([self._crop_ref(user_uid, crop_id) for crop_id in crop_ids],
+                                   field_paths=['peso_promedio_gramos', 'num_registros']):
+            if doc.exists:
+                datos = doc.to_dict() or {}
+                pesos[doc.id] = datos.get('peso_promedio_gramos', 100)
+                if 'num_registros' not in datos:
+                    sin_agregados.add(doc.id)
+        # Producciones recientes del resumen: cada lote añade y quita las
+        # justas para que la lista no pase de STATS_RECENT_MAX
+        resumen_doc = self.stats.summary_ref(user_uid).get(field_paths=['ultimas_producciones'])
+        recientes = list((resumen_doc.to_dict() or {}).get('ultimas_producciones') or []) if resumen_doc.exists else []
+        
+        lote = []
+        cultivos_lote = set()
+        rollups_lote = set()
+        for resultado, registro in validos:
+            if registro['cultivo_id'] not in pesos:
+                resultado.update(success=False, error='Cultivo no encontrado')
+                continue
+            registro['user_uid'] = user_uid
+            if 'kilos' not in registro:
+                self._set_kilos_from_units(registro, pesos[registro['cultivo_id']])
+            
+            # Operaciones del lote: registros, un update por cultivo, el resumen
+            # (y el recorte de sus recientes) y un documento de rollups por año y cultivo
+            rollup = self.rollups.document_of(registro)
+            nuevo_cultivo = registro['cultivo_id'] not in cultivos_lote
+            nuevo_rollup = rollup not in rollups_lote
+            if len(lote) + len(cultivos_lote) + len(rollups_lote) + 3 + nuevo_cultivo + nuevo_rollup > BATCH_MAX_OPS:
+                self._commit_production_chunk(user_uid, lote, sin_agregados, recientes)
+                lote = []
+                cultivos_lote = set()
+                rollups_lote = set()
+            lote.append((resultado, registro))
+            cultivos_lote.add(registro['cultivo_id'])
+            rollups_lote.add(rollup)
+        if lote:
+            self._commit_production_chunk(user_uid, lote, sin_agregados, recientes)
+        
+        for crop_id in sorted(sin_agregados):
+            if any(r['success'] and r['crop_id'] == crop_id for r in resultados):
+                self._aggregate_legacy_crop(user_uid, crop_id)
+        
+        guardados = sum(1 for r in resultados if r['success'])
+        print(f"✅ Producción por lotes para {user_uid}: {guardados}/{len(resultados)} registros guardados")
+        self.invalidate_user_crops(user_uid)
+        return resultados
+
+    def _commit_production_chunk(self, user_uid: str, lote: List[Tuple[Dict, Dict]], sin_agregados=(),
+                                 recientes: Optional[List[Dict]] = None) -> None:
+        """
+        Escribir un lote de registros, los agregados de sus cultivos, el
+        resumen de estadísticas y los rollups en un commit
+        
+        Args:
+            user_uid (str): UID del usuario
+            lote (List[Tuple[Dict, Dict]]): Pares (resultado, registro)
+            sin_agregados: Cultivos sin agregados todavía (no se incrementan)
+            recientes (Optional[List[Dict]]): 'ultimas_producciones' guardadas;
+                se actualiza en el sitio si el commit sale bien
+        """
+        batch = self.db.batch()
+        por_cultivo = {}
+        for resultado, registro in lote:
+            registro_ref = self._crop_ref(user_uid, registro['cultivo_id']).collection('producciones').document()
+            batch.set(registro_ref, registro)
+            resultado['id'] = registro_ref.id
+            por_cultivo.setdefault(registro['cultivo_id'], []).append(dict(registro, id=registro_ref.id))
+        for crop_id, registros in por_cultivo.items():
+            cambios = self._aggregate_increments(registros) if crop_id not in sin_agregados else {}
+            batch.update(self._crop_ref(user_uid, crop_id), dict(cambios, actualizado_en=datetime.datetime.utcnow()))
+        todos = [r for registros in por_cultivo.values() for r in registros]
+        nuevas, sobrantes, quedan = self.stats.bounded_recent(recientes or [], todos)
+        batch.set(self.stats.summary_ref(user_uid), self.stats.production_delta(todos, recientes=nuevas), merge=True)
+        if sobrantes:
+            batch.update(self.stats.summary_ref(user_uid), {'ultimas_producciones': firestore.ArrayRemove(sobrantes)})
+        self.rollups.write_delta(batch, user_uid, todos)
+        self._bump_data_version(batch, user_uid)
+        try:
+            batch.commit()
+            if recientes is not None:
+                recientes[:] = quedan
+        except Exception as e:
+            print(f"❌ Error guardando lote de producción ({len(lote)} registros): {e}")
+            for resultado, _ in lote:
+                resultado.pop('id', None)
+                resultado.update(success=False, error='Error guardando el lote', reintentar=True)
+
+    def _validate_production_record(self, datos) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        Validar un registro de la ingesta por lotes
+        
+        Args:
+            datos: Registro recibido {crop_id, kilos, unidades, fecha}
             
         Returns:
-            float: Peso promedio en gramos (por defecto 100g si no se encuentra)
+            Tuple[Optional[Dict], Optional[str]]: (registro normalizado, error)
         """
+        if not isinstance(datos, dict):
+            return None, 'Registro inválido'
+        crop_id = datos.get('crop_id')
+        if not crop_id or not isinstance(crop_id, str):
+            return None, 'crop_id requerido'
+        
+        registro = {'cultivo_id': crop_id}
         try:
-            if not self.db:
-                # Almacenamiento local en sesión
-                from flask import session
-                session_key = f'crops_{user_uid}'
-                cultivos = session.get(session_key, [])
-                for cultivo in cultivos:
-                    if cultivo.get('id') == crop_id:
-                        return cultivo.get('peso_promedio_gramos', 100.0)
-                return 100.0  # Valor por defecto
+            kilos = float(datos['kilos']) if datos.get('kilos') not in (None, '') else 0
+            unidades = float(datos['unidades']) if datos.get('unidades') not in (None, '') else 0
+            # 'nan' e 'inf' se leen como float pero no son cantidades válidas
+            if not (math.isfinite(kilos) and math.isfinite(unidades)):
+                return None, 'kilos y unidades deben ser numéricos'
+            unidades = int(unidades)
+        except (TypeError, ValueError, OverflowError):
+            return None, 'kilos y unidades deben ser numéricos'
+        if kilos < 0 or unidades < 0:
+            return None, 'kilos y unidades no pueden ser negativos'
+        if kilos <= 0 and unidades <= 0:
+            return None, 'Indica kilos o unidades'
+        if kilos > 0:
+            registro['kilos'] = kilos
+        if unidades > 0:
+            registro['unidades'] = unidades
+        
+        try:
+            registro['fecha'] = self.parse_production_date(datos.get('fecha')) or datetime.datetime.utcnow()
+        except ValueError as e:
+            return None, str(e)
+        return registro, None
+    
+    @staticmethod
+    def parse_production_date(valor) -> Optional[datetime.datetime]:
+        """
+        Fecha de un registro de producción enviada por el cliente
+        
+        Args:
+            valor: Fecha en ISO 8601, o None / '' para un registro de ahora
             
-            # Firestore
-            crop_ref = self.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
-            crop_doc = crop_ref.get()
-            if crop_doc.exists:
-                cultivo = crop_doc.to_dict()
-                return cultivo.get('peso_promedio_gramos', 100.0)
+        Returns:
+            Optional[datetime.datetime]: Fecha leída o None si no se indica
             
-            return 100.0  # Valor por defecto
-        except Exception as e:
-            print(f"Error obteniendo peso promedio del cultivo {crop_id}: {e}")
-            return 100.0
+        Raises:
+            ValueError: Si la fecha no es ISO 8601
+        """
+        if valor in (None, ''):
+            return None
+        try:
+            return datetime.datetime.fromisoformat(str(valor).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('fecha inválida (formato ISO 8601)')
 
     def undo_last_production(self, user_uid: str, crop_id: str) -> bool:
         """
         Deshacer (eliminar) el último registro de producción del cultivo indicado.
         Soporta Firestore y almacenamiento local de sesión cuando no hay DB.
+        
+        El último es el añadido más tarde (creado_en), no el de fecha más
+        reciente: un registro atrasado se deshace aunque quede en medio del
+        historial. Los registros anteriores a creado_en siguen el orden por fecha.
         """
         try:
             if not self.db:
@@ -263,7 +1431,9 @@ class CropService:
                         produccion = c.get('produccion_diaria', [])
                         if not produccion:
                             return False
-                        produccion.pop()
+                        # La lista está ordenada por fecha: buscar el último añadido
+                        altas = [(p['creado_en'], i) for i, p in enumerate(produccion) if p.get('creado_en')]
+                        produccion.pop(max(altas)[1] if altas else -1)
                         c['produccion_diaria'] = produccion
                         # Recalcular agregados locales si existen
                         try:
@@ -273,30 +1443,208 @@ class CropService:
                         except Exception:
                             pass
                         session[session_key] = cultivos
+                        self.invalidate_user_crops(user_uid)
                         return True
                 return False
 
-            # Firestore
-            crop_ref = self.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
-            crop_doc = crop_ref.get()
+            # Firestore: registro y agregados se actualizan en una transacción
+            crop_ref = self._crop_ref(user_uid, crop_id)
+            transaction = self.db.transaction()
+            if not self._undo_last_production_tx(transaction, user_uid, crop_ref):
+                return False
+            print(f"↩️ Deshecha última producción para cultivo {crop_id}")
+            self.invalidate_user_crops(user_uid)
+            return True
+        except Exception as e:
+            print(f"Error deshaciendo última producción: {e}")
+            return False
+
+    def _undo_last_production_tx(self, transaction, user_uid: str, crop_ref) -> bool:
+        """
+        Eliminar el último registro añadido y descontarlo de los agregados
+        
+        Se ejecuta dentro de una transacción para que dos deshacer simultáneos
+        no borren el mismo registro ni descuenten dos veces los totales.
+        primer/ultimo_registro se recalculan con los extremos por fecha que
+        quedan, porque el registro eliminado puede ser uno atrasado.
+        
+        Args:
+            transaction: Transacción de Firestore
+            user_uid (str): UID del usuario
+            crop_ref: Referencia al documento del cultivo
+            
+        Returns:
+            bool: True si había un registro que eliminar
+        """
+        @firestore.transactional
+        def deshacer(transaction):
+            crop_doc = crop_ref.get(transaction=transaction)
             if not crop_doc.exists:
                 return False
             cultivo = crop_doc.to_dict()
-            produccion_actual = cultivo.get('produccion_diaria', [])
-            if not produccion_actual:
+            produccion_legacy = cultivo.get('produccion_diaria') or []
+            producciones_ref = crop_ref.collection('producciones')
+            # El último añadido; los registros sin creado_en (anteriores) no
+            # salen en esa consulta y se deshacen después, por fecha
+            ultimos = list(producciones_ref.order_by('creado_en', direction=firestore.Query.DESCENDING)
+                           .limit(1).stream(transaction=transaction))
+            if not ultimos:
+                ultimos = list(producciones_ref.order_by('fecha', direction=firestore.Query.DESCENDING)
+                               .limit(1).stream(transaction=transaction))
+            # Los dos primeros y los dos últimos por fecha: los extremos que quedan
+            extremos = [
+                doc
+                for direccion in (firestore.Query.ASCENDING, firestore.Query.DESCENDING)
+                for doc in producciones_ref.order_by('fecha', direction=direccion).limit(2).stream(transaction=transaction)
+            ]
+            
+            cambios = {'actualizado_en': datetime.datetime.utcnow()}
+            if ultimos and not (produccion_legacy and ultimos[0].to_dict().get('origen') == 'migracion'):
+                # Registro de la subcolección añadido más tarde
+                eliminado = dict(ultimos[0].to_dict(), id=ultimos[0].id)
+                transaction.delete(ultimos[0].reference)
+            elif produccion_legacy:
+                # Cultivo sin migrar: quitar del array heredado y de su copia migrada, si existe
+                indice = len(produccion_legacy) - 1
+                eliminado = dict(produccion_legacy.pop(), id=self._legacy_production_id(indice))
+                cambios['produccion_diaria'] = produccion_legacy
+                transaction.delete(producciones_ref.document(self._legacy_production_id(indice)))
+            else:
                 return False
-            # Eliminar último elemento
-            produccion_actual.pop()
-            crop_ref.update({
-                'produccion_diaria': produccion_actual,
+            restantes = [d.to_dict() for d in extremos if d.id != eliminado['id']] + produccion_legacy
+            
+            if 'num_registros' in cultivo:
+                if int(cultivo.get('num_registros') or 0) <= 1:
+                    # Sin registros: reiniciar exactamente, sin arrastrar decimales
+                    cambios.update(self._compute_aggregates([]))
+                else:
+                    cambios.update(self._aggregate_increments([eliminado], signo=-1))
+                    fechas = [e for e in (self._to_epoch(self._to_datetime(r.get('fecha'))) for r in restantes) if e is not None]
+                    if fechas:
+                        cambios['primer_registro'] = min(fechas)
+                        cambios['ultimo_registro'] = max(fechas)
+            transaction.update(crop_ref, cambios)
+            eliminado['cultivo_id'] = crop_ref.id
+            transaction.set(self.stats.summary_ref(user_uid),
+                            self.stats.production_delta([eliminado], signo=-1), merge=True)
+            self.rollups.write_delta(transaction, user_uid, [eliminado], signo=-1)
+            self._bump_data_version(transaction, user_uid)
+            return True
+        
+        return deshacer(transaction)
+    
+    def update_crop(self, user_uid: str, crop_id: str, datos: Dict) -> bool:
+        """
+        Actualizar los datos editables de un cultivo
+        
+        Un cambio de precio no obliga a recalcular nada: el beneficio se
+        obtiene al leer a partir de kilos_totales.
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            datos (Dict): Campos a actualizar
+            
+        Returns:
+            bool: True si se actualizó exitosamente
+        """
+        try:
+            if not self.db:
+                return False
+            
+            batch = self.db.batch()
+            batch.update(self._crop_ref(user_uid, crop_id), dict(datos, actualizado_en=datetime.datetime.utcnow()))
+            if 'nombre' in datos or 'precio_por_kilo' in datos:
+                # El resumen de estadísticas guarda nombre y precio para sus ingresos
+                batch.set(self.stats.summary_ref(user_uid),
+                          self.stats.crop_delta(crop_id, datos.get('nombre'), datos.get('precio_por_kilo')),
+                          merge=True)
+            self._bump_data_version(batch, user_uid)
+            batch.commit()
+            print(f"✅ Cultivo {crop_id} actualizado")
+            self.invalidate_user_crops(user_uid)
+            return True
+        except Exception as e:
+            print(f"Error actualizando cultivo {crop_id}: {e}")
+            return False
+    
+    def delete_crop(self, user_uid: str, crop_id: str) -> bool:
+        """
+        Borrado suave de un cultivo: marcar activo=False
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            
+        Returns:
+            bool: True si se eliminó exitosamente
+        """
+        try:
+            if not self.db:
+                return False
+            
+            crop_ref = self._crop_ref(user_uid, crop_id)
+            crop_doc = crop_ref.get(field_paths=['activo'])
+            if not crop_doc.exists:
+                return False
+            
+            batch = self.db.batch()
+            batch.update(crop_ref, {
+                'activo': False,
                 'actualizado_en': datetime.datetime.utcnow()
             })
-            print(f"↩️ Deshecha última producción para cultivo {crop_id}")
+            if (crop_doc.to_dict() or {}).get('activo', True):
+                batch.set(self.stats.summary_ref(user_uid), self.stats.crop_delta(crop_id, activos=-1), merge=True)
+            self._bump_data_version(batch, user_uid)
+            batch.commit()
+            print(f"🗑️ Cultivo {crop_id} eliminado")
+            self.invalidate_user_crops(user_uid)
             return True
         except Exception as e:
-            print(f"Error deshaciendo última producción: {e}")
+            print(f"Error eliminando cultivo {crop_id}: {e}")
             return False
+    
+    def recompute_crop_aggregates(self, user_uid: str, crop_id: str) -> bool:
+        """
+        Recalcular los agregados de un cultivo a partir de su historial
+        
+        Pensado para cultivos creados antes de que existieran los agregados:
+        lo usan scripts/migrate_producciones.py y la primera producción que
+        se registra en uno de ellos.
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            
+        Returns:
+            bool: True si se recalcularon
+        """
+        crop_ref = self._crop_ref(user_uid, crop_id)
+        crop_doc = crop_ref.get()
+        if not crop_doc.exists:
+            return False
+        cultivo = self._process_cultivo_dates(crop_doc.to_dict())
+        registros = self.get_crop_productions(user_uid, crop_id, cultivo)
+        agregados = self._compute_aggregates(registros)
+        self._update_crop_doc(user_uid, crop_ref, dict(agregados, actualizado_en=datetime.datetime.utcnow()))
+        self.invalidate_user_crops(user_uid)
+        return True
 
+    def _aggregate_legacy_crop(self, user_uid: str, crop_id: str) -> None:
+        """
+        Calcular los agregados de un cultivo anterior a ellos tras registrar
+        su primera producción nueva
+        
+        Si falla, el cultivo sigue sin num_registros: se lee con todo su
+        historial y la siguiente producción lo vuelve a intentar.
+        """
+        try:
+            if self.recompute_crop_aggregates(user_uid, crop_id):
+                get_aggregated_crops().set((user_uid, crop_id), True)
+            print(f"📊 Agregados calculados para el cultivo {crop_id} (anterior a los agregados)")
+        except Exception as e:
+            print(f"⚠️ No se pudieron calcular los agregados del cultivo {crop_id}: {e}")
+    
     def add_abono(self, user_uid: str, crop_id: str, descripcion: str) -> bool:
         """
         Añadir un nuevo abono a un cultivo
@@ -330,6 +1678,7 @@ class CropService:
                         c['abonos'] = abonos
                         break
                 session[session_key] = cultivos
+                self.invalidate_user_crops(user_uid)
                 return True
             
             # Firestore
@@ -342,11 +1691,12 @@ class CropService:
             abonos_actuales = cultivo.get('abonos', [])
             abonos_actuales.append(nuevo_abono)
             
-            crop_ref.update({
+            self._update_crop_doc(user_uid, crop_ref, {
                 'abonos': abonos_actuales,
                 'actualizado_en': datetime.datetime.utcnow()
             })
             print(f"✅ Abono añadido para cultivo {crop_id}: {descripcion}")
+            self.invalidate_user_crops(user_uid)
             return True
             
         except Exception as e:
@@ -433,6 +1783,7 @@ class CropService:
                             abonos[abono_index]['descripcion'] = nueva_descripcion.strip()
                             c['abonos'] = abonos
                             session[session_key] = cultivos
+                            self.invalidate_user_crops(user_uid)
                             return True
                 return False
             
@@ -449,11 +1800,12 @@ class CropService:
             if 0 <= abono_index < len(abonos):
                 abonos[abono_index]['descripcion'] = nueva_descripcion.strip()
                 
-                crop_ref.update({
+                self._update_crop_doc(user_uid, crop_ref, {
                     'abonos': abonos,
                     'actualizado_en': datetime.datetime.utcnow()
                 })
                 print(f"✅ Abono editado para cultivo {crop_id} en índice {abono_index}")
+                self.invalidate_user_crops(user_uid)
                 return True
             else:
                 print(f"❌ Índice de abono inválido: {abono_index}")
@@ -488,6 +1840,7 @@ class CropService:
                             abonos.pop(abono_index)
                             c['abonos'] = abonos
                             session[session_key] = cultivos
+                            self.invalidate_user_crops(user_uid)
                             return True
                 return False
             
@@ -504,11 +1857,12 @@ class CropService:
             if 0 <= abono_index < len(abonos):
                 abonos.pop(abono_index)
                 
-                crop_ref.update({
+                self._update_crop_doc(user_uid, crop_ref, {
                     'abonos': abonos,
                     'actualizado_en': datetime.datetime.utcnow()
                 })
                 print(f"✅ Abono eliminado para cultivo {crop_id} en índice {abono_index}")
+                self.invalidate_user_crops(user_uid)
                 return True
             else:
                 print(f"❌ Índice de abono inválido: {abono_index}")
@@ -573,20 +1927,24 @@ class CropService:
                             }
                         })
                         session[session_key] = cultivos
+                        self.invalidate_user_crops(user_uid)
                         return True
                 return False
             
             # Firestore
-            crop_ref = self.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
+            crop_ref = self._crop_ref(user_uid, crop_id)
             crop_doc = crop_ref.get()
             if not crop_doc.exists:
                 return False
             
             cultivo = crop_doc.to_dict()
             
-            # Calcular estadísticas finales
-            produccion = cultivo.get('produccion_diaria', [])
-            total_kilos = sum(p.get('kilos', 0) for p in produccion)
+            # Calcular estadísticas finales (desde los agregados si el cultivo los tiene)
+            if 'num_registros' in cultivo:
+                total_kilos = float(cultivo.get('kilos_totales') or 0)
+            else:
+                produccion = self.get_crop_productions(user_uid, crop_id, self._process_cultivo_dates(cultivo))
+                total_kilos = sum(p.get('kilos', 0) for p in produccion)
             precio_kilo = cultivo.get('precio_por_kilo', 0)
             total_beneficio = total_kilos * precio_kilo
             
@@ -598,12 +1956,19 @@ class CropService:
                 pass
             else:
                 fecha_siembra = datetime.datetime.utcnow()
-                
+            
+            # Firestore devuelve las fechas con zona (UTC): restar ambas sin zona
+            if isinstance(fecha_siembra, datetime.datetime) and fecha_siembra.tzinfo is not None:
+                fecha_siembra = fecha_siembra.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            if fecha_cosecha.tzinfo is not None:
+                fecha_cosecha = fecha_cosecha.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            
             dias_cultivo = (fecha_cosecha - fecha_siembra).days if hasattr(fecha_siembra, 'date') else 0
             rendimiento_diario = total_kilos / max(1, dias_cultivo) if dias_cultivo > 0 else 0
             
-            # Actualizar cultivo como finalizado
-            crop_ref.update({
+            # Actualizar cultivo como finalizado (y los contadores del resumen)
+            batch = self.db.batch()
+            batch.update(crop_ref, {
                 'activo': False,
                 'fecha_cosecha': fecha_cosecha,
                 'finalizado_en': datetime.datetime.utcnow(),
@@ -615,14 +1980,79 @@ class CropService:
                 },
                 'actualizado_en': datetime.datetime.utcnow()
             })
+            batch.set(self.stats.summary_ref(user_uid),
+                      self.stats.crop_delta(crop_id, activos=-1 if cultivo.get('activo', True) else 0, finalizados=1),
+                      merge=True)
+            self._bump_data_version(batch, user_uid)
+            batch.commit()
             
             print(f"✅ Cultivo {crop_id} finalizado correctamente")
+            self.invalidate_user_crops(user_uid)
             return True
             
         except Exception as e:
             print(f"Error finalizando cultivo: {e}")
             return False
     
+    def migrate_legacy_productions(self, user_uid: str, crop_id: str, dry_run: bool = False) -> int:
+        """
+        Mover el array 'produccion_diaria' de un cultivo a su subcolección
+        
+        Es idempotente y reanudable: cada registro se escribe con un ID
+        determinista (legacy-NNNNNN) y el array sólo se elimina en el último
+        lote, así que repetir la migración tras un fallo no duplica registros.
+        
+        Args:
+            user_uid (str): UID del usuario
+            crop_id (str): ID del cultivo
+            dry_run (bool): Sólo contar, sin escribir
+            
+        Returns:
+            int: Número de registros migrados (-1 si el cultivo no existe)
+        """
+        crop_ref = self._crop_ref(user_uid, crop_id)
+        crop_doc = crop_ref.get()
+        if not crop_doc.exists:
+            return -1
+        
+        produccion_legacy = crop_doc.to_dict().get('produccion_diaria')
+        if produccion_legacy is None:
+            return 0
+        if dry_run:
+            return len(produccion_legacy)
+        
+        # Agregados con el historial completo (array + registros ya en la subcolección)
+        cultivo = self._process_cultivo_dates(crop_doc.to_dict())
+        agregados = self._compute_aggregates(self.get_crop_productions(user_uid, crop_id, cultivo))
+        
+        producciones_ref = crop_ref.collection('producciones')
+        batch = self.db.batch()
+        ops = 0
+        for indice, produccion in enumerate(produccion_legacy):
+            registro = dict(produccion, user_uid=user_uid, cultivo_id=crop_id, origen='migracion')
+            batch.set(producciones_ref.document(self._legacy_production_id(indice)), registro)
+            ops += 1
+            if ops >= BATCH_MAX_OPS:
+                batch.commit()
+                batch = self.db.batch()
+                ops = 0
+        
+        batch.update(crop_ref, dict(
+            agregados,
+            produccion_diaria=firestore.DELETE_FIELD,
+            producciones_migradas=True,
+            actualizado_en=datetime.datetime.utcnow()
+        ))
+        self._bump_data_version(batch, user_uid)
+        batch.commit()
+        self.invalidate_user_crops(user_uid)
+        return len(produccion_legacy)
+    
+    @staticmethod
+    def _legacy_production_id(indice: int) -> str:
+        """ID determinista del documento migrado desde la posición del array"""
+        return f"legacy-{indice:06d}"
+    
     def get_user_totals(self, user_uid: str) -> Tuple[float, float]:
         """
         Calcular totales de kilos y beneficios del usuario
@@ -634,58 +2064,63 @@ class CropService:
             Tuple[float, float]: (total_kilos, total_beneficios)
         """
         try:
-            cultivos = self.get_user_crops(user_uid)
-            total_kilos = 0
-            total_beneficios = 0
-            
-            for cultivo in cultivos:
-                precio_kilo = cultivo.get('precio_por_kilo', 0)
-                produccion = cultivo.get('produccion_diaria', [])
-                
-                kilos_cultivo = sum(p.get('kilos', 0) for p in produccion)
-                beneficio_cultivo = kilos_cultivo * precio_kilo
-                
-                total_kilos += kilos_cultivo
-                total_beneficios += beneficio_cultivo
-            
-            return total_kilos, total_beneficios
+            snapshot = self.get_user_snapshot(user_uid, include_production=False)
+            return snapshot['total_kilos'], snapshot['total_beneficios']
             
         except Exception as e:
             print(f"Error calculando totales: {e}")
             return 0, 0
     
-    def _get_peso_promedio_cultivo(self, user_uid: str, crop_id: str) -> float:
+    def build_snapshot(self, cultivos: List[Dict]) -> Dict:
         """
-        Obtener el peso promedio en gramos de un cultivo específico
+        Calcular en una sola pasada las métricas de una lista de cultivos
+        
+        Los totales, el ranking y los buckets salen del motor por columnas
+        (AnalyticsEngine), que se guarda en la instantánea como 'analitica'.
         
         Args:
-            user_uid (str): UID del usuario
-            crop_id (str): ID del cultivo
+            cultivos (List[Dict]): Cultivos ya cargados (usuario o demo)
             
         Returns:
-            float: Peso promedio en gramos, 100 por defecto si no se encuentra
+            Dict: Instantánea con 'cultivos', 'metricas' (por id de cultivo),
+                  'total_kilos', 'total_beneficios', 'ranking' y 'analitica'
         """
+        from app.services.analytics_service import AnalyticsEngine
+        
+        motor = AnalyticsEngine(cultivos)
+        metricas = {}
+        
+        for indice, cultivo in enumerate(cultivos):
+            metricas_cultivo = motor.crop_metrics(indice)
+            metricas_cultivo['dias_cultivo'] = self._dias_cultivo(cultivo)
+            metricas_cultivo['total_abonos'] = len(cultivo.get('abonos', []))
+            metricas[cultivo.get('id')] = metricas_cultivo
+            
+            # Exponer los agregados en el propio cultivo para las plantillas
+            cultivo['kilos_totales'] = metricas_cultivo['total_kilos']
+            cultivo['unidades_totales'] = metricas_cultivo['total_unidades']
+            cultivo['beneficio_total'] = metricas_cultivo['beneficio']
+        
+        return {
+            'cultivos': cultivos,
+            'metricas': metricas,
+            'total_kilos': motor.total_kilos,
+            'total_beneficios': motor.total_beneficios,
+            'ranking': motor.ranking(),
+            'analitica': motor
+        }
+    
+    @staticmethod
+    def _dias_cultivo(cultivo: Dict) -> Optional[int]:
+        """Días de cultivo hasta la cosecha (o hasta hoy si sigue activo)"""
+        fecha_siembra = cultivo.get('fecha_siembra')
+        if not fecha_siembra:
+            return None
+        fecha_fin = cultivo.get('fecha_cosecha') or datetime.datetime.now()
         try:
-            if not self.db:
-                # Modo local
-                from flask import session
-                cultivos = session.get(f'crops_{user_uid}', [])
-                for c in cultivos:
-                    if c.get('id') == crop_id:
-                        return float(c.get('peso_promedio_gramos', 100))
-                return 100.0
-            
-            # Firestore
-            crop_ref = self.db.collection('usuarios').document(user_uid).collection('cultivos').document(crop_id)
-            crop_doc = crop_ref.get()
-            if crop_doc.exists:
-                cultivo = crop_doc.to_dict()
-                return float(cultivo.get('peso_promedio_gramos', 100))
-            return 100.0
-            
-        except Exception as e:
-            print(f"Error obteniendo peso promedio: {e}")
-            return 100.0
+            return (fecha_fin - fecha_siembra).days
+        except Exception:
+            return None
     
     def get_demo_crops(self) -> List[Dict]:
         """Datos demo completos para mostrar funcionalidades premium - 10 plantas distintas"""
@@ -752,21 +2187,12 @@ class CropService:
     
     def get_demo_totals(self) -> Tuple[float, float]:
         """Calcular totales de datos demo"""
-        demo_crops = self.get_demo_crops()
-        total_kilos = 0
-        total_beneficios = 0
-        
-        for cultivo in demo_crops:
-            precio_kilo = cultivo.get('precio_por_kilo', 0)
-            produccion = cultivo.get('produccion_diaria', [])
-            
-            kilos_cultivo = sum(p.get('kilos', 0) for p in produccion)
-            beneficio_cultivo = kilos_cultivo * precio_kilo
-            
-            total_kilos += kilos_cultivo
-            total_beneficios += beneficio_cultivo
-        
-        return total_kilos, total_beneficios
+        snapshot = self.get_demo_snapshot()
+        return snapshot['total_kilos'], snapshot['total_beneficios']
+    
+    def get_demo_snapshot(self) -> Dict:
+        """Instantánea de los datos demo (cultivos y totales coherentes entre sí)"""
+        return self.build_snapshot(self.get_demo_crops())
     
     def _check_crop_limits(self, user_uid: str) -> bool:
         """
@@ -800,47 +2226,59 @@ class CropService:
             print("🔧 Aplicando solución temporal: permitiendo creación de cultivo por error en verificación")
             return True
     
-    def _process_cultivo_dates(self, cultivo: Dict) -> Dict:
-        """Procesar fechas de cultivo para compatibilidad"""
-        import datetime as _dt
-        # Helper local para convertir a datetime cuando sea posible
-        def _to_dt(value):
+    @staticmethod
+    def _to_datetime(value):
+        """Convertir Timestamp de Firestore o string ISO a datetime cuando sea posible"""
+        try:
+            # Si es objeto Timestamp de Firestore
+            if hasattr(value, 'to_datetime') and callable(getattr(value, 'to_datetime')):
+                return value.to_datetime()
+        except Exception:
+            pass
+        # Si ya es datetime, devolver tal cual
+        if isinstance(value, datetime.datetime):
+            return value
+        # Si viene como string ISO
+        if isinstance(value, str):
             try:
-                # Si es objeto Timestamp de Firestore
-                if hasattr(value, 'to_datetime') and callable(getattr(value, 'to_datetime')):
-                    return value.to_datetime()
+                return datetime.datetime.fromisoformat(value)
             except Exception:
-                pass
-            # Si ya es datetime, devolver tal cual
-            if isinstance(value, _dt.datetime):
                 return value
-            # Si viene como string ISO
-            if isinstance(value, str):
-                try:
-                    return _dt.datetime.fromisoformat(value)
-                except Exception:
-                    return value
-            return value
-
+        return value
+    
+    def _process_cultivo_dates(self, cultivo: Dict) -> Dict:
+        """Procesar fechas de cultivo para compatibilidad"""
         # Convertir timestamps/strings de Firestore a datetime si es necesario
         for field in ['fecha_siembra', 'fecha_cosecha', 'creado_en', 'actualizado_en']:
             if field in cultivo and cultivo[field]:
-                cultivo[field] = _to_dt(cultivo[field])
+                cultivo[field] = self._to_datetime(cultivo[field])
         
-        # Procesar fechas en produccion_diaria
+        # primer/ultimo_registro se guardan como epoch (Minimum/Maximum atómicos)
+        for field in ['primer_registro', 'ultimo_registro']:
+            if isinstance(cultivo.get(field), (int, float)):
+                cultivo[field] = datetime.datetime.fromtimestamp(cultivo[field], tz=datetime.timezone.utc)
+        
+        # Procesar fechas en produccion_diaria (array heredado)
         if 'produccion_diaria' in cultivo:
             for produccion in cultivo['produccion_diaria']:
-                if 'fecha' in produccion and produccion['fecha']:
-                    produccion['fecha'] = _to_dt(produccion['fecha'])
-                # Normalizar kilos a float
-                if 'kilos' in produccion:
-                    try:
-                        produccion['kilos'] = float(produccion['kilos'])
-                    except Exception:
-                        pass
+                self._process_production(produccion)
         
         return cultivo
     
+    def _process_production(self, produccion: Dict, doc_id: Optional[str] = None) -> Dict:
+        """Normalizar un registro de producción (fecha a datetime, kilos a float)"""
+        if doc_id is not None:
+            produccion['id'] = doc_id
+        if 'fecha' in produccion and produccion['fecha']:
+            produccion['fecha'] = self._to_datetime(produccion['fecha'])
+        # Normalizar kilos a float
+        if 'kilos' in produccion:
+            try:
+                produccion['kilos'] = float(produccion['kilos'])
+            except Exception:
+                pass
+        return produccion
+    
     # ==========================================
     # MÉTODOS PARA USUARIOS LOCALES (SIN FIREBASE)
     # ==========================================
@@ -916,6 +2354,7 @@ class CropService:
             
             # Guardar en sesión
             session[session_key] = cultivos
+            self.invalidate_user_crops(user_uid)
             
             print(f"✅ Cultivo local '{cultivo['nombre']}' creado para usuario {user_uid}")
             return True
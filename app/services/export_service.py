@@ -0,0 +1,1147 @@
+"""
+Servicio de exportación de informes
+Libro Excel en modo sólo escritura: las filas se escriben según se generan
+y el fichero se guarda en un temporal que se envía por bloques. Los informes
+de usuarios con Firestore se generan como trabajos en segundo plano y se
+guardan por versión de datos para servirlos de nuevo sin regenerarlos. El
+paquete ZIP genera varios formatos a la vez en un pool de procesos.
+"""
+import datetime
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from collections.abc import Iterator
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# Tipo MIME de los libros .xlsx
+EXCEL_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Formatos de informe: tipo MIME, extensión y nombre del fichero descargado
+EXPORT_FORMATS = {
+    'excel': {'mimetype': EXCEL_MIMETYPE, 'extension': 'xlsx', 'nombre': 'analisis'},
+    'pdf': {'mimetype': 'application/pdf', 'extension': 'pdf', 'nombre': 'reporte'},
+    'pdf_weasyprint': {'mimetype': 'application/pdf', 'extension': 'pdf', 'nombre': 'reporte'}
+}
+
+# Formato de informe de cada motor PDF (ver pdf_service.PDF_ENGINES)
+PDF_ENGINE_FORMATS = {'reportlab': 'pdf', 'weasyprint': 'pdf_weasyprint'}
+
+# Ficheros del paquete ZIP (/analytics/export/bundle): nombre dentro del ZIP,
+# si se comprime (xlsx y pdf ya van comprimidos) y si usa el historial de
+# producción (los que no lo usan no lo reciben)
+BUNDLE_FORMATS = {
+    'csv': {'fichero': 'huerto_detallado.csv', 'comprimir': True, 'historial': False},
+    'json': {'fichero': 'huerto_completo.json', 'comprimir': True, 'historial': True},
+    'excel': {'fichero': 'huerto_analisis.xlsx', 'comprimir': False, 'historial': True},
+    'pdf': {'fichero': 'huerto_reporte.pdf', 'comprimir': False, 'historial': False}
+}
+
+# Tablas y formatos de la exportación por columnas (pyarrow)
+ARROW_TABLES = ('produccion', 'cultivos', 'abonos')
+ARROW_FORMATS = {
+    'parquet': {'mimetype': 'application/vnd.apache.parquet', 'extension': 'parquet'},
+    'arrow': {'mimetype': 'application/vnd.apache.arrow.file', 'extension': 'arrow'}
+}
+
+# Estados de un trabajo de exportación
+JOB_PENDING = 'pendiente'
+JOB_RUNNING = 'en_curso'
+JOB_DONE = 'completado'
+JOB_FAILED = 'error'
+
+# Bytes del temporal del Excel que se mantienen en memoria antes de pasar a disco
+EXCEL_SPOOL_BYTES = 8 * 1024 * 1024
+
+# Ancho máximo de columna (caracteres) en las hojas de datos y en la de abonos
+EXCEL_MAX_WIDTH = 20
+EXCEL_MAX_WIDTH_TEXT = 30
+
+class ColumnWidths:
+    """
+    Longitud máxima del texto de cada columna, medida al emitir las filas
+
+    En modo sólo escritura los anchos van en la cabecera de la hoja, antes
+    de la primera fila: se miden las filas (o una fila de muestra con los
+    valores más largos posibles) y se aplican antes de escribirlas.
+    """
+
+    def __init__(self, maximo: int = EXCEL_MAX_WIDTH):
+        self.maximo = maximo
+        self.longitudes = {}
+
+    def track(self, fila: Iterable) -> None:
+        """Registrar las longitudes de una fila de valores o celdas"""
+        for columna, valor in enumerate(fila, 1):
+            valor = getattr(valor, 'value', valor)
+            longitud = len(str(valor)) if valor is not None else 0
+            if longitud > self.longitudes.get(columna, 0):
+                self.longitudes[columna] = longitud
+
+    def apply(self, ws) -> None:
+        """Fijar en la hoja el ancho de cada columna medida"""
+        from openpyxl.utils import get_column_letter
+
+        for columna, longitud in self.longitudes.items():
+            ws.column_dimensions[get_column_letter(columna)].width = min(longitud + 2, self.maximo)
+
+def write_excel(destino, snapshot: Dict, registros_de: Callable[[Dict], Iterable[Dict]],
+                fecha_reporte: Optional[datetime.datetime] = None) -> None:
+    """
+    Escribir el libro de análisis (resumen, cultivos, producción y abonos)
+
+    El libro se crea en modo sólo escritura: cada fila se serializa al
+    añadirla y sólo las de la hoja en curso pasan por memoria. La producción
+    se lee cultivo a cultivo de registros_de, así que puede ser un iterador
+    sobre Firestore que no carga el historial entero.
+
+    Args:
+        destino: Ruta o fichero binario con seek (p. ej. SpooledTemporaryFile)
+        snapshot (Dict): Instantánea de cultivos con 'metricas' y totales
+            (CropService.get_user_snapshot, sin producción)
+        registros_de (Callable[[Dict], Iterable[Dict]]): Registros de
+            producción de un cultivo en orden de fecha
+        fecha_reporte (Optional[datetime.datetime]): Fecha del informe
+            (por defecto ahora)
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.chart import BarChart, Reference
+    from openpyxl.styles import Font, PatternFill, Alignment
+
+    cultivos = snapshot['cultivos']
+    fecha_reporte = fecha_reporte or datetime.datetime.now()
+    wb = Workbook(write_only=True)
+
+    # Estilo para encabezados
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="198754", end_color="198754", fill_type="solid")
+
+    def celda(ws, valor, **estilo):
+        cell = WriteOnlyCell(ws, value=valor)
+        for atributo, valor_estilo in estilo.items():
+            setattr(cell, atributo, valor_estilo)
+        return cell
+
+    def cabecera(ws, titulos: List[str], **estilo) -> List:
+        return [celda(ws, titulo, font=header_font, fill=header_fill, **estilo) for titulo in titulos]
+
+    # === HOJA 1: RESUMEN ===
+    ws1 = wb.create_sheet(title="Resumen General")
+    ws1.append([celda(ws1, "🌱 HuertoRentable - Análisis Completo", font=Font(bold=True, size=16, color="198754"))])
+    ws1.append([])
+    ws1.append(cabecera(ws1, ["Resumen General"]))
+    ws1.append(["Total Cultivos:", len(cultivos)])
+    ws1.append(["Producción Total:", f"{snapshot['total_kilos']:.1f} kg"])
+    ws1.append(["Beneficios Totales:", f"{snapshot['total_beneficios']:.2f} €".replace('.', ',')])
+    ws1.append(["Fecha Reporte:", fecha_reporte.strftime('%Y-%m-%d %H:%M')])
+    ws1.merged_cells.add('A1:D1')
+    ws1.merged_cells.add('A3:B3')
+
+    # === HOJA 2: DETALLE CULTIVOS COMPLETO ===
+    ws2 = wb.create_sheet(title="Detalle Cultivos Completo")
+    headers = ['Cultivo', 'Estado', 'Fecha Siembra', 'Fecha Cosecha', 'Días Cultivo',
+               'Número Plantas', 'Precio/kg (€)', 'Total Unidades', 'Total Kilos',
+               'Peso/Unidad (kg)', 'Beneficio Total (€)', 'Total Abonos', 'Rentabilidad (%)']
+    filas = []
+    for cultivo in cultivos:
+        # Métricas precalculadas en la instantánea
+        metricas = snapshot['metricas'][cultivo.get('id')]
+        filas.append([
+            cultivo['nombre'],
+            'Activo' if cultivo.get('activo', True) else 'Finalizado',
+            cultivo['fecha_siembra'].strftime('%Y-%m-%d') if cultivo.get('fecha_siembra') else '',
+            cultivo['fecha_cosecha'].strftime('%Y-%m-%d') if cultivo.get('fecha_cosecha') else '',
+            metricas['dias_cultivo'] if metricas['dias_cultivo'] is not None else "",
+            cultivo.get('numero_plantas', 1),
+            cultivo.get('precio_por_kilo', 0),
+            metricas['total_unidades'],
+            metricas['total_kilos'],
+            metricas['peso_por_unidad'],
+            metricas['beneficio'],
+            len(cultivo.get('abonos', [])),
+            metricas['rentabilidad']
+        ])
+    anchos = ColumnWidths()
+    anchos.track(headers)
+    for fila in filas:
+        anchos.track(fila)
+    anchos.apply(ws2)
+    ws2.append(cabecera(ws2, headers, alignment=Alignment(horizontal='center')))
+    for fila in filas:
+        ws2.append(fila)
+
+    if cultivos:
+        # Gráficas sobre rangos conocidos de antemano: una fila por cultivo bajo la cabecera
+        categorias = Reference(ws2, min_col=1, min_row=2, max_row=len(cultivos) + 1)
+        for columna, titulo, posicion in ((9, "Kilos por cultivo", "O2"), (11, "Beneficio por cultivo (€)", "O20")):
+            grafica = BarChart()
+            grafica.title = titulo
+            grafica.add_data(Reference(ws2, min_col=columna, min_row=1, max_row=len(cultivos) + 1), titles_from_data=True)
+            grafica.set_categories(categorias)
+            ws2.add_chart(grafica, posicion)
+
+    # === HOJA 3: PRODUCCIÓN DETALLADA ===
+    # La hoja se crea con el primer registro; los anchos salen de una fila de
+    # muestra con el nombre de cultivo más largo y los formatos fijos
+    headers_prod = ['Cultivo', 'Fecha', 'Kilos', 'Unidades', 'Peso/Unidad (kg)']
+    ws3 = None
+    for cultivo in cultivos:
+        for produccion in registros_de(cultivo):
+            if ws3 is None:
+                ws3 = wb.create_sheet(title="Producción Diaria")
+                anchos = ColumnWidths()
+                anchos.track(headers_prod)
+                anchos.track([max((c['nombre'] for c in cultivos), key=len), '2000-01-01', 9999.999, 99999, 0.123456])
+                anchos.apply(ws3)
+                ws3.append(cabecera(ws3, ["Producción Detallada por Día"]))
+                ws3.append(cabecera(ws3, headers_prod))
+                ws3.merged_cells.add('A1:E1')
+            kilos = produccion.get('kilos', 0)
+            unidades = produccion.get('unidades', 0)
+            fecha = produccion.get('fecha')
+            ws3.append([
+                cultivo['nombre'],
+                fecha.strftime('%Y-%m-%d') if fecha else '',
+                kilos,
+                unidades,
+                (kilos or 0) / unidades if unidades and unidades > 0 else 0
+            ])
+
+    # === HOJA 4: HISTORIAL DE ABONOS ===
+    abonos = [
+        [cultivo['nombre'], abono['fecha'].strftime('%Y-%m-%d') if 'fecha' in abono else '', abono.get('descripcion', '')]
+        for cultivo in cultivos for abono in cultivo.get('abonos', [])
+    ]
+    if abonos:
+        ws4 = wb.create_sheet(title="Historial Abonos")
+        headers_abonos = ['Cultivo', 'Fecha', 'Descripción']
+        anchos = ColumnWidths(EXCEL_MAX_WIDTH_TEXT)  # Un poco más ancho para descripciones
+        anchos.track(headers_abonos)
+        for fila in abonos:
+            anchos.track(fila)
+        anchos.apply(ws4)
+        ws4.append(cabecera(ws4, ["Historial de Abonos y Mantenimiento"]))
+        ws4.append(cabecera(ws4, headers_abonos))
+        ws4.merged_cells.add('A1:C1')
+        for fila in abonos:
+            ws4.append(fila)
+
+    wb.save(destino)
+
+def _is_lazy(valor: Any) -> bool:
+    """True si el valor es o contiene un iterador (hay que codificarlo por partes)"""
+    if isinstance(valor, Iterator):
+        return True
+    if isinstance(valor, dict):
+        return any(_is_lazy(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return any(_is_lazy(v) for v in valor)
+    return False
+
+def iter_json(valor: Any, indent: Optional[int] = None, nivel: int = 0) -> Iterator[str]:
+    """
+    Codificar un valor JSON por partes, con iteradores en lugar de listas
+    
+    Los dict y listas normales se codifican de una vez; los iteradores (y
+    los contenedores que los incluyen) se recorren elemento a elemento, así
+    una lista de registros generada cultivo a cultivo nunca está entera en
+    memoria. El texto resultante es idéntico al de json.dumps con el mismo
+    indent (y ensure_ascii=False) sobre el valor con las listas completas.
+    
+    Args:
+        valor (Any): Valor JSON; listas como iteradores donde convenga
+        indent (Optional[int]): Sangría como en json.dumps
+        nivel (int): Nivel de anidamiento de 'valor' (uso interno)
+    
+    Yields:
+        str: Fragmentos de texto JSON
+    """
+    salto = '\n' + ' ' * (indent * (nivel + 1)) if indent is not None else ''
+    cierre = '\n' + ' ' * (indent * nivel) if indent is not None else ''
+    separador = ',' if indent is not None else ', '
+    
+    if not _is_lazy(valor):
+        texto = json.dumps(valor, indent=indent, ensure_ascii=False)
+        # Las cadenas JSON no contienen saltos de línea sin escapar
+        yield texto.replace('\n', cierre) if indent is not None and nivel else texto
+    elif isinstance(valor, dict):
+        if not valor:
+            yield '{}'
+            return
+        for posicion, (clave, elemento) in enumerate(valor.items()):
+            yield f"{'{' if posicion == 0 else separador}{salto}{json.dumps(str(clave), ensure_ascii=False)}: "
+            yield from iter_json(elemento, indent, nivel + 1)
+        yield cierre + '}'
+    else:
+        vacio = True
+        for elemento in valor:
+            yield ('[' if vacio else separador) + salto
+            vacio = False
+            yield from iter_json(elemento, indent, nivel + 1)
+        yield '[]' if vacio else cierre + ']'
+
+def iter_ndjson(documentos: Iterable[Dict]) -> Iterator[str]:
+    """Una línea JSON compacta por documento (application/x-ndjson)"""
+    for documento in documentos:
+        yield json.dumps(documento, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+def chunked(partes: Iterable[str], tamano_bloque: int) -> Iterator[str]:
+    """
+    Agrupar fragmentos de texto en bloques de unos tamano_bloque caracteres
+    
+    El primer fragmento sale solo para que la descarga empiece antes de
+    leer ningún dato; sólo el bloque en curso está en memoria.
+    """
+    bloque = []
+    tamano = 0
+    primero = True
+    for parte in partes:
+        bloque.append(parte)
+        tamano += len(parte)
+        if primero or tamano >= tamano_bloque:
+            yield ''.join(bloque)
+            bloque = []
+            tamano = 0
+            primero = False
+    if bloque:
+        yield ''.join(bloque)
+
+# Cabecera del CSV con una fila por cultivo (/analytics/export/csv)
+CSV_CROP_HEADER = [
+    'Cultivo', 'Estado', 'Fecha Siembra', 'Fecha Cosecha', 'Días Cultivo',
+    'Número Plantas', 'Precio/kg (€)', 'Total Unidades', 'Total Kilos',
+    'Peso/Unidad (kg)', 'Beneficio Total (€)', 'Total Abonos', 'Rentabilidad (%)'
+]
+
+def csv_crop_rows(cultivos: List[Dict], metricas: List[Dict]) -> Iterator[List]:
+    """Filas del CSV por cultivo (sin cabecera, ver CSV_CROP_HEADER) con las métricas de cada uno"""
+    from app.utils.helpers import format_spanish_number
+    
+    for cultivo, metrica in zip(cultivos, metricas):
+        peso_por_unidad = metrica['peso_por_unidad']
+        yield [
+            cultivo['nombre'],
+            'Activo' if cultivo.get('activo', True) else 'Finalizado',
+            cultivo['fecha_siembra'].strftime('%Y-%m-%d') if cultivo.get('fecha_siembra') else '',
+            cultivo['fecha_cosecha'].strftime('%Y-%m-%d') if cultivo.get('fecha_cosecha') else '',
+            metrica['dias_cultivo'] if metrica['dias_cultivo'] is not None else "",
+            cultivo.get('numero_plantas', 1),
+            format_spanish_number(cultivo.get('precio_por_kilo', 0), 2),
+            metrica['total_unidades'],
+            format_spanish_number(metrica['total_kilos'], 1),
+            format_spanish_number(peso_por_unidad, 3) if peso_por_unidad > 0 else "0",
+            format_spanish_number(metrica['beneficio'], 2),
+            len(cultivo.get('abonos', [])),
+            format_spanish_number(metrica['rentabilidad'], 1)
+        ]
+
+def json_production(registro: Dict) -> Dict:
+    """Registro de producción en el export JSON"""
+    kilos = registro.get('kilos', 0)
+    unidades = registro.get('unidades', 0)
+    return {
+        'fecha': registro['fecha'].isoformat(),
+        'kilos': kilos,
+        'unidades': unidades,
+        'peso_unitario': float(kilos or 0) / unidades if unidades and unidades > 0 else 0.0
+    }
+
+def json_crop_data(cultivo: Dict, metricas: Dict, produccion_diaria: Optional[Iterable[Dict]]) -> Dict:
+    """Documento de un cultivo en el export JSON (produccion_diaria puede ser un iterador)"""
+    total_kilos_cultivo = metricas['total_kilos']
+    beneficio = metricas['beneficio']
+    dias_cultivo = metricas['dias_cultivo']
+    return {
+        'informacion_basica': {
+            'nombre': cultivo['nombre'],
+            'activo': cultivo.get('activo', True),
+            'numero_plantas': cultivo.get('numero_plantas', 1),
+            'precio_por_kilo': cultivo.get('precio_por_kilo', 0)
+        },
+        'fechas': {
+            'fecha_siembra': cultivo['fecha_siembra'].isoformat() if cultivo.get('fecha_siembra') else None,
+            'fecha_cosecha': cultivo['fecha_cosecha'].isoformat() if cultivo.get('fecha_cosecha') else None,
+            'dias_cultivo': dias_cultivo
+        },
+        'produccion': {
+            'total_kilos': total_kilos_cultivo,
+            'total_unidades': metricas['total_unidades'],
+            'peso_por_unidad': metricas['peso_por_unidad'],
+            'beneficio_total': beneficio,
+            'produccion_diaria': produccion_diaria
+        },
+        'mantenimiento': {
+            'total_abonos': len(cultivo.get('abonos', [])),
+            'abonos_detallados': [
+                {
+                    'fecha': a['fecha'].isoformat() if 'fecha' in a else None,
+                    'descripcion': a.get('descripcion', '')
+                } for a in cultivo.get('abonos', [])
+            ]
+        },
+        'estadisticas': {
+            'rentabilidad_porcentaje': metricas['rentabilidad'],
+            'productividad_por_planta': total_kilos_cultivo / cultivo.get('numero_plantas', 1),
+            'beneficio_por_dia': beneficio / dias_cultivo if dias_cultivo and dias_cultivo > 0 else 0
+        }
+    }
+
+def json_summary(snapshot: Dict, user: Optional[Dict]) -> Dict:
+    """Bloque 'resumen' del export JSON"""
+    return {
+        'total_cultivos': len(snapshot['cultivos']),
+        'total_kilos': snapshot['total_kilos'],
+        'total_beneficios': snapshot['total_beneficios'],
+        'fecha_exportacion': datetime.datetime.now().isoformat(),
+        'usuario': user['uid'] if user else 'demo'
+    }
+
+def json_export_document(resumen: Dict, snapshot: Dict, produccion_de: Callable[[Dict], Iterable[Dict]]) -> Dict:
+    """
+    Documento del export JSON, para codificarlo con iter_json
+    
+    Los cultivos son un generador y la producción de cada uno se pide a
+    produccion_de (registros ya convertidos con json_production) al llegar
+    a ese cultivo.
+    """
+    return {
+        'resumen': resumen,
+        'cultivos_detallados': (
+            json_crop_data(cultivo, snapshot['metricas'][cultivo.get('id')], produccion_de(cultivo))
+            for cultivo in snapshot['cultivos']
+        )
+    }
+
+def _arrow_timestamps(epochs):
+    """Columna timestamp[ms, UTC] desde segundos epoch (NaN o None pasan a nulo)"""
+    import numpy as np
+    import pyarrow as pa
+
+    valores = np.array(epochs, dtype=np.float64)
+    nulos = np.isnan(valores)
+    milisegundos = np.rint(np.where(nulos, 0, valores) * 1000).astype(np.int64)
+    return pa.array(milisegundos, type=pa.timestamp('ms', tz='UTC'), mask=nulos)
+
+def arrow_table(snapshot: Dict, tabla: str):
+    """
+    Tabla pyarrow con tipos de una instantánea con producción
+
+    'produccion' sale directamente de las columnas del motor de analytics
+    (una fila por registro, con el cultivo como diccionario), 'cultivos' de
+    sus totales por cultivo y 'abonos' de los cultivos. Las fechas son
+    timestamp UTC y los números conservan su tipo.
+
+    Args:
+        snapshot (Dict): Instantánea con 'analitica' y la producción cargada
+            (CropService.get_user_snapshot con include_production=True)
+        tabla (str): Una de ARROW_TABLES
+
+    Returns:
+        pyarrow.Table: Tabla pedida
+
+    Raises:
+        ValueError: Si la tabla no existe
+    """
+    import numpy as np
+    import pyarrow as pa
+    from app.services.crop_service import CropService
+
+    cultivos = snapshot['cultivos']
+    motor = snapshot['analitica']
+    ids = pa.array([str(c.get('id', '')) for c in cultivos], type=pa.string())
+
+    if tabla == 'produccion':
+        indices = pa.array(motor.cultivo.astype(np.int32))
+        return pa.table({
+            'cultivo_id': pa.DictionaryArray.from_arrays(indices, ids),
+            'cultivo': pa.DictionaryArray.from_arrays(indices, pa.array([c.get('nombre', '') for c in cultivos], type=pa.string())),
+            'fecha': _arrow_timestamps(motor.fecha),
+            'kilos': pa.array(motor.kilos_registro),
+            'unidades': pa.array(motor.unidades_registro),
+            'peso_unitario': pa.array(motor.peso_unitario()),
+            'precio_por_kilo': pa.array(motor.precio_registro),
+            'beneficio': pa.array(motor.kilos_registro * motor.precio_registro)
+        })
+
+    if tabla == 'cultivos':
+        metricas = [snapshot['metricas'][c.get('id')] for c in cultivos]
+        return pa.table({
+            'id': ids,
+            'nombre': pa.array([c.get('nombre', '') for c in cultivos], type=pa.string()),
+            'activo': pa.array([bool(c.get('activo', True)) for c in cultivos], type=pa.bool_()),
+            'fecha_siembra': _arrow_timestamps([CropService._to_epoch(c.get('fecha_siembra')) for c in cultivos]),
+            'fecha_cosecha': _arrow_timestamps([CropService._to_epoch(c.get('fecha_cosecha')) for c in cultivos]),
+            'dias_cultivo': pa.array([m['dias_cultivo'] for m in metricas], type=pa.int32()),
+            'numero_plantas': pa.array([int(c.get('numero_plantas') or 1) for c in cultivos], type=pa.int64()),
+            'precio_por_kilo': pa.array(motor.precio),
+            'total_kilos': pa.array(motor.kilos),
+            'total_unidades': pa.array(motor.unidades),
+            'peso_por_unidad': pa.array(motor.peso_por_unidad),
+            'beneficio': pa.array(motor.beneficio),
+            'rentabilidad': pa.array(np.asarray(motor.rentabilidad, dtype=np.float64)),
+            'total_abonos': pa.array([m['total_abonos'] for m in metricas], type=pa.int32())
+        })
+
+    if tabla == 'abonos':
+        abonos = [(str(c.get('id', '')), a) for c in cultivos for a in c.get('abonos', [])]
+        return pa.table({
+            'cultivo_id': pa.array([cultivo_id for cultivo_id, _ in abonos], type=pa.string()),
+            'fecha': _arrow_timestamps([CropService._to_epoch(a.get('fecha')) for _, a in abonos]),
+            'descripcion': pa.array([a.get('descripcion', '') for _, a in abonos], type=pa.string())
+        })
+
+    raise ValueError(f"tabla debe ser una de {', '.join(ARROW_TABLES)}")
+
+def write_arrow(destino, tabla, formato: str) -> None:
+    """
+    Escribir una tabla pyarrow como Parquet o como fichero Arrow IPC
+
+    Ambos con compresión zstd por columna. Se leen con pandas.read_parquet
+    o pandas.read_feather (pyarrow.ipc.open_file) conservando los tipos.
+
+    Args:
+        destino: Ruta o fichero binario
+        tabla (pyarrow.Table): Tabla a escribir (ver arrow_table)
+        formato (str): 'parquet' o 'arrow' (ver ARROW_FORMATS)
+    """
+    import pyarrow as pa
+
+    if formato == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(tabla, destino, compression='zstd')
+        return
+    opciones = pa.ipc.IpcWriteOptions(compression='zstd')
+    with pa.ipc.new_file(destino, tabla.schema, options=opciones) as writer:
+        writer.write_table(tabla)
+
+def report_format(formato: str, motor: Optional[str] = None) -> str:
+    """
+    Formato de informe para un formato pedido y un motor PDF
+    
+    Args:
+        formato (str): 'excel' o 'pdf'
+        motor (Optional[str]): 'reportlab' o 'weasyprint' (sólo para 'pdf';
+            sin él, 'reportlab')
+    
+    Returns:
+        str: Clave de EXPORT_FORMATS ('pdf' con WeasyPrint es 'pdf_weasyprint')
+    
+    Raises:
+        ValueError: Si el motor no existe
+    """
+    if formato != 'pdf' or not motor:
+        return formato
+    if motor not in PDF_ENGINE_FORMATS:
+        raise ValueError(f"motor debe ser uno de {', '.join(PDF_ENGINE_FORMATS)}")
+    return PDF_ENGINE_FORMATS[motor]
+
+def export_filename(formato: str, user: Optional[Dict]) -> str:
+    """Nombre de descarga de un informe (huerto_analisis_<uid>.xlsx, huerto_demo_reporte.pdf...)"""
+    info = EXPORT_FORMATS[formato]
+    if user:
+        return f"huerto_{info['nombre']}_{user['uid'][:8]}.{info['extension']}"
+    return f"huerto_demo_{info['nombre']}.{info['extension']}"
+
+def report_title(user: Optional[Dict]) -> str:
+    """Línea de usuario bajo el título del informe PDF"""
+    return f"Usuario: {user.get('email', 'Premium')}" if user else "Modo Demo"
+
+def write_bundle_part(formato: str, destino: str, datos: Dict) -> str:
+    """
+    Escribir un formato del paquete ZIP en un fichero
+    
+    Se ejecuta en un proceso del pool de paquetes, así que sólo usa los
+    datos recibidos (ni Firestore ni Flask).
+    
+    Args:
+        formato (str): Clave de BUNDLE_FORMATS
+        destino (str): Ruta del fichero
+        datos (Dict): Datos de ExportService.bundle_data
+    
+    Returns:
+        str: El formato escrito
+    
+    Raises:
+        ValueError: Si el formato no existe
+    """
+    snapshot = datos['snapshot']
+    registros = datos['registros']
+    
+    def registros_de(cultivo):
+        return registros.get(cultivo.get('id')) or []
+    
+    if formato == 'csv':
+        import csv
+        cultivos = snapshot['cultivos']
+        with open(destino, 'w', encoding='utf-8', newline='') as archivo:
+            writer = csv.writer(archivo)
+            writer.writerow(CSV_CROP_HEADER)
+            writer.writerows(csv_crop_rows(cultivos, [snapshot['metricas'][c.get('id')] for c in cultivos]))
+    elif formato == 'json':
+        documento = json_export_document(datos['resumen'], snapshot, lambda c: map(json_production, registros_de(c)))
+        with open(destino, 'w', encoding='utf-8') as archivo:
+            archivo.writelines(iter_json(documento, indent=2))
+    elif formato == 'excel':
+        write_excel(destino, snapshot, registros_de)
+    elif formato == 'pdf':
+        from app.services.pdf_service import write_pdf
+        write_pdf(destino, snapshot, datos['titulo_usuario'], graficas=datos['graficas'])
+    else:
+        raise ValueError(f"formato de paquete desconocido: {formato}")
+    return formato
+
+def _without_history(datos: Dict) -> Dict:
+    """Datos del paquete sin registros de producción (menos que copiar a cada proceso)"""
+    copias = {id(c): {k: v for k, v in c.items() if k != 'produccion_diaria'} for c in datos['snapshot']['cultivos']}
+    snapshot = dict(
+        datos['snapshot'],
+        cultivos=list(copias.values()),
+        ranking=[copias.get(id(c), c) for c in datos['snapshot']['ranking']]
+    )
+    return dict(datos, snapshot=snapshot, registros={})
+
+class _ZipStream:
+    """Destino sin seek para ZipFile: guarda lo escrito hasta que se recoge con take()"""
+    
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+        self.pendiente = 0
+    
+    def write(self, datos) -> int:
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        self.pendiente += len(datos)
+        return len(datos)
+    
+    def tell(self) -> int:
+        return self._posicion
+    
+    def flush(self) -> None:
+        pass
+    
+    def take(self) -> bytes:
+        datos = b''.join(self._partes)
+        self._partes.clear()
+        self.pendiente = 0
+        return datos
+
+def _zip_file(zf: zipfile.ZipFile, salida: _ZipStream, ruta: str, nombre: str,
+              comprimir: bool, tamano_bloque: int) -> Iterator[bytes]:
+    """Añadir un fichero al ZIP por bloques y devolver los bytes del ZIP según se generan"""
+    info = zipfile.ZipInfo(nombre, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if comprimir else zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    info.file_size = os.path.getsize(ruta)  # Para decidir si hace falta ZIP64
+    with open(ruta, 'rb') as origen, zf.open(info, 'w') as destino:
+        while True:
+            bloque = origen.read(tamano_bloque)
+            if not bloque:
+                break
+            destino.write(bloque)
+            if salida.pendiente >= tamano_bloque:
+                yield salida.take()
+
+_bundle_pool = None
+_bundle_pool_lock = threading.Lock()
+
+def get_bundle_pool() -> ProcessPoolExecutor:
+    """Obtener (creando si hace falta) el pool de procesos de los paquetes ZIP"""
+    global _bundle_pool
+    with _bundle_pool_lock:
+        if _bundle_pool is None:
+            from flask import current_app, has_app_context
+            app_config = current_app.config if has_app_context() else {}
+            # 'spawn': los procesos no heredan los hilos ni las conexiones de gRPC del servidor
+            _bundle_pool = ProcessPoolExecutor(
+                max_workers=max(1, int(app_config.get('EXPORT_BUNDLE_WORKERS', 4))),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+    return _bundle_pool
+
+def _discard_bundle_pool(pool: ProcessPoolExecutor) -> None:
+    """Olvidar un pool roto (un proceso murió) para que la siguiente petición cree otro"""
+    global _bundle_pool
+    with _bundle_pool_lock:
+        if _bundle_pool is pool:
+            print("⚠️ Pool de paquetes de exportación caído, se vuelve a crear")
+            _bundle_pool = None
+    pool.shutdown(wait=False)
+
+class ExportService:
+    """Servicio de generación de ficheros de exportación"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def write_report(self, formato: str, destino, user: Optional[Dict],
+                     progreso: Optional[Callable[[float], None]] = None) -> None:
+        """
+        Escribir el informe de un usuario (o de los datos demo) en un formato
+
+        Args:
+            formato (str): 'excel', 'pdf' o 'pdf_weasyprint' (ver EXPORT_FORMATS)
+            destino: Ruta o fichero binario con seek
+            user (Optional[Dict]): Usuario autenticado, o None en modo demo
+            progreso (Optional[Callable[[float], None]]): Recibe la fracción
+                completada (0 a 1) durante la generación
+
+        Raises:
+            ValueError: Si el formato no existe
+            ImportError: Si el formato es 'pdf_weasyprint' y WeasyPrint no
+                está instalado
+        """
+        from app.services.crop_service import CropService
+
+        if formato not in EXPORT_FORMATS:
+            raise ValueError(f"formato de exportación desconocido: {formato}")
+        avisar = progreso or (lambda fraccion: None)
+        
+        crop_service = CropService(self.db)
+        if user:
+            snapshot = crop_service.get_user_snapshot(user['uid'], include_production=False)
+        else:
+            snapshot = crop_service.get_demo_snapshot()
+        avisar(0.1)
+        
+        if formato in PDF_ENGINE_FORMATS.values():
+            from app.services.pdf_service import PdfService, get_weasyprint_pool, render_report_html, write_pdf
+            titulo_usuario = report_title(user)
+            graficas = PdfService(self.db).get_charts(snapshot, user)
+            avisar(0.3)
+            if formato == 'pdf':
+                write_pdf(destino, snapshot, titulo_usuario, graficas=graficas)
+            else:
+                # El HTML se genera aquí (plantillas de Flask) y se maqueta en el pool
+                contenido = get_weasyprint_pool().render(render_report_html(snapshot, titulo_usuario, graficas=graficas))
+                if isinstance(destino, str):
+                    with open(destino, 'wb') as archivo:
+                        archivo.write(contenido)
+                else:
+                    destino.write(contenido)
+            avisar(1.0)
+            return
+        
+        cultivos = snapshot['cultivos']
+        leidos = []
+        
+        def registros_de(cultivo):
+            # El avance se mide por cultivos cuya producción ya se ha leído
+            leidos.append(cultivo.get('id'))
+            avisar(0.1 + 0.8 * (len(leidos) - 1) / max(len(cultivos), 1))
+            if user:
+                return crop_service.iter_crop_productions(user['uid'], cultivo.get('id'))
+            return cultivo.get('produccion_diaria') or []
+        
+        write_excel(destino, snapshot, registros_de)
+        avisar(1.0)
+    
+    def columnar_file(self, formato: str, tabla: str, user: Optional[Dict]) -> tempfile.SpooledTemporaryFile:
+        """
+        Tabla de producción, cultivos o abonos en Parquet o Arrow IPC
+
+        Args:
+            formato (str): 'parquet' o 'arrow' (ver ARROW_FORMATS)
+            tabla (str): Una de ARROW_TABLES
+            user (Optional[Dict]): Usuario autenticado, o None en modo demo
+
+        Returns:
+            tempfile.SpooledTemporaryFile: Fichero en la posición 0
+
+        Raises:
+            ValueError: Si el formato o la tabla no existen
+            ImportError: Si pyarrow no está instalado
+        """
+        from app.services.crop_service import CropService
+
+        if formato not in ARROW_FORMATS or tabla not in ARROW_TABLES:
+            raise ValueError(f"formato debe ser uno de {', '.join(ARROW_FORMATS)} y tabla una de {', '.join(ARROW_TABLES)}")
+        crop_service = CropService(self.db)
+        if user:
+            # La tabla de producción necesita el historial en el motor
+            snapshot = crop_service.get_user_snapshot(user['uid'], include_production=tabla == 'produccion')
+        else:
+            snapshot = crop_service.get_demo_snapshot()
+
+        archivo = tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_BYTES)
+        try:
+            write_arrow(archivo, arrow_table(snapshot, tabla), formato)
+        except Exception:
+            archivo.close()
+            raise
+        archivo.seek(0)
+        return archivo
+
+    def bundle_data(self, user: Optional[Dict], formatos: List[str]) -> Dict:
+        """
+        Datos de un paquete ZIP, leídos una sola vez para todos los formatos
+        
+        Args:
+            user (Optional[Dict]): Usuario autenticado, o None en modo demo
+            formatos (List[str]): Claves de BUNDLE_FORMATS
+        
+        Returns:
+            Dict: 'snapshot' (con métricas, sin motor de análisis),
+                'registros' (id de cultivo -> registros en orden de fecha),
+                'resumen' (JSON), 'titulo_usuario' y 'graficas' (PDF)
+        """
+        from app.services.crop_service import CropService
+        
+        crop_service = CropService(self.db)
+        if user:
+            snapshot = crop_service.get_user_snapshot(user['uid'], include_production=True)
+        else:
+            snapshot = crop_service.get_demo_snapshot()
+        # Los procesos reciben una copia: el motor de análisis no hace falta
+        snapshot = {clave: valor for clave, valor in snapshot.items() if clave != 'analitica'}
+        graficas = []
+        if 'pdf' in formatos:
+            from app.services.pdf_service import PdfService
+            graficas = PdfService(self.db).get_charts(snapshot, user)
+        return {
+            'snapshot': snapshot,
+            # Las mismas listas que llevan los cultivos (se copian una vez al enviarlas)
+            'registros': {c.get('id'): c.get('produccion_diaria') or [] for c in snapshot['cultivos']},
+            'resumen': json_summary(snapshot, user),
+            'titulo_usuario': report_title(user),
+            'graficas': graficas
+        }
+    
+    def iter_bundle(self, datos: Dict, formatos: List[str], tamano_bloque: int = 64 * 1024,
+                    timeout: Optional[float] = None) -> Iterator[bytes]:
+        """
+        Paquete ZIP con varios formatos generados a la vez
+        
+        Cada formato se escribe en un proceso del pool de paquetes (ver
+        get_bundle_pool) y se añade al ZIP en cuanto termina, mientras los
+        demás siguen: el paquete tarda como el formato más lento, no como la
+        suma. El ZIP se envía por bloques sin guardarlo entero. Si un formato
+        falla o no termina en timeout segundos, el paquete lleva
+        'errores.txt' en su lugar.
+        
+        Args:
+            datos (Dict): Datos de bundle_data
+            formatos (List[str]): Claves de BUNDLE_FORMATS
+            tamano_bloque (int): Bytes aproximados de cada bloque enviado
+            timeout (Optional[float]): Segundos máximos para todos los formatos
+        
+        Yields:
+            bytes: Bloques del fichero ZIP
+        """
+        inicio = time.perf_counter()
+        directorio = tempfile.mkdtemp(prefix='huerto_paquete_')
+        salida = _ZipStream()
+        pool = get_bundle_pool()
+        futuros = {}
+        errores = []
+        try:
+            ligeros = None
+            try:
+                for formato in formatos:
+                    ruta = os.path.join(directorio, BUNDLE_FORMATS[formato]['fichero'])
+                    if BUNDLE_FORMATS[formato]['historial']:
+                        parte = datos
+                    else:
+                        ligeros = ligeros or _without_history(datos)
+                        parte = ligeros
+                    futuros[pool.submit(write_bundle_part, formato, ruta, parte)] = formato
+            except BrokenProcessPool:
+                _discard_bundle_pool(pool)
+                raise
+            
+            with zipfile.ZipFile(salida, 'w') as zf:
+                try:
+                    for futuro in as_completed(futuros, timeout=timeout):
+                        formato = futuros[futuro]
+                        try:
+                            futuro.result()
+                        except Exception as e:
+                            print(f"❌ Error generando {formato} del paquete: {e}")
+                            if isinstance(e, BrokenProcessPool):
+                                _discard_bundle_pool(pool)
+                            errores.append(formato)
+                            continue
+                        info = BUNDLE_FORMATS[formato]
+                        yield from _zip_file(zf, salida, os.path.join(directorio, info['fichero']),
+                                             info['fichero'], info['comprimir'], tamano_bloque)
+                except FuturesTimeoutError:
+                    pendientes = [formato for futuro, formato in futuros.items() if not futuro.done()]
+                    print(f"⏱️ Formatos del paquete sin terminar a tiempo: {', '.join(pendientes)}")
+                    errores.extend(pendientes)
+                if errores:
+                    zf.writestr('errores.txt', f"No se pudieron generar: {', '.join(errores)}\n")
+            yield salida.take()
+            print(f"📦 Paquete de {len(formatos) - len(errores)} formatos generado en {time.perf_counter() - inicio:.2f}s")
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+            shutil.rmtree(directorio, ignore_errors=True)
+    
+    def report_file(self, formato: str, user: Optional[Dict]) -> tempfile.SpooledTemporaryFile:
+        """
+        Informe de un usuario (o de los datos demo) en un fichero temporal
+        
+        Args:
+            formato (str): 'excel' o 'pdf' (ver EXPORT_FORMATS)
+            user (Optional[Dict]): Usuario autenticado, o None en modo demo
+
+        Returns:
+            tempfile.SpooledTemporaryFile: Fichero en la posición 0, en memoria
+                hasta EXCEL_SPOOL_BYTES y en disco a partir de ahí
+        """
+        archivo = tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_BYTES)
+        try:
+            self.write_report(formato, archivo, user)
+        except Exception:
+            archivo.close()
+            raise
+        archivo.seek(0)
+        return archivo
+
+class ExportJob:
+    """Trabajo de exportación de un informe para una versión de datos"""
+    
+    def __init__(self, user: Dict, formato: str, version: int):
+        self.id = uuid.uuid4().hex
+        self.user = {'uid': user['uid'], 'email': user.get('email')}
+        self.formato = formato
+        self.version = version
+        self.estado = JOB_PENDING
+        self.progreso = 0.0
+        self.error = None
+        self.ruta = None
+        self.creado = time.time()
+        self.terminado = None
+        self.cambios = 0  # Crece con cada cambio de estado o progreso (eventos SSE)
+    
+    @property
+    def terminal(self) -> bool:
+        return self.estado in (JOB_DONE, JOB_FAILED)
+    
+    def to_dict(self) -> Dict:
+        """Estado público del trabajo (sin rutas del servidor)"""
+        return {
+            'id': self.id,
+            'formato': self.formato,
+            'version': self.version,
+            'estado': self.estado,
+            'progreso': round(self.progreso * 100),
+            'error': self.error
+        }
+
+class ExportJobs:
+    """
+    Cola local de trabajos de exportación y ficheros generados
+    
+    Los trabajos se ejecutan en un ThreadPoolExecutor propio del proceso,
+    fuera del hilo de la petición. Cada fichero terminado se guarda en disco
+    con nombre (usuario, formato, versión de datos): mientras la versión no
+    cambie se sirve ese fichero sin generar nada. Las peticiones iguales
+    (mismo usuario, formato y versión) que llegan con un trabajo en marcha
+    reciben ese mismo trabajo en lugar de lanzar otro.
+    
+    El registro de trabajos vive en memoria del proceso; los ficheros están
+    en EXPORT_ARTIFACT_DIR y los comparten los procesos de la misma máquina.
+    """
+    
+    def __init__(self, app, directorio: Optional[str] = None, max_workers: int = 2,
+                 ttl_seconds: float = 3600, max_files: int = 200):
+        self.app = app
+        self.directorio = directorio or os.path.join(tempfile.gettempdir(), 'huerto_exports')
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_files = max(1, int(max_files))
+        os.makedirs(self.directorio, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix='export')
+        self._cambio = threading.Condition()
+        self._trabajos = {}
+        self._por_clave = {}
+    
+    def _prefijo(self, uid: str, formato: str) -> str:
+        # El UID no va en claro en el nombre del fichero
+        return f"{hashlib.sha256(uid.encode('utf-8')).hexdigest()[:16]}_{formato}_"
+    
+    def _patron(self, uid: str, formato: str):
+        # Sólo ficheros de ese formato: el prefijo de 'pdf' también es el comienzo de 'pdf_weasyprint_'
+        extension = re.escape(EXPORT_FORMATS[formato]['extension'])
+        return re.compile(rf"^{re.escape(self._prefijo(uid, formato))}\d+(-[0-9a-f]+)?\.{extension}$")
+    
+    def artifact_path(self, uid: str, formato: str, version: int) -> str:
+        """Ruta del fichero generado para un usuario, formato y versión de datos"""
+        return os.path.join(self.directorio, f"{self._prefijo(uid, formato)}{version}.{EXPORT_FORMATS[formato]['extension']}")
+    
+    def find_artifact(self, uid: str, formato: str, version: int) -> Optional[str]:
+        """Ruta del fichero ya generado para esa versión, si existe y no ha caducado"""
+        ruta = self.artifact_path(uid, formato, version)
+        try:
+            if time.time() - os.path.getmtime(ruta) < self.ttl_seconds:
+                return ruta
+        except OSError:
+            pass
+        return None
+    
+    def submit(self, user: Dict, formato: str, version: int) -> ExportJob:
+        """
+        Pedir un informe: trabajo en marcha, fichero ya generado o trabajo nuevo
+        
+        Args:
+            user (Dict): Usuario autenticado (se usan 'uid' y 'email')
+            formato (str): 'excel' o 'pdf'
+            version (int): Versión de datos actual del usuario
+        
+        Returns:
+            ExportJob: Trabajo (puede estar ya completado)
+        
+        Raises:
+            ValueError: Si el formato no existe
+        """
+        if formato not in EXPORT_FORMATS:
+            raise ValueError(f"formato de exportación desconocido: {formato}")
+        clave = (user['uid'], formato, version)
+        
+        with self._cambio:
+            self._prune_jobs()
+            existente = self._trabajos.get(self._por_clave.get(clave))
+            if existente and existente.estado != JOB_FAILED and (not existente.terminal or os.path.exists(existente.ruta)):
+                return existente
+            
+            job = ExportJob(user, formato, version)
+            self._trabajos[job.id] = job
+            self._por_clave[clave] = job.id
+            ruta = self.find_artifact(user['uid'], formato, version)
+            if ruta:
+                job.estado, job.progreso, job.ruta, job.terminado = JOB_DONE, 1.0, ruta, time.time()
+                return job
+        
+        print(f"📦 Exportación {formato} en cola para {user['uid'][:8]} (versión {version})")
+        self._pool.submit(self._run, job)
+        return job
+    
+    def get(self, job_id: str, uid: str) -> Optional[ExportJob]:
+        """Trabajo por id, sólo si pertenece al usuario"""
+        with self._cambio:
+            job = self._trabajos.get(job_id)
+        return job if job and job.user['uid'] == uid else None
+    
+    def wait(self, job: ExportJob, cambios: int = -1, timeout: Optional[float] = None) -> Dict:
+        """
+        Esperar a que el trabajo cambie respecto a 'cambios' o termine
+        
+        Args:
+            job (ExportJob): Trabajo observado
+            cambios (int): Último valor de job.cambios visto (-1: no esperar)
+            timeout (Optional[float]): Segundos máximos de espera
+        
+        Returns:
+            Dict: Estado (to_dict) con 'cambios' para la siguiente espera
+        """
+        with self._cambio:
+            self._cambio.wait_for(lambda: job.terminal or job.cambios != cambios, timeout=timeout)
+            estado = job.to_dict()
+            estado['cambios'] = job.cambios
+        return estado
+    
+    def wait_done(self, job: ExportJob, timeout: float) -> bool:
+        """Esperar a que el trabajo termine; False si se agota el tiempo"""
+        with self._cambio:
+            return self._cambio.wait_for(lambda: job.terminal, timeout=timeout)
+    
+    def _update(self, job: ExportJob, **cambios) -> None:
+        with self._cambio:
+            for atributo, valor in cambios.items():
+                setattr(job, atributo, valor)
+            job.cambios += 1
+            self._cambio.notify_all()
+    
+    def _run(self, job: ExportJob) -> None:
+        """Generar el informe en un hilo del pool y guardarlo como fichero de la versión"""
+        from flask import g
+        from app.services.crop_service import CropService
+        
+        uid = job.user['uid']
+        temporal = os.path.join(self.directorio, f".{job.id}.tmp")
+        try:
+            with self.app.app_context():
+                self._update(job, estado=JOB_RUNNING)
+                inicio = time.perf_counter()
+                ExportService(self.app.db).write_report(
+                    job.formato, temporal, job.user,
+                    progreso=lambda fraccion: self._update(job, progreso=min(fraccion, 0.99))
+                )
+                # Si hubo escrituras durante la generación el fichero puede
+                # mezclar versiones: se entrega a este trabajo pero no se reutiliza
+                g.pop('data_versions', None)
+                version_final = CropService(self.app.db).get_data_version(uid)
+            if version_final == job.version:
+                ruta = self.artifact_path(uid, job.formato, job.version)
+            else:
+                ruta = os.path.join(self.directorio, f"{self._prefijo(uid, job.formato)}{job.version}-{job.id}.{EXPORT_FORMATS[job.formato]['extension']}")
+            os.replace(temporal, ruta)
+            self._prune_files(uid, job.formato, ruta)
+            print(f"✅ Exportación {job.formato} de {uid[:8]} generada en {time.perf_counter() - inicio:.2f}s")
+            self._update(job, estado=JOB_DONE, progreso=1.0, ruta=ruta, terminado=time.time())
+        except Exception as e:
+            print(f"❌ Error generando exportación {job.formato} de {uid[:8]}: {e}")
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            self._update(job, estado=JOB_FAILED, error='No se pudo generar el informe', terminado=time.time())
+    
+    def _prune_jobs(self) -> None:
+        # Llamar con el candado tomado
+        limite = time.time() - self.ttl_seconds
+        for job_id in [j.id for j in self._trabajos.values() if j.terminal and j.terminado < limite]:
+            job = self._trabajos.pop(job_id)
+            clave = (job.user['uid'], job.formato, job.version)
+            if self._por_clave.get(clave) == job_id:
+                del self._por_clave[clave]
+    
+    def _prune_files(self, uid: str, formato: str, conservar: str) -> None:
+        """Borrar versiones anteriores del mismo informe, ficheros caducados y los que sobran"""
+        ahora = time.time()
+        patron = self._patron(uid, formato)
+        ficheros = []
+        for ruta in glob.glob(os.path.join(self.directorio, '*_*_*.*')):
+            try:
+                modificado = os.path.getmtime(ruta)
+                anterior = patron.match(os.path.basename(ruta)) is not None and ruta != conservar
+                if anterior or ahora - modificado >= self.ttl_seconds:
+                    os.remove(ruta)
+                else:
+                    ficheros.append((modificado, ruta))
+            except OSError:
+                continue  # Borrado por otro proceso
+        for _, ruta in sorted(ficheros)[:max(0, len(ficheros) - self.max_files)]:
+            if ruta != conservar:
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+
+_export_jobs = None
+_export_jobs_lock = threading.Lock()
+
+def get_export_jobs() -> ExportJobs:
+    """Obtener (creando si hace falta) la cola de trabajos de exportación del proceso"""
+    global _export_jobs
+    with _export_jobs_lock:
+        if _export_jobs is None:
+            from flask import current_app
+            _export_jobs = ExportJobs(
+                current_app._get_current_object(),
+                directorio=current_app.config.get('EXPORT_ARTIFACT_DIR'),
+                max_workers=current_app.config.get('EXPORT_JOB_WORKERS', 2),
+                ttl_seconds=current_app.config.get('EXPORT_ARTIFACT_TTL_SECONDS', 3600),
+                max_files=current_app.config.get('EXPORT_ARTIFACT_MAX_FILES', 200)
+            )
+    return _export_jobs
@@ -0,0 +1,298 @@
+"""
+Servicio de importación de producción
+Lectura en streaming de CSV y Excel con el formato de las exportaciones,
+deduplicación frente al historial y escritura por lotes
+"""
+import csv
+import datetime
+import io
+import itertools
+import os
+from typing import Dict, Iterator, Optional, Tuple
+
+# Filas válidas por llamada a CropService.add_productions_batch (un aviso de progreso por lote)
+IMPORT_BATCH_ROWS = 500
+
+# Filas en las que se busca la cabecera (las exportaciones llevan un título encima)
+IMPORT_HEADER_SCAN_ROWS = 10
+
+# Errores de fila que se devuelven con detalle (el resto sólo se cuentan)
+IMPORT_MAX_ERRORS = 50
+
+# Columnas reconocidas: nombre normalizado de la cabecera -> campo
+IMPORT_COLUMNS = {
+    'cultivo': 'cultivo',
+    'fecha': 'fecha',
+    'hora': 'hora',
+    'kilos': 'kilos',
+    'kg': 'kilos',
+    'unidades': 'unidades'
+}
+
+def parse_number(valor) -> Optional[float]:
+    """
+    Número de una celda, también con formato español ('1,5', '1.234,5 €')
+
+    Returns:
+        Optional[float]: Valor, o None si la celda está vacía
+
+    Raises:
+        ValueError: Si el texto no es un número
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    texto = str(valor).replace('€', '').replace(' ', '').strip()
+    if not texto:
+        return None
+    if ',' in texto:
+        # Coma decimal: el punto, si lo hay, separa miles
+        texto = texto.replace('.', '').replace(',', '.')
+    return float(texto)
+
+def parse_import_date(fecha, hora=None) -> Tuple[datetime.datetime, bool]:
+    """
+    Fecha de una fila importada y si incluye la hora
+
+    Acepta fechas de Excel, ISO 8601 ('2024-05-01', '2024-05-01T10:30') y
+    el formato español 'dd/mm/aaaa'; la hora puede ir en su propia columna
+    ('HH:MM', como la exportación CSV).
+
+    Returns:
+        Tuple[datetime.datetime, bool]: (fecha, tiene hora)
+
+    Raises:
+        ValueError: Si la fecha o la hora no se reconocen
+    """
+    if isinstance(fecha, datetime.datetime):
+        valor, con_hora = fecha, fecha.time() != datetime.time(0)
+    elif isinstance(fecha, datetime.date):
+        valor, con_hora = datetime.datetime.combine(fecha, datetime.time(0)), False
+    else:
+        texto = str(fecha or '').strip()
+        if not texto:
+            raise ValueError('fecha requerida')
+        try:
+            if '/' in texto:
+                valor = datetime.datetime.strptime(texto, '%d/%m/%Y')
+            else:
+                valor = datetime.datetime.fromisoformat(texto.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f'fecha inválida: {texto}')
+        con_hora = len(texto) > 10
+
+    if hora not in (None, ''):
+        if isinstance(hora, datetime.time):
+            hora_valor = hora
+        else:
+            try:
+                hora_valor = datetime.time.fromisoformat(str(hora).strip())
+            except ValueError:
+                raise ValueError(f'hora inválida: {hora}')
+        valor = datetime.datetime.combine(valor.date(), hora_valor, tzinfo=valor.tzinfo)
+        con_hora = True
+    return valor, con_hora
+
+def _dedup_key(crop_id: str, epoch: float, kilos: Optional[float], unidades: int, con_hora: bool) -> int:
+    """
+    Clave (hash) para detectar un registro repetido
+
+    Una fila con hora se compara al minuto y una sin hora (exportación
+    Excel) al día, porque las exportaciones no guardan los segundos ni, en
+    Excel, la hora. Sin kilos (sólo unidades) se compara sin ellos.
+    """
+    kilos = round(kilos, 3) if kilos is not None else None
+    if con_hora:
+        return hash((crop_id, 'm', int(epoch // 60), kilos, unidades))
+    return hash((crop_id, 'd', int(epoch // 86400), kilos, unidades))
+
+class ImportService:
+    """Servicio de importación masiva de registros de producción"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def read_rows(self, archivo, nombre_fichero: str) -> Tuple[Dict[str, int], Iterator[Tuple[int, tuple]]]:
+        """
+        Abrir un CSV o XLSX y leer su cabecera
+
+        El resto del fichero se lee fila a fila según se consume el iterador:
+        el CSV como texto y el Excel con openpyxl en modo sólo lectura (la
+        hoja 'Producción Diaria' si existe, si no la primera).
+
+        Args:
+            archivo: Fichero binario subido (con seek)
+            nombre_fichero (str): Nombre original, para saber el formato
+
+        Returns:
+            Tuple[Dict[str, int], Iterator[Tuple[int, tuple]]]: Columnas
+                (campo -> posición) y filas (número de fila, valores)
+
+        Raises:
+            ValueError: Si el formato no es CSV/XLSX o falta la cabecera
+        """
+        extension = os.path.splitext(nombre_fichero or '')[1].lower()
+        if extension == '.csv':
+            filas = self._csv_rows(archivo)
+        elif extension == '.xlsx':
+            filas = self._xlsx_rows(archivo)
+        else:
+            raise ValueError('Formato no soportado: sube un fichero .csv o .xlsx')
+
+        for numero, fila in itertools.islice(filas, IMPORT_HEADER_SCAN_ROWS):
+            columnas = {}
+            for posicion, titulo in enumerate(fila):
+                campo = IMPORT_COLUMNS.get(str(titulo or '').strip().lower())
+                if campo and campo not in columnas:
+                    columnas[campo] = posicion
+            if 'fecha' in columnas and ('kilos' in columnas or 'unidades' in columnas):
+                return columnas, filas
+        raise ValueError('No se encontró la cabecera: se necesitan las columnas Fecha y Kilos o Unidades')
+
+    @staticmethod
+    def _csv_rows(archivo) -> Iterator[Tuple[int, tuple]]:
+        """Filas de un CSV (UTF-8, separador ',' ';' o tabulador según la primera línea)"""
+        texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+        primera = texto.readline()
+        separador = max((',', ';', '\t'), key=primera.count)
+        lector = csv.reader(itertools.chain([primera], texto), delimiter=separador)
+        for numero, fila in enumerate(lector, 1):
+            yield numero, tuple(fila)
+
+    @staticmethod
+    def _xlsx_rows(archivo) -> Iterator[Tuple[int, tuple]]:
+        """Filas de un libro Excel en modo sólo lectura"""
+        from openpyxl import load_workbook
+
+        try:
+            wb = load_workbook(archivo, read_only=True, data_only=True)
+        except Exception:
+            raise ValueError('El fichero no es un Excel (.xlsx) válido')
+        try:
+            ws = wb['Producción Diaria'] if 'Producción Diaria' in wb.sheetnames else wb.worksheets[0]
+            for numero, fila in enumerate(ws.iter_rows(values_only=True), 1):
+                yield numero, fila
+        finally:
+            wb.close()
+
+    def import_rows(self, user_uid: str, columnas: Dict[str, int], filas: Iterator[Tuple[int, tuple]],
+                    crop_id: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Importar registros de producción leídos con read_rows
+
+        Cada fila se valida y se asigna a su cultivo por nombre (columna
+        Cultivo, sin distinguir mayúsculas) o a crop_id si se indica. Las
+        filas repetidas, frente al historial del cultivo o dentro del propio
+        fichero, se saltan. Las válidas se escriben en lotes de
+        IMPORT_BATCH_ROWS con CropService.add_productions_batch. En memoria
+        sólo están el lote en curso y las claves de deduplicación de los
+        cultivos que aparecen en el fichero.
+
+        Args:
+            user_uid (str): UID del usuario
+            columnas (Dict[str, int]): Columnas de read_rows
+            filas (Iterator[Tuple[int, tuple]]): Filas de read_rows
+            crop_id (Optional[str]): Cultivo de todas las filas (ignora la
+                columna Cultivo)
+
+        Yields:
+            Dict: Un aviso 'progreso' por lote escrito y un 'resumen' final,
+                con filas, importados, duplicados, errores y detalle_errores
+
+        Raises:
+            ValueError: Si falta la columna Cultivo sin crop_id, o crop_id no
+                es un cultivo del usuario
+        """
+        from app.services.crop_service import CropService
+
+        crop_service = CropService(self.db)
+        cultivos = crop_service.get_user_snapshot(user_uid, include_production=False, projection='chart')['cultivos']
+        por_nombre = {}
+        for cultivo in cultivos:
+            por_nombre.setdefault(str(cultivo.get('nombre', '')).strip().lower(), cultivo.get('id'))
+        if crop_id is not None and crop_id not in {c.get('id') for c in cultivos}:
+            raise ValueError('Cultivo no encontrado')
+        if crop_id is None and 'cultivo' not in columnas:
+            raise ValueError('Falta la columna Cultivo (o elige un cultivo para todo el fichero)')
+
+        estado = {'filas': 0, 'importados': 0, 'duplicados': 0, 'errores': 0, 'detalle_errores': []}
+        vistos = {}
+        lote = []
+
+        def error(numero, mensaje):
+            estado['errores'] += 1
+            if len(estado['detalle_errores']) < IMPORT_MAX_ERRORS:
+                estado['detalle_errores'].append({'fila': numero, 'error': mensaje})
+
+        def claves_existentes(id_cultivo):
+            # Claves del historial del cultivo, leídas la primera vez que aparece
+            if id_cultivo not in vistos:
+                claves = set()
+                for registro in crop_service.iter_crop_productions(user_uid, id_cultivo):
+                    epoch = CropService._to_epoch(registro.get('fecha'))
+                    if epoch is None:
+                        continue
+                    kilos = float(registro.get('kilos', 0) or 0)
+                    unidades = int(registro.get('unidades', 0) or 0)
+                    # Con y sin hora, con y sin kilos: como pueda venir en el fichero
+                    for con_hora in (True, False):
+                        claves.add(_dedup_key(id_cultivo, epoch, kilos, unidades, con_hora))
+                        claves.add(_dedup_key(id_cultivo, epoch, None, unidades, con_hora))
+                vistos[id_cultivo] = claves
+            return vistos[id_cultivo]
+
+        def escribir():
+            resultados = crop_service.add_productions_batch(user_uid, [registro for _, registro in lote])
+            for (numero, _), resultado in zip(lote, resultados):
+                if resultado['success']:
+                    estado['importados'] += 1
+                else:
+                    error(numero, resultado.get('error', 'No se pudo guardar'))
+            lote.clear()
+
+        def celda(fila, campo):
+            posicion = columnas.get(campo)
+            return fila[posicion] if posicion is not None and posicion < len(fila) else None
+
+        for numero, fila in filas:
+            if not any(valor not in (None, '') for valor in fila):
+                continue  # Fila vacía
+            estado['filas'] += 1
+
+            if crop_id is not None:
+                id_cultivo = crop_id
+            else:
+                nombre = str(celda(fila, 'cultivo') or '').strip()
+                id_cultivo = por_nombre.get(nombre.lower())
+                if id_cultivo is None:
+                    error(numero, f'Cultivo desconocido: {nombre}' if nombre else 'Cultivo vacío')
+                    continue
+            try:
+                fecha, con_hora = parse_import_date(celda(fila, 'fecha'), celda(fila, 'hora'))
+                kilos = parse_number(celda(fila, 'kilos'))
+                unidades = parse_number(celda(fila, 'unidades'))
+            except ValueError as e:
+                error(numero, str(e))
+                continue
+            if (kilos is None or kilos <= 0) and (unidades is None or unidades <= 0):
+                error(numero, 'Indica kilos o unidades')
+                continue
+
+            claves = claves_existentes(id_cultivo)
+            clave = _dedup_key(id_cultivo, CropService._to_epoch(fecha), kilos, int(unidades or 0), con_hora)
+            if clave in claves:
+                estado['duplicados'] += 1
+                continue
+            claves.add(clave)
+
+            lote.append((numero, {'crop_id': id_cultivo, 'kilos': kilos, 'unidades': unidades, 'fecha': fecha.isoformat()}))
+            if len(lote) >= IMPORT_BATCH_ROWS:
+                escribir()
+                yield {'tipo': 'progreso', **estado}
+
+        if lote:
+            escribir()
+        print(f"📥 Importación de {user_uid[:8]}: {estado['importados']} importados, "
+              f"{estado['duplicados']} duplicados, {estado['errores']} errores de {estado['filas']} filas")
+        yield {'tipo': 'resumen', **estado}
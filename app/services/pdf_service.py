@@ -0,0 +1,508 @@
+"""
+Servicio de informes PDF
+Estilos, tablas y plantilla del informe se construyen una vez por proceso;
+las gráficas (barras por cultivo y tendencia mensual) se dibujan una vez por
+versión de datos del usuario y se guardan ya convertidas a formas simples.
+El motor alternativo (WeasyPrint) maqueta templates/exports/pdf_report.html
+en un pool de procesos que cargan fuentes y CSS al arrancar.
+"""
+import base64
+import datetime
+import importlib.util
+import multiprocessing
+import os
+import resource
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.charts.linecharts import HorizontalLineChart
+from reportlab.graphics.shapes import Drawing, Group, String, UserNode
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from app.services.cache_service import TTLCache
+
+# Cultivos de la gráfica de barras (los de más beneficio) y meses de la tendencia
+PDF_CHART_MAX_CROPS = 15
+PDF_CHART_MAX_MONTHS = 24
+
+# Ancho útil del marco en puntos enteros: márgenes del informe (72 pt) y relleno del marco (6 pt) a cada lado
+PDF_FRAME_WIDTH = int(A4[0]) - 2 * 72 - 12
+
+VERDE = colors.HexColor('#198754')
+
+# Motores del informe PDF (el de por defecto se elige con PDF_ENGINE)
+PDF_ENGINES = ('reportlab', 'weasyprint')
+
+PDF_REPORT_TEMPLATE = 'exports/pdf_report.html'
+PDF_REPORT_CSS = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                              'static', 'css', 'pdf_report.css')
+
+_styles = None
+_styles_lock = threading.Lock()
+_chart_cache = None
+_weasyprint_pool = None
+_weasyprint_pool_lock = threading.Lock()
+
+# Estado de cada proceso del pool de WeasyPrint (ver _init_weasyprint_worker)
+_worker_fonts = None
+_worker_css = None
+
+def _build_styles() -> Dict:
+    """Hojas de estilo, estilos de tabla y anchos de columna del informe"""
+    styles = getSampleStyleSheet()
+    cabecera = [
+        ('BACKGROUND', (0, 0), (-1, 0), VERDE),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]
+    return {
+        'normal': styles['Normal'],
+        'subtitulo': styles['Heading2'],
+        'titulo': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            spaceAfter=30,
+            textColor=VERDE,
+            alignment=1  # Center
+        ),
+        'seccion': ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=16,
+            spaceAfter=12,
+            textColor=VERDE
+        ),
+        'tabla_resumen': TableStyle(cabecera + [
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12)
+        ]),
+        'tabla_cultivos': TableStyle(cabecera + [
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('FONTSIZE', (0, 1), (-1, -1), 8),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
+        ]),
+        'anchos_resumen': [3*inch, 2*inch],
+        'anchos_cultivos': [0.8*inch, 0.8*inch, 0.6*inch, 0.7*inch, 0.7*inch, 0.8*inch, 0.7*inch]
+    }
+
+def get_pdf_styles() -> Dict:
+    """
+    Estilos del informe, construidos la primera vez que se piden
+
+    Los estilos de reportlab no se modifican al maquetar, así que el mismo
+    diccionario sirve a todos los hilos del proceso.
+    """
+    global _styles
+    if _styles is None:
+        with _styles_lock:
+            if _styles is None:
+                _styles = _build_styles()
+    return _styles
+
+def get_chart_cache() -> TTLCache:
+    """Obtener (creando si hace falta) la caché de gráficas del proceso"""
+    global _chart_cache
+    if _chart_cache is None:
+        from flask import current_app, has_app_context
+        app_config = current_app.config if has_app_context() else {}
+        # Sin copias: las gráficas guardadas sólo se leen al dibujarlas
+        _chart_cache = TTLCache(
+            max_size=app_config.get('PDF_CHART_CACHE_MAX_ENTRIES', 200),
+            ttl_seconds=app_config.get('PDF_CHART_CACHE_TTL_SECONDS', 600),
+            copy_values=False
+        )
+    return _chart_cache
+
+def _short_label(texto: str, maximo: int = 10) -> str:
+    """Etiqueta de eje recortada para que no se solapen"""
+    texto = str(texto)
+    return texto if len(texto) <= maximo else texto[:maximo - 1] + '…'
+
+def _plain_shapes(nodo):
+    """
+    Copia de un nodo con sólo grupos y formas simples
+
+    Los widgets (ejes, series) se sustituyen por lo que dibujan y los grupos
+    pierden los atributos que apuntan a ellos: dibujar el resultado no vuelve
+    a calcular nada y se puede pasar a otros procesos (pickle).
+    """
+    if isinstance(nodo, UserNode):
+        nodo = nodo.provideNode()
+    if isinstance(nodo, Group):
+        return Group(*[_plain_shapes(hijo) for hijo in nodo.contents], transform=nodo.transform)
+    return nodo
+
+def _plain_drawing(drawing: Drawing) -> Drawing:
+    """Gráfica convertida a formas simples (ver _plain_shapes)"""
+    return Drawing(drawing.width, drawing.height, *[_plain_shapes(nodo) for nodo in drawing.contents])
+
+def crop_bars_drawing(ranking: List[Dict]) -> Optional[Drawing]:
+    """
+    Barras de kilos y beneficio de los cultivos con más beneficio
+
+    Args:
+        ranking (List[Dict]): Cultivos ordenados por beneficio (snapshot['ranking'])
+
+    Returns:
+        Optional[Drawing]: Gráfica convertida a formas simples, o None sin cultivos
+    """
+    cultivos = ranking[:PDF_CHART_MAX_CROPS]
+    if not cultivos:
+        return None
+    alto = 200
+    drawing = Drawing(PDF_FRAME_WIDTH, alto)
+    chart = VerticalBarChart()
+    chart.x, chart.y = 40, 45
+    chart.width, chart.height = PDF_FRAME_WIDTH - 60, alto - 70
+    chart.data = [
+        [float(c.get('kilos_totales', 0) or 0) for c in cultivos],
+        [float(c.get('beneficio_total', 0) or 0) for c in cultivos]
+    ]
+    chart.categoryAxis.categoryNames = [_short_label(c.get('nombre', '')) for c in cultivos]
+    chart.categoryAxis.labels.angle = 30
+    chart.categoryAxis.labels.boxAnchor = 'ne'
+    chart.categoryAxis.labels.fontSize = 7
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.labels.fontSize = 7
+    chart.bars[0].fillColor = VERDE
+    chart.bars[1].fillColor = colors.HexColor('#ffc107')
+    drawing.add(chart)
+    drawing.add(String(40, alto - 12, 'Kilos (verde) y beneficio en € (amarillo) por cultivo', fontSize=9))
+    return _plain_drawing(drawing)
+
+def monthly_trend_drawing(periodos: List[Dict]) -> Optional[Drawing]:
+    """
+    Línea de kilos y beneficio por mes
+
+    Args:
+        periodos (List[Dict]): Serie 'mes' de RollupService (periodo, kilos, beneficio)
+
+    Returns:
+        Optional[Drawing]: Gráfica convertida a formas simples, o None con
+            menos de dos meses
+    """
+    periodos = periodos[-PDF_CHART_MAX_MONTHS:]
+    if len(periodos) < 2:
+        return None
+    alto = 180
+    drawing = Drawing(PDF_FRAME_WIDTH, alto)
+    chart = HorizontalLineChart()
+    chart.x, chart.y = 40, 35
+    chart.width, chart.height = PDF_FRAME_WIDTH - 60, alto - 60
+    chart.data = [
+        [float(p.get('kilos', 0) or 0) for p in periodos],
+        [round(float(p.get('beneficio', 0) or 0), 2) for p in periodos]
+    ]
+    chart.categoryAxis.categoryNames = [p['periodo'] for p in periodos]
+    chart.categoryAxis.labels.angle = 45
+    chart.categoryAxis.labels.boxAnchor = 'ne'
+    chart.categoryAxis.labels.fontSize = 6
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.labels.fontSize = 7
+    chart.lines[0].strokeColor = VERDE
+    chart.lines[1].strokeColor = colors.HexColor('#ffc107')
+    drawing.add(chart)
+    drawing.add(String(40, alto - 12, 'Evolución mensual: kilos (verde) y beneficio en € (amarillo)', fontSize=9))
+    return _plain_drawing(drawing)
+
+def build_charts(snapshot: Dict, periodos: List[Dict]) -> List[Drawing]:
+    """Gráficas del informe que tienen datos"""
+    return [grafica for grafica in (crop_bars_drawing(snapshot['ranking']), monthly_trend_drawing(periodos))
+            if grafica is not None]
+
+def write_pdf(destino, snapshot: Dict, titulo_usuario: str,
+              fecha_reporte: Optional[datetime.datetime] = None,
+              graficas: Optional[List[Drawing]] = None) -> None:
+    """
+    Escribir el reporte PDF de análisis (resumen, cultivos, gráficas y rentabilidad)
+
+    La tabla de cultivos repite la cabecera en cada página.
+
+    Args:
+        destino: Ruta o fichero binario donde guardar el PDF
+        snapshot (Dict): Instantánea de cultivos con totales y 'ranking'
+            (CropService.get_user_snapshot, sin producción)
+        titulo_usuario (str): Línea de usuario bajo el título
+        fecha_reporte (Optional[datetime.datetime]): Fecha del informe
+            (por defecto ahora)
+        graficas (Optional[List[Drawing]]): Gráficas ya construidas (ver
+            build_charts; no se modifican, se pueden compartir entre
+            informes); sin ellas el informe no lleva sección de gráficas
+    """
+    from app.utils.helpers import format_spanish_number
+
+    estilos = get_pdf_styles()
+    normal = estilos['normal']
+    seccion = estilos['seccion']
+    cultivos = snapshot['cultivos']
+    total_kilos = snapshot['total_kilos']
+    total_beneficios = snapshot['total_beneficios']
+    fecha_reporte = fecha_reporte or datetime.datetime.now()
+
+    doc = SimpleDocTemplate(destino, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+
+    # Título principal
+    story = [
+        Paragraph("🌱 HuertoRentable", estilos['titulo']),
+        Paragraph("Reporte Completo de Análisis", estilos['subtitulo']),
+        Spacer(1, 12),
+        Paragraph(f"<b>{titulo_usuario}</b>", normal),
+        Paragraph(f"Fecha: {fecha_reporte.strftime('%d/%m/%Y %H:%M')}", normal),
+        Spacer(1, 20)
+    ]
+
+    # Resumen ejecutivo
+    story.append(Paragraph("📊 Resumen Ejecutivo", seccion))
+    resumen_data = [
+        ['Métrica', 'Valor'],
+        ['Total de Cultivos', str(len(cultivos))],
+        ['Producción Total', f"{total_kilos:.1f} kg"],
+        ['Beneficios Totales', f"{format_spanish_number(total_beneficios, 2)} €"],
+        ['Beneficio Promedio', f"{format_spanish_number((total_beneficios/len(cultivos) if cultivos else 0), 2)} € por cultivo"]
+    ]
+    story.append(Table(resumen_data, colWidths=estilos['anchos_resumen'], style=estilos['tabla_resumen']))
+    story.append(Spacer(1, 20))
+
+    if not cultivos:
+        story.append(Paragraph("No hay cultivos registrados", normal))
+    else:
+        # Detalle de cultivos
+        story.append(Paragraph("🌱 Detalle de Cultivos", seccion))
+        cultivos_data = [['Cultivo', 'Fecha Siembra', 'Plantas', 'Precio/kg', 'Kilos', 'Beneficio', 'Estado']]
+        for cultivo in cultivos:
+            cultivos_data.append([
+                cultivo['nombre'],
+                cultivo['fecha_siembra'].strftime('%d/%m/%Y'),
+                str(cultivo.get('plantas_sembradas', 0)),
+                f"{format_spanish_number(cultivo.get('precio_por_kilo', 0), 2)} €",
+                f"{cultivo.get('kilos_totales', 0):.1f} kg",
+                f"{format_spanish_number(cultivo.get('beneficio_total', 0), 2)} €",
+                'Activo' if cultivo.get('activo', True) else 'Cosechado'
+            ])
+        story.append(Table(cultivos_data, colWidths=estilos['anchos_cultivos'], style=estilos['tabla_cultivos'], repeatRows=1))
+        story.append(Spacer(1, 20))
+
+        if graficas:
+            story.append(Paragraph("📈 Gráficas", seccion))
+            for grafica in graficas:
+                # Flowable nuevo con las formas compartidas: platypus guarda
+                # estado de maquetación en cada flowable
+                story.append(Drawing(grafica.width, grafica.height, *grafica.contents))
+                story.append(Spacer(1, 12))
+            story.append(Spacer(1, 8))
+
+        # Análisis de rentabilidad
+        story.append(Paragraph("💹 Análisis de Rentabilidad", seccion))
+        cultivo_top = snapshot['ranking'][0]
+        story.append(Paragraph(f"<b>🏆 Cultivo Más Rentable:</b> {cultivo_top['nombre']}", normal))
+        story.append(Paragraph(f"Beneficio: {format_spanish_number(cultivo_top.get('beneficio_total', 0), 2)} €", normal))
+        story.append(Paragraph(f"Producción: {cultivo_top.get('kilos_totales', 0):.1f} kg", normal))
+        story.append(Spacer(1, 12))
+
+        activos = len([c for c in cultivos if c.get('activo', True)])
+        cosechados = len(cultivos) - activos
+        story.append(Paragraph("<b>📊 Estadísticas:</b>", normal))
+        story.append(Paragraph(f"• Cultivos activos: {activos}", normal))
+        story.append(Paragraph(f"• Cultivos cosechados: {cosechados}", normal))
+        if total_kilos > 0:
+            story.append(Paragraph(f"• Rentabilidad: {format_spanish_number((total_beneficios/total_kilos), 2)} €/kg", normal))
+
+    # Pie de página
+    story.append(Spacer(1, 30))
+    story.append(Paragraph("🌱 <b>HuertoRentable</b> - Gestión inteligente de huertos rentables", normal))
+    story.append(Paragraph(f"Reporte generado el {fecha_reporte.strftime('%d/%m/%Y %H:%M')}", normal))
+
+    doc.build(story)
+
+def chart_svg(grafica: Drawing) -> str:
+    """Gráfica en SVG codificado en base64 (para una imagen data: de la plantilla HTML)"""
+    from reportlab.graphics import renderSVG
+    return base64.b64encode(renderSVG.drawToString(grafica).encode('utf-8')).decode('ascii')
+
+def render_report_html(snapshot: Dict, titulo_usuario: str,
+                       fecha_reporte: Optional[datetime.datetime] = None,
+                       graficas: Optional[List[Drawing]] = None) -> str:
+    """
+    HTML del informe (PDF_REPORT_TEMPLATE) para WeasyPrint
+
+    Necesita contexto de aplicación de Flask. Lleva las mismas gráficas que
+    el informe de reportlab, como SVG; los estilos no van en el HTML, los
+    pone cada proceso del pool.
+    """
+    from flask import render_template
+
+    cultivos = snapshot['cultivos']
+    fecha_reporte = fecha_reporte or datetime.datetime.now()
+    return render_template(
+        PDF_REPORT_TEMPLATE,
+        titulo_usuario=titulo_usuario,
+        fecha_reporte=fecha_reporte.strftime('%d/%m/%Y %H:%M'),
+        cultivos=cultivos,
+        total_cultivos=len(cultivos),
+        total_kilos=snapshot['total_kilos'],
+        total_beneficios=snapshot['total_beneficios'],
+        beneficio_promedio=snapshot['total_beneficios'] / len(cultivos) if cultivos else 0,
+        graficas=[chart_svg(grafica) for grafica in graficas or []]
+    )
+
+def weasyprint_available() -> bool:
+    """True si WeasyPrint está instalado (sus bibliotecas de sistema se comprueban al arrancar el pool)"""
+    return importlib.util.find_spec('weasyprint') is not None
+
+def _init_weasyprint_worker(css_path: str) -> None:
+    """
+    Preparar un proceso del pool: fuentes, CSS y un documento de prueba
+
+    La primera maqueta de WeasyPrint carga Pango y las fuentes del sistema;
+    se hace aquí para que la primera petición no lo pague.
+    """
+    global _worker_fonts, _worker_css
+    from weasyprint import CSS, HTML
+    from weasyprint.text.fonts import FontConfiguration
+
+    _worker_fonts = FontConfiguration()
+    _worker_css = CSS(filename=css_path, font_config=_worker_fonts)
+    HTML(string='<p>🌱 HuertoRentable</p>').write_pdf(stylesheets=[_worker_css], font_config=_worker_fonts)
+
+def _render_weasyprint(html: str) -> bytes:
+    """Maquetar un informe en un proceso del pool"""
+    from weasyprint import HTML
+    return HTML(string=html).write_pdf(stylesheets=[_worker_css], font_config=_worker_fonts)
+
+def _worker_usage() -> Tuple[int, float, int]:
+    """PID, segundos de CPU y pico de RSS (KB) del proceso del pool (para el benchmark)"""
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    return os.getpid(), uso.ru_utime + uso.ru_stime, uso.ru_maxrss
+
+class WeasyPrintPool:
+    """
+    Pool de procesos que maquetan el informe HTML con WeasyPrint
+
+    Los procesos se crean con 'spawn' (no heredan los hilos ni las
+    conexiones de gRPC del servidor) y cargan fuentes y CSS una vez al
+    arrancar. Si un proceso muere el pool se vuelve a crear.
+    """
+
+    def __init__(self, max_workers: int = 2, timeout: float = 60, css_path: str = PDF_REPORT_CSS):
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = float(timeout)
+        self.css_path = css_path
+        self._lock = threading.Lock()
+        self._executor = self._create()
+
+    def _create(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_weasyprint_worker,
+            initargs=(self.css_path,)
+        )
+
+    def warm(self) -> None:
+        """Arrancar todos los procesos sin esperar a que estén listos"""
+        for _ in range(self.max_workers):
+            self._executor.submit(os.getpid)
+
+    def submit(self, funcion, *args):
+        """Ejecutar una función en el pool y esperar el resultado (hasta timeout)"""
+        executor = self._executor
+        try:
+            return executor.submit(funcion, *args).result(timeout=self.timeout)
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    print("⚠️ Pool de WeasyPrint caído, se vuelve a crear")
+                    self._executor = self._create()
+            raise
+
+    def render(self, html: str) -> bytes:
+        """
+        PDF de un informe HTML (render_report_html)
+
+        Raises:
+            concurrent.futures.TimeoutError: Si tarda más de timeout
+            BrokenProcessPool: Si el proceso muere (o WeasyPrint no arranca)
+        """
+        return self.submit(_render_weasyprint, html)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+def get_weasyprint_pool() -> WeasyPrintPool:
+    """
+    Obtener (creando y calentando si hace falta) el pool de WeasyPrint del proceso
+
+    Raises:
+        ImportError: Si WeasyPrint no está instalado
+    """
+    global _weasyprint_pool
+    with _weasyprint_pool_lock:
+        if _weasyprint_pool is None:
+            if not weasyprint_available():
+                raise ImportError('WeasyPrint no está instalado')
+            from flask import current_app, has_app_context
+            app_config = current_app.config if has_app_context() else {}
+            _weasyprint_pool = WeasyPrintPool(
+                max_workers=app_config.get('PDF_WEASYPRINT_WORKERS', 2),
+                timeout=app_config.get('PDF_WEASYPRINT_TIMEOUT_SECONDS', 60)
+            )
+            _weasyprint_pool.warm()
+    return _weasyprint_pool
+
+class PdfService:
+    """Servicio de gráficas de los informes PDF"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_charts(self, snapshot: Dict, user: Optional[Dict]) -> List[Drawing]:
+        """
+        Gráficas del informe de un usuario (o de los datos demo)
+
+        Las de un usuario se guardan con su versión de datos en la clave: una
+        escritura cambia la versión y las anteriores dejan de pedirse. Las
+        demo no se guardan porque sus datos se generan en cada petición.
+
+        Args:
+            snapshot (Dict): Instantánea del usuario (sin producción)
+            user (Optional[Dict]): Usuario autenticado, o None en modo demo
+
+        Returns:
+            List[Drawing]: Gráficas con datos, en orden del informe
+        """
+        from app.services.crop_service import CropService
+
+        crop_service = CropService(self.db)
+        precios = {c.get('id'): c.get('precio_por_kilo', 0) for c in snapshot['cultivos']}
+        if not user:
+            registros = [dict(r, cultivo_id=c['id']) for c in snapshot['cultivos'] for r in c.get('produccion_diaria', [])]
+            periodos = crop_service.rollups.merge_series(
+                list(crop_service.rollups.build_rollups(registros).values()), 'mes', precios
+            )
+            return build_charts(snapshot, periodos)
+
+        uid = user['uid']
+        cache = get_chart_cache()
+        clave = (uid, 'pdf_graficas', crop_service.get_data_version(uid))
+        encontradas, graficas = cache.get(clave)
+        if not encontradas:
+            from flask import g, has_app_context
+            periodos = crop_service.rollups.get_rollups(uid, 'mes', precios=precios)
+            graficas = build_charts(snapshot, periodos)
+            # La primera lectura de rollups los regenera y sube la versión
+            if has_app_context():
+                g.get('data_versions', {}).pop(uid, None)
+            cache.set((uid, 'pdf_graficas', crop_service.get_data_version(uid)), graficas)
+        return graficas
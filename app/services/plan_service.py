@@ -172,8 +172,8 @@ class PlanService:
             plan_info = self.get_plan_info(plan)
             print(f"📊 Info del plan: {plan_info.get('limits', {})}")
             
-            # Obtener uso actual
-            crops_count = len(crop_service.get_user_crops(uid))
+            # Obtener uso actual (sólo hace falta contar los cultivos)
+            crops_count = len(crop_service.get_user_crops(uid, include_production=False, projection='ids'))
             print(f"🌱 Cultivos actuales: {crops_count}")
             
             max_crops = plan_info['limits']['max_crops']
@@ -0,0 +1,377 @@
+"""
+Servicio de rollups de producción por periodo
+Documentos usuarios/{uid}/rollups/{año}_{cultivo} con buckets por día, semana, mes y temporada
+"""
+import contextlib
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from firebase_admin import firestore
+
+# Granularidades guardadas en cada documento anual
+ROLLUP_GRANULARITIES = ('dia', 'semana', 'mes', 'temporada')
+
+# Temporadas de cultivo por mes (hemisferio norte). El invierno empieza en
+# diciembre y pertenece a la temporada del año en que empieza.
+TEMPORADAS = ('primavera', 'verano', 'otoño', 'invierno')
+TEMPORADA_POR_MES = {
+    3: 'primavera', 4: 'primavera', 5: 'primavera',
+    6: 'verano', 7: 'verano', 8: 'verano',
+    9: 'otoño', 10: 'otoño', 11: 'otoño',
+    12: 'invierno', 1: 'invierno', 2: 'invierno'
+}
+
+# Documento con la zona horaria y el formato con los que se calcularon los buckets
+ROLLUP_STATE_DOC = 'estado'
+
+# Formato de los documentos: 2 = un documento por año y cultivo (el 1, un
+# documento por año con todos los cultivos, se regenera en la primera lectura)
+ROLLUP_FORMAT = 2
+
+# Regeneraciones pendientes de los rollups de los usuarios leídos sin ellos:
+# un hilo por proceso y como mucho una en cola o en curso por usuario
+_rebuild_pool = None
+_rebuild_lock = threading.Lock()
+_rebuilds_pendientes = set()
+
+def schedule_rebuild(db, user_uid: str, zona_horaria: str) -> bool:
+    """
+    Regenerar en segundo plano los rollups de un usuario
+
+    Args:
+        db: Cliente de la base de datos
+        user_uid (str): UID del usuario
+        zona_horaria (str): Zona horaria de los buckets
+
+    Returns:
+        bool: True si se ha encolado, False si ya había una pendiente
+    """
+    global _rebuild_pool
+    from flask import current_app, has_app_context
+    app = current_app._get_current_object() if has_app_context() else None
+    with _rebuild_lock:
+        if user_uid in _rebuilds_pendientes:
+            return False
+        _rebuilds_pendientes.add(user_uid)
+        if _rebuild_pool is None:
+            _rebuild_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rollups')
+
+    def regenerar():
+        try:
+            with app.app_context() if app is not None else contextlib.nullcontext():
+                RollupService(db, zona_horaria).rebuild_rollups(user_uid)
+        except Exception as e:
+            print(f"❌ Error regenerando los rollups de {user_uid}: {e}")
+        finally:
+            with _rebuild_lock:
+                _rebuilds_pendientes.discard(user_uid)
+
+    _rebuild_pool.submit(regenerar)
+    return True
+
+class RollupService:
+    """
+    Rollups de producción por usuario y cultivo
+
+    Cada documento guarda, para un año y un cultivo, los kilos, unidades y
+    registros por granularidad y periodo:
+        
+        {'cultivo_id': crop_id, 'anio': '2025',
+         'mes': {'2025-06': {'kilos', 'unidades', 'registros'}}, ...}
+
+    Así cada documento tiene como mucho unos 440 periodos, sea cual sea el
+    número de cultivos, lejos de los límites de tamaño y de campos de un
+    documento de Firestore (los mapas de buckets no se indexan, ver
+    firestore.indexes.json).
+
+    Los periodos se calculan en la zona horaria local (ROLLUP_TIMEZONE): día
+    AAAA-MM-DD, semana ISO AAAA-Wnn, mes AAAA-MM y temporada AAAA-nombre.
+    Igual que en StatsService, las escrituras son set(merge=True) con
+    Increment para ir en el mismo lote o transacción que el registro, y el
+    beneficio se calcula al leer con el precio actual de cada cultivo.
+    """
+
+    def __init__(self, db, zona_horaria: Optional[str] = None):
+        self.db = db
+        if zona_horaria is None:
+            from flask import current_app, has_app_context
+            zona_horaria = current_app.config.get('ROLLUP_TIMEZONE', 'Europe/Madrid') if has_app_context() else 'Europe/Madrid'
+        self.zona_horaria = zona_horaria
+        self._zona = self._load_zone(zona_horaria)
+
+    @staticmethod
+    def _load_zone(nombre: str) -> datetime.tzinfo:
+        """Zona horaria por nombre IANA (UTC si el sistema no la conoce)"""
+        from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+        try:
+            return ZoneInfo(nombre)
+        except (ZoneInfoNotFoundError, ValueError):
+            print(f"⚠️ Zona horaria {nombre} no disponible, los rollups se calculan en UTC")
+            return datetime.timezone.utc
+
+    def rollups_ref(self, user_uid: str):
+        """Referencia Firestore a la colección de rollups del usuario"""
+        return self.db.collection('usuarios').document(user_uid).collection('rollups')
+
+    def rollup_ref(self, user_uid: str, doc_id: str):
+        """Referencia a un documento de rollups (año y cultivo, o el de estado)"""
+        return self.rollups_ref(user_uid).document(doc_id)
+    
+    @staticmethod
+    def rollup_doc_id(anio: str, crop_id: str) -> str:
+        """ID del documento de rollups de un año y un cultivo"""
+        return f"{anio}_{crop_id}"
+
+    def local_date(self, fecha) -> Optional[datetime.datetime]:
+        """Fecha en la zona local (las fechas sin zona se toman como UTC)"""
+        from app.services.crop_service import CropService
+        fecha = CropService._to_datetime(fecha)
+        if not isinstance(fecha, datetime.datetime):
+            return None
+        if fecha.tzinfo is None:
+            fecha = fecha.replace(tzinfo=datetime.timezone.utc)
+        return fecha.astimezone(self._zona)
+
+    def bucket_keys(self, fecha) -> Tuple[Optional[str], Dict[str, str]]:
+        """
+        Año del documento y periodo de cada granularidad de una fecha
+
+        Returns:
+            Tuple[Optional[str], Dict[str, str]]: (año, {granularidad: periodo});
+                (None, {}) si la fecha no es válida
+        """
+        local = self.local_date(fecha)
+        if local is None:
+            return None, {}
+        iso = local.isocalendar()
+        anio_temporada = local.year - 1 if local.month <= 2 else local.year
+        return str(local.year), {
+            'dia': local.strftime('%Y-%m-%d'),
+            'semana': f"{iso[0]}-W{iso[1]:02d}",
+            'mes': local.strftime('%Y-%m'),
+            'temporada': f"{anio_temporada}-{TEMPORADA_POR_MES[local.month]}"
+        }
+
+    def document_of(self, registro: Dict) -> Optional[str]:
+        """Documento de rollups en el que cae un registro (None si no tiene fecha válida)"""
+        anio = self.bucket_keys(registro.get('fecha'))[0]
+        return self.rollup_doc_id(anio, registro['cultivo_id']) if anio is not None else None
+
+    def _group(self, registros: List[Dict]) -> Dict[str, Dict]:
+        """Sumar registros por año y cultivo, granularidad y periodo"""
+        documentos = {}
+        for registro in registros:
+            anio, claves = self.bucket_keys(registro.get('fecha'))
+            if anio is None:
+                continue
+            kilos = float(registro.get('kilos', 0) or 0)
+            unidades = int(registro.get('unidades', 0) or 0)
+            documento = documentos.setdefault(self.rollup_doc_id(anio, registro['cultivo_id']),
+                                              {'cultivo_id': registro['cultivo_id'], 'anio': anio})
+            for granularidad, periodo in claves.items():
+                bucket = documento.setdefault(granularidad, {}).setdefault(periodo, {'kilos': 0, 'unidades': 0, 'registros': 0})
+                bucket['kilos'] += kilos
+                bucket['unidades'] += unidades
+                bucket['registros'] += 1
+        return documentos
+
+    def production_delta(self, registros: List[Dict], signo: int = 1) -> Dict[str, Dict]:
+        """
+        Cambios de los rollups al añadir (o eliminar) registros de producción
+
+        Args:
+            registros (List[Dict]): Registros con 'fecha' y 'cultivo_id'
+            signo (int): 1 al añadir, -1 al eliminar
+
+        Returns:
+            Dict[str, Dict]: ID de documento -> datos para set(merge=True) sobre él
+        """
+        ahora = datetime.datetime.utcnow()
+        deltas = {}
+        for doc_id, documento in self._group(registros).items():
+            datos = {
+                granularidad: {
+                    periodo: {campo: firestore.Increment(signo * valor) for campo, valor in bucket.items()}
+                    for periodo, bucket in documento[granularidad].items()
+                }
+                for granularidad in ROLLUP_GRANULARITIES
+            }
+            datos.update(cultivo_id=documento['cultivo_id'], anio=documento['anio'], actualizado_en=ahora)
+            deltas[doc_id] = datos
+        return deltas
+
+    def write_delta(self, writer, user_uid: str, registros: List[Dict], signo: int = 1) -> None:
+        """Añadir a un lote o transacción los cambios de rollups de unos registros"""
+        for doc_id, datos in self.production_delta(registros, signo).items():
+            writer.set(self.rollup_ref(user_uid, doc_id), datos, merge=True)
+
+    def build_rollups(self, registros: List[Dict]) -> Dict[str, Dict]:
+        """
+        Construir desde cero los documentos de rollups (uno por año y cultivo)
+
+        Args:
+            registros (List[Dict]): Todos los registros del usuario, con 'cultivo_id'
+
+        Returns:
+            Dict[str, Dict]: ID de documento -> documento completo
+        """
+        ahora = datetime.datetime.utcnow()
+        documentos = self._group(registros)
+        for documento in documentos.values():
+            for granularidad in ROLLUP_GRANULARITIES:
+                documento.setdefault(granularidad, {})
+            documento['actualizado_en'] = ahora
+        return documentos
+
+    def rebuild_rollups(self, user_uid: str) -> Dict[str, Dict]:
+        """
+        Regenerar (backfill) los rollups de un usuario desde sus registros
+
+        Reescribe los documentos de cada año y cultivo, borra los que ya no
+        tienen registros (y los del formato anterior) y guarda la zona horaria
+        y el formato usados. Las escrituras van en lotes de BATCH_MAX_OPS; el
+        estado se guarda en el último, así que si se corta a medias la
+        siguiente lectura vuelve a encolarlo. Como en el resumen de
+        estadísticas, las escrituras simultáneas pueden perderse; basta con
+        volver a lanzarlo.
+
+        Args:
+            user_uid (str): UID del usuario
+
+        Returns:
+            Dict[str, Dict]: ID de documento -> documento guardado
+        """
+        from app.services.crop_service import BATCH_MAX_OPS, CropService
+        crop_service = CropService(self.db)
+        cultivos, registros = crop_service.get_user_history(user_uid)
+        documentos = self.build_rollups(registros)
+
+        operaciones = [('delete', doc_ref, None) for doc_ref in self.rollups_ref(user_uid).list_documents()
+                       if doc_ref.id not in documentos and doc_ref.id != ROLLUP_STATE_DOC]
+        operaciones += [('set', self.rollup_ref(user_uid, doc_id), documento) for doc_id, documento in documentos.items()]
+        # Lotes de BATCH_MAX_OPS, dejando sitio en el último para el estado y la versión de datos
+        tamano = BATCH_MAX_OPS - 2
+        lotes = [operaciones[inicio:inicio + tamano] for inicio in range(0, len(operaciones), tamano)] or [[]]
+        for indice, lote in enumerate(lotes):
+            batch = self.db.batch()
+            for operacion, doc_ref, documento in lote:
+                if operacion == 'delete':
+                    batch.delete(doc_ref)
+                else:
+                    batch.set(doc_ref, documento)
+            if indice == len(lotes) - 1:
+                batch.set(self.rollup_ref(user_uid, ROLLUP_STATE_DOC), {
+                    'zona_horaria': self.zona_horaria,
+                    'formato': ROLLUP_FORMAT,
+                    'reconstruido_en': datetime.datetime.utcnow()
+                })
+                # Las series pueden cambiar: invalidar los ETag de las rutas JSON
+                crop_service._bump_data_version(batch, user_uid)
+            batch.commit()
+        print(f"📆 Rollups reconstruidos para {user_uid}: {len(registros)} registros en {len(documentos)} documentos ({self.zona_horaria})")
+        return documentos
+
+    def _load_documents(self, user_uid: str, crop_id: Optional[str] = None) -> List[Dict]:
+        """
+        Documentos de rollups del usuario, o sólo los de un cultivo
+
+        Si nunca se han calculado, se calcularon con otra zona horaria o
+        tienen el formato anterior, la petición se responde agrupando los
+        registros de producción (sin escribir nada) y la regeneración se
+        encola en segundo plano, una por usuario (schedule_rebuild). Para
+        no pasar por aquí tras cambiar ROLLUP_TIMEZONE o el formato, lanzar
+        scripts/backfill_rollups.py.
+        """
+        documentos = []
+        estado = None
+        if crop_id is None:
+            # Una consulta: todos los documentos y el de estado
+            for doc in self.rollups_ref(user_uid).stream():
+                if doc.id == ROLLUP_STATE_DOC:
+                    estado = doc.to_dict()
+                else:
+                    documentos.append(doc.to_dict())
+        else:
+            estado_doc = self.rollup_ref(user_uid, ROLLUP_STATE_DOC).get()
+            estado = estado_doc.to_dict() if estado_doc.exists else None
+            documentos = [doc.to_dict() for doc in
+                          self.rollups_ref(user_uid).where('cultivo_id', '==', crop_id).stream()]
+        if not estado or estado.get('zona_horaria') != self.zona_horaria or estado.get('formato') != ROLLUP_FORMAT:
+            from app.services.crop_service import CropService
+            _, registros = CropService(self.db).get_user_history(user_uid)
+            if crop_id is not None:
+                registros = [r for r in registros if r.get('cultivo_id') == crop_id]
+            documentos = list(self.build_rollups(registros).values())
+            schedule_rebuild(self.db, user_uid, self.zona_horaria)
+        return documentos
+
+    def get_rollups(self, user_uid: str, granularidad: str = 'mes', crop_id: Optional[str] = None,
+                    precios: Optional[Dict[str, float]] = None) -> List[Dict]:
+        """
+        Serie de un usuario (o de uno de sus cultivos) por periodo
+
+        Lee sólo los documentos de rollups (con crop_id, sólo los de ese
+        cultivo): el coste depende del número de periodos, no del número de
+        registros.
+
+        Args:
+            user_uid (str): UID del usuario
+            granularidad (str): 'dia', 'semana', 'mes' o 'temporada'
+            crop_id (Optional[str]): Limitar la serie a un cultivo
+            precios (Optional[Dict[str, float]]): Precio por kilo de cada
+                cultivo; si no se indica se leen de los cultivos del usuario
+
+        Returns:
+            List[Dict]: Periodos en orden cronológico con 'periodo', 'kilos',
+                        'unidades', 'registros' y 'beneficio'
+        """
+        if granularidad not in ROLLUP_GRANULARITIES:
+            raise ValueError(f"Granularidad no válida: {granularidad}")
+        from app.services.crop_service import CropService
+        crop_service = CropService(self.db)
+
+        if precios is None:
+            precios = {c.get('id'): c.get('precio_por_kilo', 0)
+                       for c in crop_service.get_user_crops(user_uid, include_production=False, projection='chart')}
+        if not self.db:
+            # Sesión: pocos registros, se agrupan al leer
+            registros = [dict(r, cultivo_id=c.get('id')) for c in crop_service.get_user_crops(user_uid)
+                         for r in c.get('produccion_diaria', [])]
+            documentos = list(self.build_rollups(registros).values())
+        else:
+            documentos = self._load_documents(user_uid, crop_id)
+        return self.merge_series(documentos, granularidad, precios, crop_id)
+
+    @staticmethod
+    def merge_series(documentos: List[Dict], granularidad: str, precios: Dict[str, float],
+                     crop_id: Optional[str] = None) -> List[Dict]:
+        """
+        Sumar los buckets de varios documentos (años y cultivos) en una serie ordenada
+
+        Un mismo periodo puede repartirse entre dos años (semana ISO o
+        invierno a caballo entre diciembre y enero).
+        """
+        periodos = {}
+        for documento in documentos:
+            cultivo_id = documento.get('cultivo_id')
+            if crop_id is not None and cultivo_id != crop_id:
+                continue
+            precio = float(precios.get(cultivo_id, 0) or 0)
+            for periodo, bucket in (documento.get(granularidad) or {}).items():
+                total = periodos.setdefault(periodo, {'kilos': 0, 'unidades': 0, 'registros': 0, 'beneficio': 0})
+                kilos = float(bucket.get('kilos', 0) or 0)
+                total['kilos'] += kilos
+                total['unidades'] += int(bucket.get('unidades', 0) or 0)
+                total['registros'] += int(bucket.get('registros', 0) or 0)
+                total['beneficio'] += kilos * precio
+
+        def orden(periodo):
+            if granularidad == 'temporada':
+                anio, nombre = periodo.split('-', 1)
+                return (anio, TEMPORADAS.index(nombre) if nombre in TEMPORADAS else len(TEMPORADAS))
+            return (periodo, 0)
+
+        # Los periodos vaciados al deshacer se quedan a 0 registros
+        return [dict(total, periodo=periodo) for periodo, total in sorted(periodos.items(), key=lambda p: orden(p[0]))
+                if total['registros'] > 0]
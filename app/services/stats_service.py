@@ -0,0 +1,289 @@
+"""
+Servicio de estadísticas por usuario
+Documento usuarios/{uid}/stats/summary mantenido de forma incremental
+"""
+import datetime
+from typing import Dict, List, Optional, Tuple
+from firebase_admin import firestore
+
+# Producciones recientes que se muestran en el dashboard
+STATS_RECENT_MAX = 10
+
+class StatsService:
+    """
+    Modelo de lectura precalculado para el dashboard
+
+    El documento guarda totales, número de cultivos por estado, kilos por mes
+    y cultivo, nombre y precio de cada cultivo y las últimas producciones.
+    Los ingresos no se guardan: se calculan al leer con el precio de cada
+    cultivo, igual que beneficio_total en los agregados del cultivo.
+
+    Las escrituras usan set(merge=True) con transformaciones atómicas para
+    poder ir en el mismo lote o transacción que el registro de producción,
+    sin leer el documento antes.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def summary_ref(self, user_uid: str):
+        """Referencia Firestore al documento de estadísticas del usuario"""
+        return self.db.collection('usuarios').document(user_uid).collection('stats').document('summary')
+
+    @staticmethod
+    def month_key(fecha) -> Optional[str]:
+        """Mes (YYYY-MM, en UTC) al que pertenece una fecha"""
+        if not isinstance(fecha, datetime.datetime):
+            return None
+        if fecha.tzinfo is not None:
+            fecha = fecha.astimezone(datetime.timezone.utc)
+        return fecha.strftime('%Y-%m')
+
+    @staticmethod
+    def recent_entry(registro_id: str, registro: Dict) -> Dict:
+        """
+        Entrada de 'ultimas_producciones' para un registro
+
+        Debe construirse siempre igual para que ArrayRemove la encuentre al
+        deshacer, por eso la fecha se guarda como epoch.
+        """
+        from app.services.crop_service import CropService
+        entrada = {'id': registro_id, 'cultivo_id': registro.get('cultivo_id'),
+                   'fecha': CropService._to_epoch(registro.get('fecha'))}
+        for campo in ('kilos', 'unidades'):
+            if campo in registro:
+                entrada[campo] = registro[campo]
+        return entrada
+
+    @staticmethod
+    def _newest(entradas: List[Dict]) -> List[Dict]:
+        """Las STATS_RECENT_MAX entradas más recientes, de más reciente a más antigua"""
+        return sorted(entradas, key=lambda e: e.get('fecha') or 0, reverse=True)[:STATS_RECENT_MAX]
+    
+    def bounded_recent(self, guardadas: List[Dict], registros: List[Dict]) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """
+        Entradas de 'ultimas_producciones' a añadir y a quitar al escribir
+        unos registros para que la lista no pase de STATS_RECENT_MAX
+        
+        Args:
+            guardadas (List[Dict]): Entradas que tiene ya el documento
+            registros (List[Dict]): Registros nuevos con 'id' y 'cultivo_id'
+        
+        Returns:
+            Tuple[List[Dict], List[Dict], List[Dict]]: (a añadir, a quitar,
+                lista resultante)
+        """
+        nuevas = [self.recent_entry(r['id'], r) for r in registros]
+        quedan = self._newest(guardadas + nuevas)
+        ids = {e['id'] for e in quedan}
+        return ([e for e in nuevas if e['id'] in ids],
+                [e for e in guardadas if e['id'] not in ids],
+                quedan)
+    
+    def production_delta(self, registros: List[Dict], signo: int = 1,
+                         recientes: Optional[List[Dict]] = None) -> Dict:
+        """
+        Cambios del resumen al añadir (o eliminar) registros de producción
+
+        Al añadir sólo entran en 'ultimas_producciones' las STATS_RECENT_MAX
+        más recientes de la llamada (o las indicadas en recientes, calculadas
+        con bounded_recent), así un lote grande no hace crecer la lista.
+        
+        Args:
+            registros (List[Dict]): Registros con 'id' y 'cultivo_id'
+            signo (int): 1 al añadir, -1 al eliminar
+            recientes (Optional[List[Dict]]): Entradas a añadir a la lista
+
+        Returns:
+            Dict: Datos para set(merge=True) sobre el documento de resumen
+        """
+        kilos_por_mes = {}
+        for registro in registros:
+            mes = self.month_key(registro.get('fecha'))
+            if mes is None:
+                continue
+            por_cultivo = kilos_por_mes.setdefault(mes, {})
+            por_cultivo[registro['cultivo_id']] = por_cultivo.get(registro['cultivo_id'], 0) + float(registro.get('kilos', 0) or 0)
+
+        entradas = [self.recent_entry(r['id'], r) for r in registros]
+        if signo > 0:
+            entradas = self._newest(entradas) if recientes is None else recientes
+        datos = {
+            'kilos_totales': firestore.Increment(signo * sum(float(r.get('kilos', 0) or 0) for r in registros)),
+            'unidades_totales': firestore.Increment(signo * sum(int(r.get('unidades', 0) or 0) for r in registros)),
+            'num_registros': firestore.Increment(signo * len(registros)),
+            'kilos_por_mes': {
+                mes: {crop_id: firestore.Increment(signo * kilos) for crop_id, kilos in por_cultivo.items()}
+                for mes, por_cultivo in kilos_por_mes.items()
+            },
+            'actualizado_en': datetime.datetime.utcnow()
+        }
+        if entradas:
+            # Se añade sin leer; lo que sobre de escrituras sueltas se recorta al leer
+            datos['ultimas_producciones'] = firestore.ArrayUnion(entradas) if signo > 0 else firestore.ArrayRemove(entradas)
+        return datos
+
+    def crop_delta(self, crop_id: str, nombre: Optional[str] = None, precio_por_kilo: Optional[float] = None,
+                   activos: int = 0, finalizados: int = 0) -> Dict:
+        """
+        Cambios del resumen al crear, editar, finalizar o borrar un cultivo
+
+        Returns:
+            Dict: Datos para set(merge=True) sobre el documento de resumen
+        """
+        datos = {'actualizado_en': datetime.datetime.utcnow()}
+        info = {}
+        if nombre is not None:
+            info['nombre'] = nombre
+        if precio_por_kilo is not None:
+            info['precio_por_kilo'] = float(precio_por_kilo)
+        if info:
+            datos['cultivos'] = {crop_id: info}
+        if activos:
+            datos['cultivos_activos'] = firestore.Increment(activos)
+        if finalizados:
+            datos['cultivos_finalizados'] = firestore.Increment(finalizados)
+        return datos
+
+    def get_summary(self, user_uid: str) -> Dict:
+        """
+        Leer el resumen del usuario con ingresos y producciones recientes
+
+        Si el documento no existe o nunca se ha reconstruido (datos anteriores
+        al resumen), se regenera desde los datos originales.
+
+        Args:
+            user_uid (str): UID del usuario
+
+        Returns:
+            Dict: Totales, cultivos por estado, 'meses' (kilos y beneficio)
+                  y 'ultimas_producciones' de más reciente a más antigua
+        """
+        if not self.db:
+            return self.derive(self.build_summary([], []))
+
+        try:
+            doc = self.summary_ref(user_uid).get()
+            resumen = doc.to_dict() if doc.exists else None
+            if not resumen or 'reconstruido_en' not in resumen:
+                resumen = self.rebuild_summary(user_uid)
+            else:
+                self._trim_recent(user_uid, resumen.get('ultimas_producciones', []))
+            return self.derive(resumen)
+        except Exception as e:
+            print(f"❌ Error obteniendo estadísticas de {user_uid}: {e}")
+            return self.derive(self.build_summary([], []))
+
+    def _trim_recent(self, user_uid: str, entradas: List[Dict]) -> None:
+        """Quitar las producciones recientes sobrantes cuando la lista crece demasiado"""
+        if len(entradas) <= 2 * STATS_RECENT_MAX:
+            return
+        ordenadas = sorted(entradas, key=lambda e: e.get('fecha') or 0, reverse=True)
+        # ArrayRemove de entradas concretas: no pisa las que se añadan a la vez
+        self.summary_ref(user_uid).update({
+            'ultimas_producciones': firestore.ArrayRemove(ordenadas[STATS_RECENT_MAX:])
+        })
+
+    @staticmethod
+    def derive(resumen: Dict) -> Dict:
+        """
+        Calcular los datos derivados (ingresos y listas ordenadas) de un resumen
+
+        Args:
+            resumen (Dict): Documento de resumen tal y como está guardado
+
+        Returns:
+            Dict: Resumen listo para las vistas
+        """
+        cultivos = resumen.get('cultivos') or {}
+
+        def precio(crop_id):
+            return float((cultivos.get(crop_id) or {}).get('precio_por_kilo', 0) or 0)
+
+        meses = []
+        beneficio_total = 0
+        for mes, por_cultivo in sorted((resumen.get('kilos_por_mes') or {}).items()):
+            kilos = sum(por_cultivo.values())
+            beneficio = sum(k * precio(crop_id) for crop_id, k in por_cultivo.items())
+            beneficio_total += beneficio
+            meses.append({'mes': mes, 'kilos': kilos, 'beneficio': beneficio})
+
+        recientes = sorted(resumen.get('ultimas_producciones') or [], key=lambda e: e.get('fecha') or 0, reverse=True)
+        ultimas = []
+        for entrada in recientes[:STATS_RECENT_MAX]:
+            info = cultivos.get(entrada.get('cultivo_id')) or {}
+            ultimas.append(dict(
+                entrada,
+                fecha=datetime.datetime.fromtimestamp(entrada['fecha'], tz=datetime.timezone.utc) if entrada.get('fecha') else None,
+                nombre=info.get('nombre', 'Sin nombre'),
+                precio_por_kilo=precio(entrada.get('cultivo_id'))
+            ))
+
+        return {
+            'kilos_totales': resumen.get('kilos_totales', 0),
+            'unidades_totales': resumen.get('unidades_totales', 0),
+            'num_registros': resumen.get('num_registros', 0),
+            'beneficio_total': beneficio_total,
+            'cultivos_activos': resumen.get('cultivos_activos', 0),
+            'cultivos_finalizados': resumen.get('cultivos_finalizados', 0),
+            'meses': meses,
+            'ultimas_producciones': ultimas
+        }
+
+    def build_summary(self, cultivos: List[Dict], registros: List[Dict]) -> Dict:
+        """
+        Construir desde cero el documento de resumen
+
+        Args:
+            cultivos (List[Dict]): Todos los cultivos del usuario (activos o no)
+            registros (List[Dict]): Todos sus registros, con 'id' y 'cultivo_id'
+
+        Returns:
+            Dict: Documento de resumen completo
+        """
+        kilos_por_mes = {}
+        for registro in registros:
+            mes = self.month_key(registro.get('fecha'))
+            if mes is None:
+                continue
+            por_cultivo = kilos_por_mes.setdefault(mes, {})
+            por_cultivo[registro['cultivo_id']] = por_cultivo.get(registro['cultivo_id'], 0) + float(registro.get('kilos', 0) or 0)
+
+        recientes = sorted(registros, key=lambda r: self.recent_entry(r['id'], r)['fecha'] or 0, reverse=True)
+        return {
+            'kilos_totales': sum(float(r.get('kilos', 0) or 0) for r in registros),
+            'unidades_totales': sum(int(r.get('unidades', 0) or 0) for r in registros),
+            'num_registros': len(registros),
+            'cultivos_activos': sum(1 for c in cultivos if c.get('activo', True)),
+            'cultivos_finalizados': sum(1 for c in cultivos if not c.get('activo', True) and c.get('fecha_cosecha')),
+            'cultivos': {
+                c['id']: {'nombre': c.get('nombre', ''), 'precio_por_kilo': float(c.get('precio_por_kilo', 0) or 0)}
+                for c in cultivos
+            },
+            'kilos_por_mes': kilos_por_mes,
+            'ultimas_producciones': [self.recent_entry(r['id'], r) for r in recientes[:STATS_RECENT_MAX]],
+            'reconstruido_en': datetime.datetime.utcnow(),
+            'actualizado_en': datetime.datetime.utcnow()
+        }
+
+    def rebuild_summary(self, user_uid: str) -> Dict:
+        """
+        Regenerar el resumen de un usuario a partir de sus cultivos y registros
+
+        Sirve para reparar el documento o crearlo para datos antiguos. Las
+        escrituras que lleguen mientras se reconstruye pueden perderse; basta
+        con volver a lanzarlo.
+
+        Args:
+            user_uid (str): UID del usuario
+
+        Returns:
+            Dict: Documento de resumen guardado
+        """
+        from app.services.crop_service import CropService
+        cultivos, registros = CropService(self.db).get_user_history(user_uid)
+
+        resumen = self.build_summary(cultivos, registros)
+        self.summary_ref(user_uid).set(resumen)
+        print(f"📊 Resumen de estadísticas reconstruido para {user_uid}: {len(cultivos)} cultivos, {len(registros)} registros")
+        return resumen
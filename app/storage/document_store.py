@@ -0,0 +1,702 @@
+"""
+Almacén de documentos compatible con el cliente de Firestore
+Base común de los backends 'memory' y 'sqlite' (STORAGE_BACKEND)
+
+Implementa el subconjunto del API de firestore.Client que usan los servicios
+(colecciones, documentos, consultas con where/order_by/select/limit/cursores,
+collection_group, get_all, WriteBatch, transacciones y las transformaciones
+Increment, Minimum, Maximum, ArrayUnion, ArrayRemove y DELETE_FIELD), de modo
+que CropService, StatsService, UserService y PlanService funcionan igual con
+cualquier backend. Los backends sólo guardan y recorren documentos; consultas,
+transformaciones y transacciones se resuelven aquí.
+"""
+import contextlib
+import copy
+import datetime
+import functools
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+# Ruta de un documento: ('usuarios', uid, 'cultivos', crop_id)
+Path = Tuple[str, ...]
+
+# Máximo de intentos de una transacción en conflicto (como Firestore)
+TRANSACTION_MAX_ATTEMPTS = 5
+
+def split_field_path(field_path: str) -> List[str]:
+    """Partes de una ruta de campo con puntos ('cultivos.abc.nombre')"""
+    return [parte.strip('`') for parte in field_path.split('.')]
+
+def get_field(data: Dict, field_path: str) -> Tuple[Any, bool]:
+    """Valor de un campo anidado y si existe"""
+    actual = data
+    for parte in split_field_path(field_path):
+        if not isinstance(actual, dict) or parte not in actual:
+            return None, False
+        actual = actual[parte]
+    return actual, True
+
+def normalize_value(value):
+    """
+    Copia de un valor tal y como lo devolvería Firestore
+
+    Las fechas sin zona se guardan como UTC y las tuplas como listas.
+    """
+    if isinstance(value, datetime.datetime):
+        return value if value.tzinfo is not None else value.replace(tzinfo=datetime.timezone.utc)
+    if isinstance(value, dict):
+        return {k: normalize_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_value(v) for v in value]
+    if isinstance(value, DocumentReference):
+        return value
+    return copy.deepcopy(value)
+
+def _type_rank(value) -> int:
+    """Orden entre tipos distintos, el mismo que aplica Firestore"""
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime.datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, DocumentReference):
+        return 6
+    if isinstance(value, list):
+        return 8
+    if isinstance(value, dict):
+        return 9
+    return 7
+
+def compare_values(a, b) -> int:
+    """Comparar dos valores de Firestore (-1, 0 o 1)"""
+    rango_a, rango_b = _type_rank(a), _type_rank(b)
+    if rango_a != rango_b:
+        return -1 if rango_a < rango_b else 1
+    if rango_a == 0:
+        return 0
+    if rango_a == 3:
+        a, b = normalize_value(a), normalize_value(b)
+    elif rango_a == 6:
+        a, b = a._path, b._path
+    elif rango_a == 8:
+        for x, y in zip(a, b):
+            resultado = compare_values(x, y)
+            if resultado:
+                return resultado
+        return compare_values(len(a), len(b))
+    elif rango_a == 9:
+        for (ka, va), (kb, vb) in zip(sorted(a.items()), sorted(b.items())):
+            resultado = compare_values(ka, kb) or compare_values(va, vb)
+            if resultado:
+                return resultado
+        return compare_values(len(a), len(b))
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        return 0
+
+def _values_equal(a, b) -> bool:
+    """Igualdad con las reglas de Firestore (1 == 1.0, pero True != 1)"""
+    return _type_rank(a) == _type_rank(b) and compare_values(a, b) == 0
+
+class DocumentSnapshot:
+    """Documento leído (exista o no) en un momento dado"""
+
+    def __init__(self, reference: 'DocumentReference', data: Optional[Dict]):
+        self.reference = reference
+        self._data = data
+        self.create_time = None
+        self.update_time = None
+        self.read_time = None
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        valor, existe = get_field(self._data or {}, field_path)
+        if not existe:
+            raise KeyError(field_path)
+        return copy.deepcopy(valor)
+
+class _Write:
+    """Operación pendiente de un lote o transacción"""
+
+    def __init__(self, path: Path, kind: str, data: Optional[Dict] = None, merge: bool = False):
+        self.path = path
+        self.kind = kind
+        self.data = data
+        self.merge = merge
+
+    def apply(self, actual: Optional[Dict]) -> Optional[Dict]:
+        """Documento resultante de aplicar la operación (None si se borra)"""
+        if self.kind == 'delete':
+            return None
+        if self.kind == 'create' and actual is not None:
+            raise exceptions.AlreadyExists(f"El documento {'/'.join(self.path)} ya existe")
+        if self.kind == 'update' and actual is None:
+            raise exceptions.NotFound(f"No existe el documento {'/'.join(self.path)}")
+
+        if self.kind == 'update':
+            nuevo = copy.deepcopy(actual)
+            for field_path, valor in self.data.items():
+                _apply_field(nuevo, split_field_path(field_path), valor)
+            return nuevo
+        if self.kind == 'set' and self.merge:
+            nuevo = copy.deepcopy(actual) if actual is not None else {}
+            _merge_into(nuevo, self.data)
+            return nuevo
+        # set sin merge o create: el documento se sustituye entero
+        nuevo = {}
+        _merge_into(nuevo, self.data)
+        return nuevo
+
+def _merge_into(destino: Dict, datos: Dict) -> None:
+    """
+    Fusionar 'datos' en 'destino' como set(merge=True): los mapas se combinan
+
+    En set() las claves son nombres de campo literales (los puntos no
+    indican anidamiento, a diferencia de update()).
+    """
+    for clave, valor in datos.items():
+        if isinstance(valor, dict):
+            hijo = destino.get(clave)
+            if not isinstance(hijo, dict):
+                hijo = destino[clave] = {}
+            _merge_into(hijo, valor)
+        else:
+            _apply_field(destino, [clave], valor)
+
+def _apply_field(destino: Dict, partes: List[str], valor) -> None:
+    """Escribir (o transformar) un campo anidado"""
+    for parte in partes[:-1]:
+        hijo = destino.get(parte)
+        if not isinstance(hijo, dict):
+            hijo = destino[parte] = {}
+        destino = hijo
+    campo = partes[-1]
+    if valor is transforms.DELETE_FIELD:
+        destino.pop(campo, None)
+    elif valor is transforms.SERVER_TIMESTAMP:
+        destino[campo] = datetime.datetime.now(datetime.timezone.utc)
+    elif isinstance(valor, transforms._NumericValue):
+        actual = destino.get(campo)
+        numerico = isinstance(actual, (int, float)) and not isinstance(actual, bool)
+        if isinstance(valor, transforms.Increment):
+            destino[campo] = actual + valor.value if numerico else valor.value
+        elif isinstance(valor, transforms.Maximum):
+            destino[campo] = max(actual, valor.value) if numerico else valor.value
+        else:
+            destino[campo] = min(actual, valor.value) if numerico else valor.value
+    elif isinstance(valor, transforms.ArrayUnion):
+        actual = destino.get(campo)
+        lista = list(actual) if isinstance(actual, list) else []
+        for elemento in normalize_value(valor.values):
+            if not any(_values_equal(elemento, x) for x in lista):
+                lista.append(elemento)
+        destino[campo] = lista
+    elif isinstance(valor, transforms.ArrayRemove):
+        actual = destino.get(campo)
+        quitar = normalize_value(valor.values)
+        lista = list(actual) if isinstance(actual, list) else []
+        destino[campo] = [x for x in lista if not any(_values_equal(x, q) for q in quitar)]
+    elif isinstance(valor, dict):
+        # Un mapa sustituye al anterior; puede llevar transformaciones dentro
+        destino[campo] = {}
+        _merge_into(destino[campo], valor)
+    else:
+        destino[campo] = normalize_value(valor)
+
+def _project(data: Dict, field_paths: Optional[List[str]]) -> Dict:
+    """Quedarse sólo con los campos pedidos (select / field_paths)"""
+    if field_paths is None:
+        return data
+    proyectado = {}
+    for field_path in field_paths:
+        valor, existe = get_field(data, field_path)
+        if existe:
+            _apply_field(proyectado, split_field_path(field_path), copy.deepcopy(valor))
+    return proyectado
+
+class Query:
+    """Consulta sobre una colección o un grupo de colecciones"""
+
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, store: 'DocumentStore', parent: Path, collection_id: str, all_descendants: bool = False):
+        self._store = store
+        self._parent_path = parent
+        self._collection_id = collection_id
+        self._all_descendants = all_descendants
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._orders: List[Tuple[str, str]] = []
+        self._projection: Optional[List[str]] = None
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._start: Optional[Tuple[Any, bool]] = None
+        self._end: Optional[Tuple[Any, bool]] = None
+
+    def _copy(self, **cambios) -> 'Query':
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        for clave, valor in cambios.items():
+            setattr(query, clave, valor)
+        return query
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value=None, filter=None) -> 'Query':
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query = self._copy()
+        query._filters.append((field_path, op_string, normalize_value(value)))
+        return query
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> 'Query':
+        query = self._copy()
+        query._orders.append((field_path, direction))
+        return query
+
+    def select(self, field_paths: Iterable[str]) -> 'Query':
+        return self._copy(_projection=list(field_paths))
+
+    def limit(self, count: int) -> 'Query':
+        return self._copy(_limit=count)
+
+    def offset(self, num_to_skip: int) -> 'Query':
+        return self._copy(_offset=num_to_skip)
+
+    def start_at(self, document_fields) -> 'Query':
+        return self._copy(_start=(document_fields, True))
+
+    def start_after(self, document_fields) -> 'Query':
+        return self._copy(_start=(document_fields, False))
+
+    def end_before(self, document_fields) -> 'Query':
+        return self._copy(_end=(document_fields, False))
+
+    def end_at(self, document_fields) -> 'Query':
+        return self._copy(_end=(document_fields, True))
+
+    def get(self, transaction: Optional['Transaction'] = None) -> List[DocumentSnapshot]:
+        return list(self.stream(transaction=transaction))
+
+    def stream(self, transaction: Optional['Transaction'] = None):
+        """Ejecutar la consulta y devolver los documentos en orden"""
+        if transaction is not None:
+            transaction._check_read()
+        igualdades = {f: v for f, op, v in self._filters if op == '=='}
+        with self._store._lock:
+            if self._all_descendants:
+                filas = list(self._store._scan_group(self._collection_id, igualdades))
+            else:
+                filas = list(self._store._scan_collection(self._parent_path, self._collection_id, igualdades))
+
+        filas = [fila for fila in filas if self._matches(fila[1])]
+        orders = self._normalized_orders()
+        filas = [fila for fila in filas if all(f == '__name__' or get_field(fila[1], f)[1] for f, _ in orders)]
+        filas.sort(key=functools.cmp_to_key(lambda a, b: self._compare_rows(a, b, orders)))
+
+        if self._start is not None:
+            valores, incluido = self._start
+            cursor = self._cursor_values(valores, orders)
+            filas = [fila for fila in filas if self._compare_cursor(fila, cursor, orders) > (-1 if incluido else 0)]
+        if self._end is not None:
+            valores, incluido = self._end
+            cursor = self._cursor_values(valores, orders)
+            filas = [fila for fila in filas if self._compare_cursor(fila, cursor, orders) < (1 if incluido else 0)]
+        filas = filas[self._offset:]
+        if self._limit is not None:
+            filas = filas[:self._limit]
+
+        for path, data, version in filas:
+            if transaction is not None:
+                transaction._record_read(path, version)
+            yield DocumentSnapshot(self._store._reference(path), _project(copy.deepcopy(data), self._projection))
+
+    def _matches(self, data: Dict) -> bool:
+        for field_path, op, esperado in self._filters:
+            valor, existe = get_field(data, field_path)
+            if op == '==':
+                ok = existe and _values_equal(valor, esperado)
+            elif op == '!=':
+                ok = existe and valor is not None and not _values_equal(valor, esperado)
+            elif op == 'in':
+                ok = existe and any(_values_equal(valor, e) for e in esperado)
+            elif op == 'not-in':
+                ok = existe and valor is not None and not any(_values_equal(valor, e) for e in esperado)
+            elif op == 'array_contains':
+                ok = existe and isinstance(valor, list) and any(_values_equal(x, esperado) for x in valor)
+            elif op == 'array_contains_any':
+                ok = existe and isinstance(valor, list) and any(_values_equal(x, e) for x in valor for e in esperado)
+            elif op in ('<', '<=', '>', '>='):
+                # Las desigualdades sólo comparan valores del mismo tipo
+                ok = existe and _type_rank(valor) == _type_rank(esperado)
+                if ok:
+                    resultado = compare_values(valor, esperado)
+                    ok = {'<': resultado < 0, '<=': resultado <= 0, '>': resultado > 0, '>=': resultado >= 0}[op]
+            else:
+                raise ValueError(f"Operador no soportado: {op}")
+            if not ok:
+                return False
+        return True
+
+    def _normalized_orders(self) -> List[Tuple[str, str]]:
+        """Orden efectivo: el pedido, el campo de la desigualdad y __name__ al final"""
+        orders = list(self._orders)
+        if not orders:
+            for field_path, op, _ in self._filters:
+                if op in ('<', '<=', '>', '>=', '!=', 'not-in'):
+                    orders.append((field_path, self.ASCENDING))
+                    break
+        if not any(f == '__name__' for f, _ in orders):
+            direccion = orders[-1][1] if orders else self.ASCENDING
+            orders.append(('__name__', direccion))
+        return orders
+
+    @staticmethod
+    def _order_value(fila, field_path: str):
+        if field_path == '__name__':
+            return fila[0]
+        return get_field(fila[1], field_path)[0]
+
+    def _compare_rows(self, a, b, orders) -> int:
+        for field_path, direccion in orders:
+            if field_path == '__name__':
+                resultado = (a[0] > b[0]) - (a[0] < b[0])
+            else:
+                resultado = compare_values(self._order_value(a, field_path), self._order_value(b, field_path))
+            if resultado:
+                return -resultado if direccion == self.DESCENDING else resultado
+        return 0
+
+    def _cursor_values(self, valores, orders) -> List:
+        """Valores del cursor alineados con el orden (dict, lista o DocumentSnapshot)"""
+        if isinstance(valores, DocumentSnapshot):
+            datos = valores._data or {}
+            lista = []
+            for field_path, _ in orders:
+                lista.append(valores.reference._path if field_path == '__name__' else get_field(datos, field_path)[0])
+            return lista
+        if isinstance(valores, dict):
+            lista = []
+            for field_path, _ in orders:
+                if field_path not in valores:
+                    break
+                lista.append(valores[field_path])
+            valores = lista
+        lista = []
+        for (field_path, _), valor in zip(orders, valores):
+            if field_path == '__name__':
+                if isinstance(valor, DocumentReference):
+                    valor = valor._path
+                elif isinstance(valor, str):
+                    valor = tuple(valor.split('/')) if '/' in valor else self._parent_path + (self._collection_id, valor)
+            else:
+                valor = normalize_value(valor)
+            lista.append(valor)
+        return lista
+
+    def _compare_cursor(self, fila, cursor, orders) -> int:
+        """Posición de la fila respecto al cursor (>0 si va después)"""
+        for (field_path, direccion), valor in zip(orders, cursor):
+            if field_path == '__name__':
+                resultado = (fila[0] > valor) - (fila[0] < valor)
+            else:
+                resultado = compare_values(self._order_value(fila, field_path), valor)
+            if resultado:
+                return -resultado if direccion == self.DESCENDING else resultado
+        return 0
+
+class CollectionReference(Query):
+    """Referencia a una colección (también sirve como consulta)"""
+
+    def __init__(self, store: 'DocumentStore', parent: Path, collection_id: str):
+        super().__init__(store, parent, collection_id)
+
+    @property
+    def id(self) -> str:
+        return self._collection_id
+
+    @property
+    def parent(self) -> Optional['DocumentReference']:
+        return self._store._reference(self._parent_path) if self._parent_path else None
+
+    def document(self, document_id: Optional[str] = None) -> 'DocumentReference':
+        if document_id is None:
+            document_id = uuid.uuid4().hex[:20]
+        return self._store._reference(self._parent_path + (self._collection_id, document_id))
+
+    def add(self, document_data: Dict, document_id: Optional[str] = None):
+        referencia = self.document(document_id)
+        referencia.create(document_data)
+        return datetime.datetime.now(datetime.timezone.utc), referencia
+
+    def list_documents(self, page_size: Optional[int] = None) -> List['DocumentReference']:
+        with self._store._lock:
+            filas = list(self._store._scan_collection(self._parent_path, self._collection_id, {}))
+        return [self._store._reference(path) for path, _, _ in filas]
+
+class DocumentReference:
+    """Referencia a un documento"""
+
+    def __init__(self, store: 'DocumentStore', path: Path):
+        self._store = store
+        self._path = path
+
+    @property
+    def id(self) -> str:
+        return self._path[-1]
+
+    @property
+    def path(self) -> str:
+        return '/'.join(self._path)
+
+    @property
+    def parent(self) -> CollectionReference:
+        return CollectionReference(self._store, self._path[:-2], self._path[-2])
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DocumentReference) and other._path == self._path
+
+    def __hash__(self) -> int:
+        return hash(self._path)
+
+    def __repr__(self) -> str:
+        return f"<DocumentReference {self.path}>"
+
+    def collection(self, collection_id: str) -> CollectionReference:
+        return CollectionReference(self._store, self._path, collection_id)
+
+    def collections(self) -> List[CollectionReference]:
+        with self._store._lock:
+            ids = self._store._collection_ids(self._path)
+        return [self.collection(collection_id) for collection_id in sorted(ids)]
+
+    def get(self, field_paths: Optional[List[str]] = None, transaction: Optional['Transaction'] = None) -> DocumentSnapshot:
+        if transaction is not None:
+            transaction._check_read()
+        with self._store._lock:
+            fila = self._store._read(self._path)
+        data, version = fila if fila else (None, 0)
+        if transaction is not None:
+            transaction._record_read(self._path, version)
+        if data is not None:
+            data = _project(copy.deepcopy(data), field_paths)
+        return DocumentSnapshot(self, data)
+
+    def create(self, document_data: Dict):
+        return self._store._commit([_Write(self._path, 'create', document_data)])
+
+    def set(self, document_data: Dict, merge: bool = False):
+        return self._store._commit([_Write(self._path, 'set', document_data, merge)])
+
+    def update(self, field_updates: Dict):
+        return self._store._commit([_Write(self._path, 'update', field_updates)])
+
+    def delete(self):
+        return self._store._commit([_Write(self._path, 'delete')])
+
+class WriteBatch:
+    """Lote de escrituras que se aplican juntas y de forma atómica"""
+
+    def __init__(self, store: 'DocumentStore'):
+        self._store = store
+        self._writes: List[_Write] = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def create(self, reference: DocumentReference, document_data: Dict) -> None:
+        self._writes.append(_Write(reference._path, 'create', document_data))
+
+    def set(self, reference: DocumentReference, document_data: Dict, merge: bool = False) -> None:
+        self._writes.append(_Write(reference._path, 'set', document_data, merge))
+
+    def update(self, reference: DocumentReference, field_updates: Dict) -> None:
+        self._writes.append(_Write(reference._path, 'update', field_updates))
+
+    def delete(self, reference: DocumentReference) -> None:
+        self._writes.append(_Write(reference._path, 'delete'))
+
+    def commit(self) -> List:
+        escrituras, self._writes = self._writes, []
+        return self._store._commit(escrituras)
+
+class Transaction(WriteBatch):
+    """
+    Transacción optimista compatible con @firestore.transactional
+
+    Guarda la versión de cada documento leído; si alguno cambia antes del
+    commit se lanza Aborted y el decorador vuelve a ejecutar la función.
+    """
+
+    def __init__(self, store: 'DocumentStore', max_attempts: int = TRANSACTION_MAX_ATTEMPTS, read_only: bool = False):
+        super().__init__(store)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads: Dict[Path, int] = {}
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def _begin(self, retry_id=None) -> None:
+        if self._id is not None:
+            raise ValueError('La transacción ya está en curso')
+        self._id = uuid.uuid4().bytes
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _rollback(self) -> None:
+        self._clean_up()
+
+    def _commit(self) -> List:
+        try:
+            return self._store._commit(self._writes, self._reads)
+        finally:
+            self._clean_up()
+
+    def commit(self) -> List:
+        return self._commit()
+
+    def _check_read(self) -> None:
+        if self._writes:
+            raise ValueError('Las lecturas de una transacción deben ir antes que las escrituras')
+
+    def _record_read(self, path: Path, version: int) -> None:
+        self._reads.setdefault(path, version)
+
+    def get(self, ref_or_query, field_paths: Optional[List[str]] = None):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get(field_paths=field_paths, transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references, field_paths: Optional[List[str]] = None):
+        return self._store.get_all(references, field_paths=field_paths, transaction=self)
+
+class DocumentStore:
+    """
+    Cliente de documentos con el API de firestore.Client
+
+    Los backends implementan _read, _scan_collection, _scan_group,
+    _collection_ids y _write_all. Todas las llamadas a esos métodos se hacen
+    con self._lock tomado.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def collection(self, collection_id: str) -> CollectionReference:
+        return CollectionReference(self, (), collection_id)
+
+    def collection_group(self, collection_id: str) -> Query:
+        return Query(self, (), collection_id, all_descendants=True)
+
+    def document(self, document_path: str) -> DocumentReference:
+        return self._reference(tuple(document_path.split('/')))
+
+    def collections(self) -> List[CollectionReference]:
+        with self._lock:
+            ids = self._collection_ids(())
+        return [self.collection(collection_id) for collection_id in sorted(ids)]
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def transaction(self, max_attempts: int = TRANSACTION_MAX_ATTEMPTS, read_only: bool = False) -> Transaction:
+        return Transaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(self, references, field_paths: Optional[List[str]] = None, transaction: Optional[Transaction] = None):
+        """Leer varios documentos de una vez (incluye los que no existen)"""
+        for referencia in list(references):
+            yield referencia.get(field_paths=field_paths, transaction=transaction)
+
+    def close(self) -> None:
+        """Liberar recursos del backend"""
+
+    def _reference(self, path: Path) -> DocumentReference:
+        return DocumentReference(self, path)
+
+    def _commit(self, escrituras: List[_Write], lecturas: Optional[Dict[Path, int]] = None) -> List:
+        """
+        Aplicar escrituras de forma atómica
+
+        Se calculan todos los documentos resultantes antes de guardar nada,
+        así un error (p. ej. update de un documento inexistente) no deja
+        cambios a medias.
+        """
+        with self._lock, self._atomic():
+            for path, version in (lecturas or {}).items():
+                fila = self._read(path)
+                if (fila[1] if fila else 0) != version:
+                    raise exceptions.Aborted(f"Conflicto en {'/'.join(path)}, se reintenta la transacción")
+
+            cambios: Dict[Path, Optional[Dict]] = {}
+            for escritura in escrituras:
+                if escritura.path in cambios:
+                    actual = cambios[escritura.path]
+                else:
+                    fila = self._read(escritura.path)
+                    actual = fila[0] if fila else None
+                cambios[escritura.path] = escritura.apply(actual)
+            if cambios:
+                self._write_all(cambios)
+        ahora = datetime.datetime.now(datetime.timezone.utc)
+        return [ahora for _ in escrituras]
+
+    # Operaciones que implementa cada backend
+
+    def _atomic(self):
+        """
+        Contexto en el que _commit comprueba las lecturas, lee y escribe
+
+        Basta con self._lock para los backends de un solo proceso; los que
+        comparten datos entre procesos abren aquí su transacción.
+        """
+        return contextlib.nullcontext()
+
+    def _read(self, path: Path) -> Optional[Tuple[Dict, int]]:
+        """(datos, versión) de un documento, o None si no existe"""
+        raise NotImplementedError
+
+    def _scan_collection(self, parent: Path, collection_id: str, igualdades: Dict) -> Iterable[Tuple[Path, Dict, int]]:
+        """Documentos de una colección; 'igualdades' permite filtrar antes (opcional)"""
+        raise NotImplementedError
+
+    def _scan_group(self, collection_id: str, igualdades: Dict) -> Iterable[Tuple[Path, Dict, int]]:
+        """Documentos de todas las colecciones con ese ID"""
+        raise NotImplementedError
+
+    def _collection_ids(self, parent: Path) -> Iterable[str]:
+        """IDs de las subcolecciones con documentos bajo 'parent' (() para la raíz)"""
+        raise NotImplementedError
+
+    def _write_all(self, cambios: Dict[Path, Optional[Dict]]) -> None:
+        """Guardar los documentos cambiados (None = borrado) de forma atómica"""
+        raise NotImplementedError
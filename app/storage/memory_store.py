@@ -0,0 +1,57 @@
+"""
+Backend de almacenamiento en memoria (STORAGE_BACKEND=memory)
+Sin red ni disco: para tests, benchmarks y pruebas de carga locales
+"""
+from typing import Dict, Iterable, Optional, Set, Tuple
+from app.storage.document_store import DocumentStore, Path
+
+class MemoryStore(DocumentStore):
+    """
+    Documentos en diccionarios del proceso
+
+    Se indexan por colección y por ID de colección para que las consultas y
+    los collection_group no recorran todos los documentos. Los datos se
+    pierden al reiniciar y no se comparten entre procesos.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._docs: Dict[Path, Tuple[Dict, int]] = {}
+        # (ruta del padre, ID de colección) -> rutas de sus documentos
+        self._by_collection: Dict[Tuple[Path, str], Set[Path]] = {}
+        # ID de colección -> rutas de sus documentos (collection_group)
+        self._by_group: Dict[str, Set[Path]] = {}
+        self._version = 0
+
+    def _read(self, path: Path) -> Optional[Tuple[Dict, int]]:
+        return self._docs.get(path)
+
+    def _scan_collection(self, parent: Path, collection_id: str, igualdades: Dict) -> Iterable[Tuple[Path, Dict, int]]:
+        for path in self._by_collection.get((parent, collection_id), ()):
+            data, version = self._docs[path]
+            yield path, data, version
+
+    def _scan_group(self, collection_id: str, igualdades: Dict) -> Iterable[Tuple[Path, Dict, int]]:
+        for path in self._by_group.get(collection_id, ()):
+            data, version = self._docs[path]
+            yield path, data, version
+
+    def _collection_ids(self, parent: Path) -> Iterable[str]:
+        ids = set()
+        for path in self._docs:
+            if len(path) > len(parent) + 1 and path[:len(parent)] == parent:
+                ids.add(path[len(parent)])
+        return ids
+
+    def _write_all(self, cambios: Dict[Path, Optional[Dict]]) -> None:
+        self._version += 1
+        for path, data in cambios.items():
+            clave = (path[:-2], path[-2])
+            if data is None:
+                if self._docs.pop(path, None) is not None:
+                    self._by_collection[clave].discard(path)
+                    self._by_group[path[-2]].discard(path)
+                continue
+            self._docs[path] = (data, self._version)
+            self._by_collection.setdefault(clave, set()).add(path)
+            self._by_group.setdefault(path[-2], set()).add(path)
@@ -0,0 +1,151 @@
+"""
+Backend de almacenamiento SQLite (STORAGE_BACKEND=sqlite)
+Para instalaciones pequeñas o sin conexión, sin depender de Firebase
+"""
+import contextlib
+import datetime
+import json
+import sqlite3
+from typing import Dict, Iterable, Optional, Tuple
+from app.storage.document_store import DocumentStore, Path, split_field_path
+
+# Campos por los que se filtra con igualdad en las consultas de los servicios;
+# tienen índice sobre su valor JSON
+INDEXED_FIELDS = ['user_uid', 'activo', 'cultivo_id', 'email']
+
+class SQLiteStore(DocumentStore):
+    """
+    Documentos guardados como JSON en una tabla SQLite
+
+    Cada documento es una fila con su ruta, la ruta de su colección y el ID
+    de colección, con índices para listar colecciones, para collection_group
+    y para los campos de INDEXED_FIELDS. Cada commit es una transacción SQLite
+    (BEGIN IMMEDIATE) que comprueba las lecturas de la transacción, lee los
+    documentos a transformar y escribe, así varios procesos pueden compartir
+    el fichero. La versión de cada escritura sale de la fila de 'contador'
+    dentro de esa misma transacción.
+    """
+
+    def __init__(self, path: str = 'huerto.sqlite3'):
+        super().__init__()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS documentos (
+                ruta TEXT PRIMARY KEY,
+                coleccion TEXT NOT NULL,
+                coleccion_id TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                version INTEGER NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_documentos_coleccion ON documentos (coleccion)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_documentos_grupo ON documentos (coleccion_id)')
+        for campo in INDEXED_FIELDS:
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_documentos_{campo} "
+                f"ON documentos (coleccion_id, json_extract(datos, '{self._json_path(campo)}'))"
+            )
+        # Contador de versiones compartido por todos los procesos; nunca
+        # retrocede, aunque se borre el documento con la versión más alta
+        self._conn.execute('CREATE TABLE IF NOT EXISTS contador (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)')
+        self._conn.execute('INSERT OR IGNORE INTO contador (id, version) SELECT 0, COALESCE(MAX(version), 0) FROM documentos')
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _json_path(field_path: str) -> str:
+        return '$' + ''.join(f'."{parte}"' for parte in split_field_path(field_path))
+
+    @staticmethod
+    def _encode(data: Dict) -> str:
+        def por_defecto(valor):
+            if isinstance(valor, datetime.datetime):
+                return {'$fecha': valor.isoformat()}
+            if isinstance(valor, bytes):
+                return {'$bytes': valor.hex()}
+            raise TypeError(f"Tipo no soportado en SQLite: {type(valor).__name__}")
+        return json.dumps(data, default=por_defecto, ensure_ascii=False, separators=(',', ':'))
+
+    @staticmethod
+    def _decode(texto: str) -> Dict:
+        def objeto(valor):
+            if len(valor) == 1 and '$fecha' in valor:
+                return datetime.datetime.fromisoformat(valor['$fecha'])
+            if len(valor) == 1 and '$bytes' in valor:
+                return bytes.fromhex(valor['$bytes'])
+            return valor
+        return json.loads(texto, object_hook=objeto)
+
+    def _where_igualdades(self, igualdades: Dict) -> Tuple[str, list]:
+        """Condiciones SQL para las igualdades que puede resolver un índice"""
+        condiciones = []
+        parametros = []
+        for field_path, valor in igualdades.items():
+            # Sólo escalares: el resto se filtra en Python (que filtra siempre)
+            if field_path in INDEXED_FIELDS and isinstance(valor, (str, bool, int)):
+                condiciones.append(f"json_extract(datos, '{self._json_path(field_path)}') = ?")
+                parametros.append(valor)
+        return ''.join(f' AND {c}' for c in condiciones), parametros
+
+    @staticmethod
+    def _ruta(path: Path) -> str:
+        return '/'.join(path)
+
+    def _read(self, path: Path) -> Optional[Tuple[Dict, int]]:
+        fila = self._conn.execute('SELECT datos, version FROM documentos WHERE ruta = ?', (self._ruta(path),)).fetchone()
+        return (self._decode(fila[0]), fila[1]) if fila else None
+
+    def _scan_collection(self, parent: Path, collection_id: str, igualdades: Dict) -> Iterable[Tuple[Path, Dict, int]]:
+        condiciones, parametros = self._where_igualdades(igualdades)
+        filas = self._conn.execute(
+            f'SELECT ruta, datos, version FROM documentos WHERE coleccion = ?{condiciones}',
+            [self._ruta(parent + (collection_id,))] + parametros
+        ).fetchall()
+        return [(tuple(ruta.split('/')), self._decode(datos), version) for ruta, datos, version in filas]
+
+    def _scan_group(self, collection_id: str, igualdades: Dict) -> Iterable[Tuple[Path, Dict, int]]:
+        condiciones, parametros = self._where_igualdades(igualdades)
+        filas = self._conn.execute(
+            f'SELECT ruta, datos, version FROM documentos WHERE coleccion_id = ?{condiciones}',
+            [collection_id] + parametros
+        ).fetchall()
+        return [(tuple(ruta.split('/')), self._decode(datos), version) for ruta, datos, version in filas]
+
+    def _collection_ids(self, parent: Path) -> Iterable[str]:
+        if not parent:
+            filas = self._conn.execute("SELECT DISTINCT substr(ruta, 1, instr(ruta, '/') - 1) FROM documentos").fetchall()
+        else:
+            prefijo = self._ruta(parent) + '/'
+            filas = self._conn.execute(
+                'SELECT DISTINCT substr(ruta, ?, instr(substr(ruta, ?), \'/\') - 1) FROM documentos WHERE ruta LIKE ? ESCAPE \'\\\'',
+                (len(prefijo) + 1, len(prefijo) + 1, prefijo.replace('%', '\\%').replace('_', '\\_') + '%')
+            ).fetchall()
+        return {fila[0] for fila in filas if fila[0]}
+
+    @contextlib.contextmanager
+    def _atomic(self):
+        # Bloquea la escritura de otros procesos desde la comprobación de lecturas hasta el COMMIT
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def _write_all(self, cambios: Dict[Path, Optional[Dict]]) -> None:
+        # Dentro de la transacción de _atomic
+        self._conn.execute('UPDATE contador SET version = version + 1 WHERE id = 0')
+        version = self._conn.execute('SELECT version FROM contador WHERE id = 0').fetchone()[0]
+        for path, data in cambios.items():
+            if data is None:
+                self._conn.execute('DELETE FROM documentos WHERE ruta = ?', (self._ruta(path),))
+            else:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO documentos (ruta, coleccion, coleccion_id, datos, version) VALUES (?, ?, ?, ?, ?)',
+                    (self._ruta(path), self._ruta(path[:-1]), path[-2], self._encode(data), version)
+                )
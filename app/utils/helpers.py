@@ -227,3 +227,13 @@ def calculate_roi(inversion: float, beneficios: float) -> float:
         return 0
     
     return ((beneficios - inversion) / inversion) * 100
+
+def format_spanish_number(value, decimals=2):
+    """Formatear número con separador decimal español (coma)"""
+    try:
+        if value is None:
+            return "0"
+        formatted = f"{float(value):.{decimals}f}"
+        return formatted.replace('.', ',')
+    except (ValueError, TypeError):
+        return str(value)
@@ -0,0 +1,64 @@
+"""
+GET condicional (ETag / 304) para las rutas JSON
+ETag fuerte a partir de la versión de datos del usuario y de la petición
+"""
+import hashlib
+from functools import wraps
+from flask import current_app, request, make_response
+
+def data_etag(user_uid: str, version: int) -> str:
+    """
+    ETag de una respuesta JSON para una versión de los datos del usuario
+
+    Incluye la ruta (endpoint y sus parámetros) y la query string ordenada,
+    así cada página, proyección o granularidad tiene su propia ETag.
+
+    Args:
+        user_uid (str): UID del usuario
+        version (int): Versión de datos (CropService.get_data_version)
+
+    Returns:
+        str: ETag sin comillas
+    """
+    argumentos = '&'.join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    ruta = '&'.join(f"{k}={v}" for k, v in sorted((request.view_args or {}).items()))
+    clave = f"{request.endpoint}|{ruta}|{argumentos}|{user_uid}|{version}"
+    return hashlib.sha256(clave.encode('utf-8')).hexdigest()[:32]
+
+def conditional_json(f):
+    """
+    Decorador para responder 304 si el cliente ya tiene la versión actual
+
+    Va debajo de @require_auth u @optional_auth. Antes de ejecutar la vista
+    se lee sólo la versión de datos del usuario: si coincide con la ETag de
+    If-None-Match se responde 304 sin cargar ni serializar cultivos. Las
+    respuestas 200 llevan la ETag y Cache-Control: private, no-cache para
+    que el navegador revalide siempre. Sin usuario (modo demo, datos
+    aleatorios) la vista se ejecuta sin ETag.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from app.middleware.auth_middleware import get_current_user_uid
+        from app.services.crop_service import CropService
+
+        user_uid = get_current_user_uid()
+        if not user_uid:
+            return f(*args, **kwargs)
+
+        try:
+            etag = data_etag(user_uid, CropService(current_app.db).get_data_version(user_uid))
+        except Exception as e:
+            print(f"⚠️ No se pudo leer la versión de datos de {user_uid}: {e}")
+            return f(*args, **kwargs)
+
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return decorated_function
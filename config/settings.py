@@ -63,6 +63,50 @@ class Config:
         'exportar_datos': True
     }
     
+    # Almacenamiento de datos: 'firestore' (por defecto), 'memory' (tests y
+    # benchmarks, sin red) o 'sqlite' (instalaciones pequeñas o sin conexión)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', 'huerto.sqlite3')
+    
+    # Zona horaria local (IANA) de los rollups por día, semana, mes y temporada
+    ROLLUP_TIMEZONE = os.environ.get('ROLLUP_TIMEZONE', 'Europe/Madrid')
+    
+    # Caché de cultivos en memoria de proceso (por instancia de Cloud Run)
+    CROP_CACHE_MAX_USERS = int(os.environ.get('CROP_CACHE_MAX_USERS', 500))
+    CROP_CACHE_TTL_SECONDS = int(os.environ.get('CROP_CACHE_TTL_SECONDS', 300))
+    
+    # Caché de series reducidas e índices de rango (por versión de datos)
+    SERIES_CACHE_MAX_ENTRIES = int(os.environ.get('SERIES_CACHE_MAX_ENTRIES', 1000))
+    SERIES_CACHE_TTL_SECONDS = int(os.environ.get('SERIES_CACHE_TTL_SECONDS', 600))
+    
+    # Trabajos de exportación (Excel/PDF) en segundo plano y ficheros generados
+    EXPORT_JOB_WORKERS = int(os.environ.get('EXPORT_JOB_WORKERS', 2))
+    EXPORT_JOB_WAIT_SECONDS = int(os.environ.get('EXPORT_JOB_WAIT_SECONDS', 120))
+    EXPORT_ARTIFACT_DIR = os.environ.get('EXPORT_ARTIFACT_DIR')  # Por defecto en el directorio temporal
+    EXPORT_ARTIFACT_TTL_SECONDS = int(os.environ.get('EXPORT_ARTIFACT_TTL_SECONDS', 3600))
+    EXPORT_ARTIFACT_MAX_FILES = int(os.environ.get('EXPORT_ARTIFACT_MAX_FILES', 200))
+    
+    # Gráficas de los informes PDF (por usuario y versión de datos)
+    PDF_CHART_CACHE_MAX_ENTRIES = int(os.environ.get('PDF_CHART_CACHE_MAX_ENTRIES', 200))
+    PDF_CHART_CACHE_TTL_SECONDS = int(os.environ.get('PDF_CHART_CACHE_TTL_SECONDS', 600))
+    
+    # Motor del informe PDF por defecto ('reportlab' o 'weasyprint') y pool de WeasyPrint
+    PDF_ENGINE = os.environ.get('PDF_ENGINE', 'reportlab')
+    PDF_WEASYPRINT_WORKERS = int(os.environ.get('PDF_WEASYPRINT_WORKERS', 2))
+    PDF_WEASYPRINT_TIMEOUT_SECONDS = int(os.environ.get('PDF_WEASYPRINT_TIMEOUT_SECONDS', 60))
+    
+    # Paquete ZIP de exportación (/analytics/export/bundle): procesos y tiempo máximo
+    EXPORT_BUNDLE_WORKERS = int(os.environ.get('EXPORT_BUNDLE_WORKERS', 4))
+    EXPORT_BUNDLE_TIMEOUT_SECONDS = int(os.environ.get('EXPORT_BUNDLE_TIMEOUT_SECONDS', 300))
+    
+    # UIDs de administradores (separados por comas): acceso a /api/cache/stats fuera de debug
+    ADMIN_UIDS = [uid.strip() for uid in os.environ.get('ADMIN_UIDS', '').split(',') if uid.strip()]
+    
+    # Tokens de Firebase ya verificados (por hash, hasta su 'exp'; 0 entradas desactiva la caché)
+    AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_TOKEN_CACHE_MAX_ENTRIES', 5000))
+    # Cada cuánto volver a comprobar en Firebase si un token en caché se ha revocado (0 = nunca)
+    AUTH_TOKEN_REVOCATION_CHECK_SECONDS = int(os.environ.get('AUTH_TOKEN_REVOCATION_CHECK_SECONDS', 0))
+    
     # JWT para autenticación
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or SECRET_KEY
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
@@ -106,6 +150,7 @@ class TestingConfig(Config):
     """Configuración para testing"""
     TESTING = True
     DEBUG = True
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'memory')
 
 # Diccionario de configuraciones disponibles
 config = {
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Backfill de los rollups de producción usuarios/{uid}/rollups/{año}_{cultivo}
+
+Calcula los buckets por día, semana, mes y temporada a partir de los
+cultivos y registros de producción existentes. Sirve para crearlos de
+antemano a los usuarios con datos anteriores a los rollups (si no, sus
+lecturas agrupan todos los registros hasta que termina la regeneración que
+encola su primera visita a analytics), repararlos o recalcularlos tras cambiar
+ROLLUP_TIMEZONE.
+
+Uso:
+    python scripts/backfill_rollups.py [--usuario UID] [--desde UID] [--zona Europe/Madrid]
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.services.rollup_service import RollupService
+from migrate_producciones import iter_user_ids
+
+def main():
+    parser = argparse.ArgumentParser(description='Calcular los rollups de producción de los usuarios')
+    parser.add_argument('--usuario', help='Calcular únicamente este UID')
+    parser.add_argument('--desde', help='Reanudar a partir del UID indicado (excluido)')
+    parser.add_argument('--zona', help='Zona horaria IANA (por defecto ROLLUP_TIMEZONE)')
+    args = parser.parse_args()
+
+    app, db = create_app()
+    app.db = db
+    if not db:
+        print("❌ No hay conexión a Firestore, no se pueden calcular los rollups")
+        return 1
+
+    with app.app_context():
+        rollup_service = RollupService(db, args.zona)
+        total = 0
+        for user_uid in iter_user_ids(db, args.usuario, args.desde):
+            rollup_service.rebuild_rollups(user_uid)
+            total += 1
+            print(f"   ✅ Completado (reanudar con --desde {user_uid})")
+
+    print(f"🏁 Rollups calculados: {total} usuarios")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark del motor de analytics por columnas frente al recorrido por diccionarios
+
+Genera un historial sintético (sin agregados guardados, como los cultivos de
+sesión o anteriores a la migración) y mide, para cada tamaño, el cálculo que
+hacían las vistas de analytics registro a registro (totales por cultivo, peso
+por unidad, meses, semanas y ranking) frente a AnalyticsEngine. No necesita
+Firestore:
+
+    python scripts/bench_analytics.py [--registros 10000 100000] [--cultivos 20] [--repeticiones 5]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.analytics_service import AnalyticsEngine
+
+def generar_cultivos(num_registros, num_cultivos, semilla=42):
+    """Cultivos con produccion_diaria repartida en los últimos tres años"""
+    aleatorio = random.Random(semilla)
+    inicio = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+    cultivos = [{
+        'id': f'bench-{i}',
+        'nombre': f'cultivo {i}',
+        'precio_por_kilo': round(aleatorio.uniform(1, 6), 2),
+        'produccion_diaria': []
+    } for i in range(num_cultivos)]
+    for _ in range(num_registros):
+        cultivo = cultivos[aleatorio.randrange(num_cultivos)]
+        unidades = aleatorio.randint(0, 12)
+        cultivo['produccion_diaria'].append({
+            'fecha': inicio + datetime.timedelta(minutes=aleatorio.randrange(3 * 365 * 24 * 60)),
+            'kilos': round(unidades * aleatorio.uniform(0.05, 0.4), 3),
+            'unidades': unidades
+        })
+    return cultivos
+
+def por_diccionarios(cultivos):
+    """Cálculo anterior: un bucle Python por registro y por vista"""
+    totales = {}
+    for cultivo in cultivos:
+        kilos = 0
+        unidades = 0
+        for produccion in cultivo.get('produccion_diaria', []):
+            kilos += produccion.get('kilos', 0) or 0
+            unidades += produccion.get('unidades', 0) or 0
+        totales[cultivo['id']] = {
+            'kilos': kilos,
+            'peso_por_unidad': (kilos / unidades) if unidades > 0 else 0,
+            'beneficio': kilos * cultivo['precio_por_kilo']
+        }
+    pesos = [p.get('kilos', 0) / p.get('unidades', 1) if p.get('unidades', 0) > 0 else 0
+             for cultivo in cultivos for p in cultivo.get('produccion_diaria', [])]
+    meses = {}
+    semanas = {}
+    for cultivo in cultivos:
+        for produccion in cultivo.get('produccion_diaria', []):
+            fecha = produccion['fecha']
+            lunes = (fecha - datetime.timedelta(days=fecha.weekday())).strftime('%Y-%m-%d')
+            for buckets, clave in ((meses, f"{fecha.year}-{fecha.month:02d}"), (semanas, lunes)):
+                bucket = buckets.setdefault(clave, {'kilos': 0, 'beneficio': 0})
+                bucket['kilos'] += produccion['kilos']
+                bucket['beneficio'] += produccion['kilos'] * cultivo['precio_por_kilo']
+    ranking = sorted(cultivos, key=lambda c: totales[c['id']]['beneficio'], reverse=True)
+    return totales, pesos, meses, semanas, ranking
+
+def por_columnas(cultivos):
+    """Cálculo con AnalyticsEngine: una pasada y operaciones vectorizadas"""
+    motor = AnalyticsEngine(cultivos)
+    totales = {cultivo['id']: motor.crop_metrics(i) for i, cultivo in enumerate(cultivos)}
+    return totales, motor.peso_unitario(), motor.monthly(), motor.weekly(), motor.ranking()
+
+def comprobar(cultivos):
+    """Verificar que los dos cálculos dan el mismo resultado"""
+    totales, pesos, meses, semanas, ranking = por_diccionarios(cultivos)
+    totales_c, pesos_c, meses_c, semanas_c, ranking_c = por_columnas(cultivos)
+    cerca = lambda a, b: abs(a - b) <= 1e-6 * max(1.0, abs(a))
+    assert all(cerca(totales[k]['kilos'], totales_c[k]['total_kilos']) for k in totales)
+    assert all(cerca(a, b) for a, b in zip(pesos, pesos_c))
+    for buckets, buckets_c in ((meses, meses_c), (semanas, semanas_c)):
+        assert sorted(buckets) == list(buckets_c)
+        assert all(cerca(buckets[k]['beneficio'], buckets_c[k]['beneficio']) for k in buckets)
+    assert [c['id'] for c in ranking] == [c['id'] for c in ranking_c]
+
+def medir(funcion, cultivos, repeticiones):
+    """Mejor tiempo (ms) de varias ejecuciones"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(cultivos)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return min(tiempos)
+
+def main():
+    parser = argparse.ArgumentParser(description='Analytics por columnas frente a diccionarios')
+    parser.add_argument('--registros', type=int, nargs='+', default=[10000, 100000], help='Tamaños del historial')
+    parser.add_argument('--cultivos', type=int, default=20, help='Cultivos entre los que se reparten los registros')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Ejecuciones por medida (se toma la mejor)')
+    args = parser.parse_args()
+
+    print(f"{'registros':>10} {'diccionarios':>14} {'columnas':>10} {'mejora':>8}")
+    for num_registros in args.registros:
+        cultivos = generar_cultivos(num_registros, args.cultivos)
+        comprobar(cultivos)
+        ms_dicts = medir(por_diccionarios, cultivos, args.repeticiones)
+        ms_columnas = medir(por_columnas, cultivos, args.repeticiones)
+        print(f"{num_registros:>10} {ms_dicts:>11.1f} ms {ms_columnas:>7.1f} ms {ms_dicts / ms_columnas:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
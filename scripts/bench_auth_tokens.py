@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark del coste de autenticación por petición: token de Firebase verificado siempre frente a en caché
+
+Firma tokens RS256 con una clave RSA generada al arrancar y sustituye, sólo
+en este proceso, la verificación de firebase_admin por la misma verificación
+de firma RSA con esa clave (sin descargar certificados, que en producción
+añade red a los fallos). Mide el tiempo por llamada a
+AuthService.verify_firebase_token sin caché, con la caché acertando, y un
+tráfico mixto de varios usuarios (cada token se usa en varias peticiones)
+con su ratio de aciertos. No necesita Firebase:
+
+    python scripts/bench_auth_tokens.py [--llamadas 2000] [--usuarios 200] [--peticiones 20]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def generar_claves():
+    """Par de claves RSA de 2048 bits, como las de los tokens de Firebase"""
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    privada = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return privada, privada.public_key()
+
+def generar_token(privada, uid):
+    """Token ID con las claims de Firebase que usa AuthService, válido una hora"""
+    import jwt
+
+    ahora = int(time.time())
+    return jwt.encode({
+        'iss': 'https://securetoken.google.com/huerto-bench',
+        'aud': 'huerto-bench',
+        'sub': uid,
+        'uid': uid,
+        'email': f'{uid}@huerto.com',
+        'email_verified': True,
+        'iat': ahora,
+        'exp': ahora + 3600
+    }, privada, algorithm='RS256')
+
+def verificador(publica):
+    """Sustituto de firebase_auth.verify_id_token: misma verificación de firma, sin red"""
+    import jwt
+
+    def verify_id_token(id_token, app=None, check_revoked=False):
+        return jwt.decode(id_token, publica, algorithms=['RS256'], audience='huerto-bench')
+    return verify_id_token
+
+def por_llamada(tokens):
+    """Microsegundos por llamada (mediana de 5 tandas) recorriendo la lista de tokens"""
+    from app.auth.auth_service import AuthService
+
+    tandas = []
+    for _ in range(5):
+        inicio = time.perf_counter()
+        for token in tokens:
+            AuthService.verify_firebase_token(token)
+        tandas.append((time.perf_counter() - inicio) / len(tokens))
+    return statistics.median(tandas) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Coste de verificar el token de Firebase por petición')
+    parser.add_argument('--llamadas', type=int, default=2000, help='Llamadas por tanda')
+    parser.add_argument('--usuarios', type=int, default=200, help='Usuarios distintos del tráfico mixto')
+    parser.add_argument('--peticiones', type=int, default=20, help='Peticiones por token en el tráfico mixto')
+    args = parser.parse_args()
+
+    from flask import Flask
+    from firebase_admin import auth as firebase_auth
+    from app.auth import auth_service
+
+    privada, publica = generar_claves()
+    firebase_auth.verify_id_token = verificador(publica)
+    token = generar_token(privada, 'bench-0')
+
+    sin_cache = Flask(__name__)
+    sin_cache.config['AUTH_TOKEN_CACHE_MAX_ENTRIES'] = 0
+    with sin_cache.app_context():
+        frio = por_llamada([token] * args.llamadas)
+
+    con_cache = Flask(__name__)
+    with con_cache.app_context():
+        auth_service._token_cache = None
+        auth_service.AuthService.verify_firebase_token(token)
+        caliente = por_llamada([token] * args.llamadas)
+
+        # Tráfico mixto: cada usuario repite su token en varias peticiones, intercaladas
+        auth_service._token_cache = None
+        tokens = [generar_token(privada, f'bench-{i}') for i in range(args.usuarios)]
+        trafico = tokens * args.peticiones
+        random.Random(0).shuffle(trafico)
+        inicio = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for t in trafico:
+                auth_service.AuthService.verify_firebase_token(t)
+        mixto = (time.perf_counter() - inicio) / len(trafico) * 1e6
+        stats = auth_service.AuthService.get_token_cache_stats()
+
+    print(f"{'caso':>24} {'por petición':>14} {'mejora':>8}")
+    print(f"{'sin caché (firma RSA)':>24} {frio:>11.1f} µs {1:>7.1f}x")
+    print(f"{'caché (acierto)':>24} {caliente:>11.1f} µs {frio / caliente:>7.1f}x")
+    print(f"{'mixto':>24} {mixto:>11.1f} µs {frio / mixto:>7.1f}x")
+    print(f"mixto: {args.usuarios} usuarios x {args.peticiones} peticiones, ratio de aciertos "
+          f"{stats['hit_rate']:.2%} ({stats['hits']} aciertos, {stats['misses']} fallos)")
+    print("sin caché no incluye la descarga de certificados de Google que hace firebase_admin al caducar los suyos")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la exportación a Excel: libro en memoria frente a modo sólo escritura
+
+Compara, para varios tamaños de historial, el pico de memoria (RSS) y el
+tiempo de la exportación anterior (Workbook normal con todo el historial
+cargado, anchos recorriendo todas las celdas y guardado en BytesIO) con
+write_excel (modo sólo escritura, registros leídos de un iterador y
+guardado en un SpooledTemporaryFile). Cada medida se hace en un proceso
+nuevo para que el pico de RSS de una no afecte a la siguiente. No necesita
+Firestore:
+
+    python scripts/bench_excel_export.py [--registros 10000 50000 100000] [--cultivos 20]
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INICIO = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+def generar_registros(indice, cantidad):
+    """Registros de un cultivo en orden de fecha, generados bajo demanda"""
+    aleatorio = random.Random(indice)
+    paso = max(1, (3 * 365 * 24 * 60) // max(cantidad, 1))
+    for i in range(cantidad):
+        unidades = aleatorio.randint(0, 12)
+        yield {
+            'fecha': INICIO + datetime.timedelta(minutes=i * paso),
+            'kilos': round(unidades * aleatorio.uniform(0.05, 0.4), 3),
+            'unidades': unidades
+        }
+
+def cabeceras(num_registros, num_cultivos):
+    """Cultivos sin historial y cuántos registros tiene cada uno"""
+    cultivos = [{
+        'id': f'bench-{i}',
+        'nombre': f'cultivo {i}',
+        'precio_por_kilo': 1 + (i % 5),
+        'fecha_siembra': INICIO,
+        'abonos': [{'fecha': INICIO, 'descripcion': 'compost'}]
+    } for i in range(num_cultivos)]
+    cantidades = [num_registros // num_cultivos + (1 if i < num_registros % num_cultivos else 0) for i in range(num_cultivos)]
+    return cultivos, cantidades
+
+def exportar_en_memoria(num_registros, num_cultivos):
+    """Exportación anterior: historial completo en memoria y libro normal"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+    from app.services.crop_service import CropService
+
+    cultivos, cantidades = cabeceras(num_registros, num_cultivos)
+    for indice, (cultivo, cantidad) in enumerate(zip(cultivos, cantidades)):
+        cultivo['produccion_diaria'] = list(generar_registros(indice, cantidad))
+    snapshot = CropService(None).build_snapshot(cultivos)
+
+    wb = Workbook()
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="198754", end_color="198754", fill_type="solid")
+    ws1 = wb.active
+    ws1.title = "Resumen General"
+    ws1['A1'] = "🌱 HuertoRentable - Análisis Completo"
+    ws1.merge_cells('A1:D1')
+    ws1['A4'] = "Total Cultivos:"
+    ws1['B4'] = len(cultivos)
+
+    def ajustar(ws, maximo):
+        # El original usaba col[0].column_letter, que falla con celdas combinadas
+        for col in ws.columns:
+            max_length = max(len(str(cell.value)) for cell in col)
+            ws.column_dimensions[get_column_letter(col[0].column)].width = min(max_length + 2, maximo)
+
+    ws2 = wb.create_sheet(title="Detalle Cultivos Completo")
+    for col, header in enumerate(['Cultivo', 'Total Unidades', 'Total Kilos', 'Peso/Unidad (kg)', 'Beneficio Total (€)'], 1):
+        cell = ws2.cell(row=1, column=col, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal='center')
+    for row, cultivo in enumerate(cultivos, 2):
+        metricas = snapshot['metricas'][cultivo['id']]
+        ws2.cell(row=row, column=1, value=cultivo['nombre'])
+        ws2.cell(row=row, column=2, value=metricas['total_unidades'])
+        ws2.cell(row=row, column=3, value=metricas['total_kilos'])
+        ws2.cell(row=row, column=4, value=metricas['peso_por_unidad'])
+        ws2.cell(row=row, column=5, value=metricas['beneficio'])
+    ajustar(ws2, 20)
+
+    ws3 = wb.create_sheet(title="Producción Diaria")
+    ws3['A1'] = "Producción Detallada por Día"
+    ws3.merge_cells('A1:E1')
+    motor = snapshot['analitica']
+    pesos_unitarios = motor.peso_unitario().tolist()
+    row = 3
+    for indice, cultivo in enumerate(cultivos):
+        for produccion, peso_unitario in zip(cultivo['produccion_diaria'], pesos_unitarios[motor.registros_de(indice)]):
+            ws3.cell(row=row, column=1, value=cultivo['nombre'])
+            ws3.cell(row=row, column=2, value=produccion['fecha'].strftime('%Y-%m-%d'))
+            ws3.cell(row=row, column=3, value=produccion['kilos'])
+            ws3.cell(row=row, column=4, value=produccion['unidades'])
+            ws3.cell(row=row, column=5, value=peso_unitario)
+            row += 1
+    ajustar(ws3, 20)
+
+    output = io.BytesIO()
+    wb.save(output)
+    return len(output.getvalue())
+
+def exportar_solo_escritura(num_registros, num_cultivos):
+    """Exportación nueva: agregados en la instantánea y registros desde un iterador"""
+    from app.services.crop_service import CropService
+    from app.services.export_service import EXCEL_SPOOL_BYTES, write_excel
+
+    cultivos, cantidades = cabeceras(num_registros, num_cultivos)
+    for indice, (cultivo, cantidad) in enumerate(zip(cultivos, cantidades)):
+        # Agregados como los guarda CropService en cada cultivo
+        kilos = unidades = 0
+        for registro in generar_registros(indice, cantidad):
+            kilos += registro['kilos']
+            unidades += registro['unidades']
+        cultivo.update(kilos_totales=kilos, unidades_totales=unidades, num_registros=cantidad)
+    snapshot = CropService(None).build_snapshot(cultivos)
+    por_id = {cultivo['id']: (indice, cantidad) for indice, (cultivo, cantidad) in enumerate(zip(cultivos, cantidades))}
+
+    with tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_BYTES) as archivo:
+        write_excel(archivo, snapshot, lambda cultivo: generar_registros(*por_id[cultivo['id']]))
+        archivo.seek(0, os.SEEK_END)
+        return archivo.tell()
+
+IMPLEMENTACIONES = {'memoria': exportar_en_memoria, 'escritura': exportar_solo_escritura}
+
+def trabajador(implementacion, num_registros, num_cultivos):
+    """Medir una exportación en este proceso e imprimir el resultado en JSON"""
+    # Importar antes de medir la memoria base
+    import openpyxl
+    from app.services import crop_service, export_service
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    inicio = time.perf_counter()
+    tamano = IMPLEMENTACIONES[implementacion](num_registros, num_cultivos)
+    segundos = time.perf_counter() - inicio
+    pico_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'segundos': segundos, 'base_mb': base_kb / 1024, 'pico_mb': pico_kb / 1024, 'bytes': tamano}))
+
+def medir(implementacion, num_registros, num_cultivos):
+    """Lanzar el trabajador en un proceso nuevo"""
+    salida = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--trabajador', implementacion,
+         '--registros', str(num_registros), '--cultivos', str(num_cultivos)],
+        check=True, capture_output=True, text=True
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Exportación a Excel en memoria frente a modo sólo escritura')
+    parser.add_argument('--registros', type=int, nargs='+', default=[10000, 50000, 100000], help='Tamaños del historial')
+    parser.add_argument('--cultivos', type=int, default=20, help='Cultivos entre los que se reparten los registros')
+    parser.add_argument('--trabajador', choices=list(IMPLEMENTACIONES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trabajador:
+        trabajador(args.trabajador, args.registros[0], args.cultivos)
+        return
+
+    print(f"{'registros':>10} {'memoria':>22} {'sólo escritura':>22} {'RSS':>7} {'tiempo':>7}")
+    for num_registros in args.registros:
+        antes = medir('memoria', num_registros, args.cultivos)
+        despues = medir('escritura', num_registros, args.cultivos)
+        rss_antes = antes['pico_mb'] - antes['base_mb']
+        rss_despues = despues['pico_mb'] - despues['base_mb']
+        print(f"{num_registros:>10} {rss_antes:>8.1f} MB {antes['segundos']:>8.2f} s "
+              f"{rss_despues:>8.1f} MB {despues['segundos']:>8.2f} s "
+              f"{rss_antes / max(rss_despues, 0.1):>6.1f}x {antes['segundos'] / despues['segundos']:>6.1f}x")
+    print("RSS: pico del proceso sobre el de después de importar openpyxl y los servicios")
+
+if __name__ == '__main__':
+    main()
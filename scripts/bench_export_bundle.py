@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark del paquete ZIP de exportación: formatos uno tras otro frente a en paralelo
+
+Con un historial sintético mide lo que tarda cada formato (CSV, JSON,
+Excel y PDF) generado en este proceso, uno detrás de otro, y lo que tarda
+el paquete con ExportService.iter_bundle (los formatos a la vez en el pool
+de procesos, ya arrancado). El paquete debería tardar como el formato más
+lento, no como la suma. No necesita Firestore:
+
+    python scripts/bench_export_bundle.py [--registros 20000 100000] [--cultivos 20] [--guardar paquete.zip]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_excel_export import cabeceras, generar_registros
+
+def generar_datos(num_registros, num_cultivos):
+    """Datos del paquete (como ExportService.bundle_data) con el historial en memoria"""
+    from app.services.crop_service import CropService
+    from app.services.export_service import json_summary, report_title
+    from app.services.pdf_service import build_charts
+
+    cultivos, cantidades = cabeceras(num_registros, num_cultivos)
+    for indice, (cultivo, cantidad) in enumerate(zip(cultivos, cantidades)):
+        cultivo['produccion_diaria'] = list(generar_registros(indice, cantidad))
+    with contextlib.redirect_stdout(io.StringIO()):
+        snapshot = CropService(None).build_snapshot(cultivos)
+    snapshot = {clave: valor for clave, valor in snapshot.items() if clave != 'analitica'}
+    periodos = [{'periodo': f'{2023 + mes // 12}-{mes % 12 + 1:02d}', 'kilos': 100 + mes, 'beneficio': 250 + mes}
+                for mes in range(24)]
+    return {
+        'snapshot': snapshot,
+        'registros': {c['id']: c['produccion_diaria'] for c in snapshot['cultivos']},
+        'resumen': json_summary(snapshot, None),
+        'titulo_usuario': report_title(None),
+        'graficas': build_charts(snapshot, periodos)
+    }
+
+def paquete(datos, formatos):
+    """Generar el paquete completo; devuelve los bytes del ZIP"""
+    from app.services.export_service import ExportService
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return b''.join(ExportService(None).iter_bundle(datos, formatos))
+
+def main():
+    parser = argparse.ArgumentParser(description='Paquete ZIP de exportación: secuencial frente a paralelo')
+    parser.add_argument('--registros', type=int, nargs='+', default=[20000, 100000], help='Tamaños del historial')
+    parser.add_argument('--cultivos', type=int, default=20, help='Cultivos entre los que se reparten los registros')
+    parser.add_argument('--guardar', help='Guardar el último paquete en esta ruta')
+    args = parser.parse_args()
+
+    from app.services.export_service import BUNDLE_FORMATS, get_bundle_pool, write_bundle_part
+
+    formatos = list(BUNDLE_FORMATS)
+    pool = get_bundle_pool()
+    inicio = time.perf_counter()
+    paquete(generar_datos(100, 2), formatos)
+    print(f"Arranque del pool de paquetes ({pool._max_workers} procesos): {time.perf_counter() - inicio:.2f} s")
+
+    print(f"{'registros':>10} " + ' '.join(f'{f:>8}' for f in formatos) + f" {'suma':>8} {'paquete':>8} {'mejora':>7} {'ZIP':>9}")
+    for num_registros in args.registros:
+        datos = generar_datos(num_registros, args.cultivos)
+        tiempos = []
+        with tempfile.TemporaryDirectory() as directorio:
+            for formato in formatos:
+                inicio = time.perf_counter()
+                write_bundle_part(formato, os.path.join(directorio, BUNDLE_FORMATS[formato]['fichero']), datos)
+                tiempos.append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        contenido = paquete(datos, formatos)
+        total = time.perf_counter() - inicio
+        with zipfile.ZipFile(io.BytesIO(contenido)) as zf:
+            assert zf.testzip() is None and len(zf.namelist()) == len(formatos), zf.namelist()
+        print(f"{num_registros:>10} " + ' '.join(f'{t:>7.2f}s' for t in tiempos) +
+              f" {sum(tiempos):>7.2f}s {total:>7.2f}s {sum(tiempos) / total:>6.1f}x {len(contenido) / 1024:>7.0f}KB")
+        if args.guardar:
+            with open(args.guardar, 'wb') as salida:
+                salida.write(contenido)
+    print("paquete: incluye enviar los datos a los procesos y montar el ZIP; el pool ya está arrancado")
+    pool.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los motores del informe PDF: reportlab frente a WeasyPrint
+
+Para varios números de cultivos mide, con cada motor en su propio proceso
+ya calentado, la latencia mediana de un informe, el tiempo de CPU por
+informe y el pico de memoria (RSS) del proceso que maqueta. reportlab se
+mide como corre en el servidor (en el proceso, con estilos y gráficas ya
+construidos); WeasyPrint como el pool (HTML generado en este proceso y
+maquetado en un proceso con fuentes y CSS cargados). También muestra lo que
+tarda en arrancar un proceso de WeasyPrint. No necesita Firestore:
+
+    python scripts/bench_pdf_engines.py [--cultivos 10 50 200 1000] [--repeticiones 5]
+"""
+import argparse
+import datetime
+import io
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pdf_export import generar_snapshot
+
+FECHA = datetime.datetime(2024, 1, 1)
+
+def medir_reportlab(num_cultivos, repeticiones):
+    """En un proceso nuevo: latencias, CPU por informe, pico de RSS (KB) y tamaño"""
+    from app.services import pdf_service
+
+    snapshot, periodos = generar_snapshot(num_cultivos)
+    graficas = pdf_service.build_charts(snapshot, periodos)
+    pdf_service.write_pdf(io.BytesIO(), snapshot, 'Benchmark', FECHA, graficas=graficas)
+    tiempos = []
+    cpu = time.process_time()
+    for _ in range(repeticiones):
+        destino = io.BytesIO()
+        inicio = time.perf_counter()
+        pdf_service.write_pdf(destino, snapshot, 'Benchmark', FECHA, graficas=graficas)
+        tiempos.append(time.perf_counter() - inicio)
+    cpu = (time.process_time() - cpu) / repeticiones
+    return tiempos, cpu, pdf_service._worker_usage()[2], len(destino.getvalue())
+
+def medir_weasyprint(pool, aplicacion, num_cultivos, repeticiones):
+    """Latencias (HTML incluido), CPU por informe (los dos procesos), pico de RSS (KB) y tamaño"""
+    from app.services import pdf_service
+
+    snapshot, periodos = generar_snapshot(num_cultivos)
+    graficas = pdf_service.build_charts(snapshot, periodos)
+    with aplicacion.app_context():
+        pool.render(pdf_service.render_report_html(snapshot, 'Benchmark', FECHA, graficas))
+        _, cpu_trabajador, _ = pool.submit(pdf_service._worker_usage)
+        cpu_local = time.process_time()
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            contenido = pool.render(pdf_service.render_report_html(snapshot, 'Benchmark', FECHA, graficas))
+            tiempos.append(time.perf_counter() - inicio)
+        cpu_local = time.process_time() - cpu_local
+    _, cpu_final, pico_kb = pool.submit(pdf_service._worker_usage)
+    return tiempos, (cpu_final - cpu_trabajador + cpu_local) / repeticiones, pico_kb, len(contenido)
+
+def fila(num_cultivos, motor, resultado):
+    tiempos, cpu, pico_kb, tamano = resultado
+    print(f"{num_cultivos:>9} {motor:>11} {statistics.median(tiempos) * 1000:>9.1f} ms {cpu * 1000:>8.1f} ms "
+          f"{pico_kb / 1024:>7.1f} MB {tamano / 1024:>8.1f} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description='Informe PDF con reportlab frente a WeasyPrint')
+    parser.add_argument('--cultivos', type=int, nargs='+', default=[10, 50, 200, 1000], help='Números de cultivos')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Informes por medida')
+    args = parser.parse_args()
+
+    from flask import Flask
+    from app.services import pdf_service
+
+    hay_weasyprint = pdf_service.weasyprint_available()
+    pool = None
+    if hay_weasyprint:
+        raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        aplicacion = Flask(__name__, template_folder=os.path.join(raiz, 'templates'))
+        pool = pdf_service.WeasyPrintPool(max_workers=1, timeout=600)
+        inicio = time.perf_counter()
+        pool.submit(os.getpid)
+        print(f"Arranque de un proceso de WeasyPrint (fuentes y CSS): {time.perf_counter() - inicio:.2f} s")
+    else:
+        print("WeasyPrint no está instalado: sólo se mide reportlab")
+
+    contexto = multiprocessing.get_context('spawn')
+    print(f"{'cultivos':>9} {'motor':>11} {'latencia':>12} {'CPU':>11} {'RSS':>10} {'tamaño':>11}")
+    try:
+        for num_cultivos in args.cultivos:
+            # Un proceso nuevo por medida para que el pico de RSS sea el de ese tamaño
+            with ProcessPoolExecutor(1, mp_context=contexto) as proceso:
+                fila(num_cultivos, 'reportlab', proceso.submit(medir_reportlab, num_cultivos, args.repeticiones).result())
+            if pool:
+                fila(num_cultivos, 'weasyprint', medir_weasyprint(pool, aplicacion, num_cultivos, args.repeticiones))
+    finally:
+        if pool:
+            pool.shutdown()
+    print("RSS: pico del proceso que maqueta (el de WeasyPrint se reutiliza entre tamaños, como en el pool)")
+
+if __name__ == '__main__':
+    main()
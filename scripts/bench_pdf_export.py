@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark del informe PDF según el número de cultivos
+
+Mide, para varios números de cultivos, el tiempo de write_pdf en tres casos:
+'en frío' (estilos y gráficas construidos en la llamada, como la primera
+exportación de una versión de datos), 'caliente' (estilos del proceso y
+gráficas de la caché, como las siguientes) y 'sin gráficas' (el informe
+anterior, sólo tablas). Cada caso se repite y se toma la mediana. No
+necesita Firestore:
+
+    python scripts/bench_pdf_export.py [--cultivos 10 50 200 1000] [--repeticiones 5]
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INICIO = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+def generar_snapshot(num_cultivos):
+    """Instantánea con agregados guardados (sin historial) y su serie mensual"""
+    from app.services.crop_service import CropService
+
+    aleatorio = random.Random(num_cultivos)
+    cultivos = [{
+        'id': f'bench-{i}',
+        'nombre': f'cultivo {i}',
+        'precio_por_kilo': 1 + (i % 5),
+        'fecha_siembra': INICIO + datetime.timedelta(days=i % 365),
+        'plantas_sembradas': aleatorio.randint(1, 40),
+        'activo': i % 3 != 0,
+        'kilos_totales': round(aleatorio.uniform(1, 300), 2),
+        'unidades_totales': aleatorio.randint(10, 2000),
+        'num_registros': aleatorio.randint(10, 500)
+    } for i in range(num_cultivos)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        snapshot = CropService(None).build_snapshot(cultivos)
+    periodos = [{
+        'periodo': f'{2023 + mes // 12}-{mes % 12 + 1:02d}',
+        'kilos': aleatorio.uniform(10, 500),
+        'beneficio': aleatorio.uniform(20, 1500)
+    } for mes in range(24)]
+    return snapshot, periodos
+
+def medir(funcion, repeticiones):
+    """Mediana en segundos de varias ejecuciones y tamaño del último PDF"""
+    tiempos = []
+    for _ in range(repeticiones):
+        destino = io.BytesIO()
+        inicio = time.perf_counter()
+        funcion(destino)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos), len(destino.getvalue())
+
+def main():
+    parser = argparse.ArgumentParser(description='Tiempo del informe PDF según el número de cultivos')
+    parser.add_argument('--cultivos', type=int, nargs='+', default=[10, 50, 200, 1000], help='Números de cultivos')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Ejecuciones por medida')
+    args = parser.parse_args()
+
+    from app.services import pdf_service
+
+    fecha = datetime.datetime(2024, 1, 1)
+    print(f"{'cultivos':>9} {'sin gráficas':>13} {'en frío':>9} {'caliente':>9} {'frío/cal.':>9} {'páginas':>8}")
+    for num_cultivos in args.cultivos:
+        snapshot, periodos = generar_snapshot(num_cultivos)
+        graficas = pdf_service.build_charts(snapshot, periodos)
+
+        def sin_graficas(destino):
+            pdf_service._styles = None
+            pdf_service.write_pdf(destino, snapshot, 'Benchmark', fecha)
+
+        def en_frio(destino):
+            pdf_service._styles = None
+            pdf_service.write_pdf(destino, snapshot, 'Benchmark', fecha,
+                                  graficas=pdf_service.build_charts(snapshot, periodos))
+
+        def caliente(destino):
+            pdf_service.write_pdf(destino, snapshot, 'Benchmark', fecha, graficas=graficas)
+
+        antes, _ = medir(sin_graficas, args.repeticiones)
+        frio, _ = medir(en_frio, args.repeticiones)
+        pdf_service.get_pdf_styles()
+        cal, tamano = medir(caliente, args.repeticiones)
+        destino = io.BytesIO()
+        caliente(destino)
+        paginas = destino.getvalue().count(b'/Type /Page\n')
+        print(f"{num_cultivos:>9} {antes * 1000:>10.1f} ms {frio * 1000:>6.1f} ms {cal * 1000:>6.1f} ms "
+              f"{frio / cal:>8.2f}x {paginas:>8}")
+    print("en frío: estilos y gráficas construidos en la llamada; caliente: estilos del proceso y gráficas en caché")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark de escrituras de producción: RPCs a Firestore por llamada
+
+Cuenta las llamadas a la API de Firestore (lecturas, consultas, transacciones
+y commits) que hace cada operación de CropService sobre un cultivo temporal,
+que se borra al terminar. La primera producción en kilos de un cultivo en el
+proceso lee num_registros en una transacción; las siguientes se escriben a
+ciegas, en un solo commit. Conviene lanzarlo contra el emulador:
+
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python scripts/bench_production_writes.py [--repeticiones N]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.services.crop_service import CropService, get_aggregated_crops
+
+# Métodos de la API de Firestore que suponen un round trip al servidor
+RPC_METHODS = [
+    'batch_get_documents', 'get_document', 'run_query', 'run_aggregation_query',
+    'list_documents', 'begin_transaction', 'commit', 'rollback', 'batch_write'
+]
+
+def instrument(db, contador):
+    """Envolver el cliente de la API de Firestore para contar sus llamadas"""
+    api = getattr(db, '_firestore_api', None)
+    if api is None:
+        # Backends memory/sqlite: no hay RPCs, sólo se miden tiempos
+        print(f"⚠️ {type(db).__name__} no usa la API de Firestore: sólo se miden tiempos")
+        return
+    for nombre in RPC_METHODS:
+        original = getattr(api, nombre, None)
+        if original is None:
+            continue
+        def contar(*args, _nombre=nombre, _original=original, **kwargs):
+            contador[_nombre] += 1
+            return _original(*args, **kwargs)
+        setattr(api, nombre, contar)
+
+def medir(nombre, operacion, repeticiones, contador):
+    """Ejecutar una operación varias veces y devolver RPCs y milisegundos por llamada"""
+    contador.clear()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        operacion()
+    ms = (time.perf_counter() - inicio) * 1000 / repeticiones
+    detalle = ', '.join(f"{k}={v / repeticiones:g}" for k, v in sorted(contador.items()))
+    print(f"{nombre:<22} {sum(contador.values()) / repeticiones:>6.2f} RPC/llamada {ms:>9.1f} ms   ({detalle})")
+
+def main():
+    parser = argparse.ArgumentParser(description='RPCs a Firestore por escritura de producción')
+    parser.add_argument('--repeticiones', type=int, default=20, help='Llamadas por operación')
+    args = parser.parse_args()
+
+    app, db = create_app()
+    app.db = db
+    if not db:
+        print("❌ No hay conexión a Firestore (usa FIRESTORE_EMULATOR_HOST para el emulador)")
+        return 1
+
+    user_uid = f"bench_{int(time.time())}"
+    user_ref = db.collection('usuarios').document(user_uid)
+    crop_ref = user_ref.collection('cultivos').document('bench')
+    user_ref.set({'uid': user_uid, 'plan': 'gratuito', 'fecha_registro': datetime.datetime.utcnow()})
+    crop_ref.set({
+        'nombre': 'benchmark', 'precio_por_kilo': 2.5, 'peso_promedio_gramos': 150,
+        'activo': True, 'abonos': [], 'fecha_siembra': datetime.datetime.utcnow(),
+        'kilos_totales': 0, 'unidades_totales': 0, 'num_registros': 0,
+        'primer_registro': None, 'ultimo_registro': None
+    })
+
+    contador = Counter()
+    instrument(db, contador)
+    try:
+        with app.app_context():
+            crop_service = CropService(db)
+            n = args.repeticiones
+            print(f"👤 Usuario temporal {user_uid}, {n} llamadas por operación\n")
+            get_aggregated_crops().clear()
+            medir('kilos (primera)', lambda: crop_service.update_production_generic(user_uid, 'bench', kilos=1.25), 1, contador)
+            medir('kilos', lambda: crop_service.update_production_generic(user_uid, 'bench', kilos=1.25), n, contador)
+            medir('unidades', lambda: crop_service.update_production_generic(user_uid, 'bench', unidades=4), n, contador)
+            medir('kilos + unidades', lambda: crop_service.update_production_generic(user_uid, 'bench', kilos=0.8, unidades=3), n, contador)
+            medir('deshacer', lambda: crop_service.undo_last_production(user_uid, 'bench'), n, contador)
+    finally:
+        # Limpiar los datos temporales
+        for doc in crop_ref.collection('producciones').list_documents():
+            doc.delete()
+        crop_ref.delete()
+        user_ref.delete()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
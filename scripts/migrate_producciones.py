@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Migración de produccion_diaria a la subcolección cultivos/{id}/producciones
+
+Recorre los usuarios y sus cultivos y mueve cada registro del array heredado
+a un documento propio. Es reanudable: los IDs de los documentos migrados son
+deterministas y el array sólo se borra al final de cada cultivo, así que se
+puede relanzar tras un fallo (o con --desde para saltar usuarios ya hechos).
+También calcula los agregados (kilos_totales, num_registros...) de los cultivos
+que todavía no los tienen.
+
+Uso:
+    python scripts/migrate_producciones.py [--dry-run] [--usuario UID] [--desde UID]
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.services.crop_service import CropService
+
+def iter_user_ids(db, usuario=None, desde=None):
+    """Devuelve los UIDs a migrar, en orden de ID de documento"""
+    if usuario:
+        yield usuario
+        return
+
+    query = db.collection('usuarios').order_by('__name__')
+    if desde:
+        query = query.start_after(db.collection('usuarios').document(desde).get())
+    for doc in query.select([]).stream():
+        yield doc.id
+
+def migrate_user(db, crop_service, user_uid, dry_run=False):
+    """Migrar todos los cultivos (activos o no) de un usuario"""
+    total = 0
+    crops_ref = db.collection('usuarios').document(user_uid).collection('cultivos')
+    for crop_doc in crops_ref.select(['producciones_migradas', 'num_registros']).stream():
+        datos = crop_doc.to_dict() or {}
+        migrados = 0
+        if not datos.get('producciones_migradas'):
+            migrados = crop_service.migrate_legacy_productions(user_uid, crop_doc.id, dry_run=dry_run)
+        if migrados > 0:
+            print(f"   🌱 {crop_doc.id}: {migrados} registros {'por migrar' if dry_run else 'migrados'}")
+            total += migrados
+        elif migrados == 0 and 'num_registros' not in datos and not dry_run:
+            # Cultivo sin array heredado pero anterior a los agregados
+            if crop_service.recompute_crop_aggregates(user_uid, crop_doc.id):
+                print(f"   📊 {crop_doc.id}: agregados recalculados")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrar produccion_diaria a la subcolección producciones')
+    parser.add_argument('--dry-run', action='store_true', help='Sólo contar registros, sin escribir')
+    parser.add_argument('--usuario', help='Migrar únicamente este UID')
+    parser.add_argument('--desde', help='Reanudar a partir del UID indicado (excluido)')
+    args = parser.parse_args()
+
+    app, db = create_app()
+    app.db = db
+    if not db:
+        print("❌ No hay conexión a Firestore, no se puede migrar")
+        return 1
+
+    with app.app_context():
+        crop_service = CropService(db)
+        total = 0
+        for user_uid in iter_user_ids(db, args.usuario, args.desde):
+            print(f"👤 Usuario {user_uid}")
+            total += migrate_user(db, crop_service, user_uid, dry_run=args.dry_run)
+            # Punto de reanudación por si se interrumpe la migración
+            print(f"   ✅ Completado (reanudar con --desde {user_uid})")
+
+    print(f"🏁 Registros {'por migrar' if args.dry_run else 'migrados'}: {total}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
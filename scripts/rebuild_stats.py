@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Reconstrucción del resumen de estadísticas usuarios/{uid}/stats/summary
+
+Regenera el documento a partir de los cultivos y registros de producción
+originales. Sirve para reparar un resumen descuadrado o para crearlo de
+antemano a los usuarios con datos anteriores al resumen (si no, se crea en
+su primera visita al dashboard).
+
+Uso:
+    python scripts/rebuild_stats.py [--usuario UID] [--desde UID]
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.services.stats_service import StatsService
+from migrate_producciones import iter_user_ids
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconstruir el resumen de estadísticas de los usuarios')
+    parser.add_argument('--usuario', help='Reconstruir únicamente este UID')
+    parser.add_argument('--desde', help='Reanudar a partir del UID indicado (excluido)')
+    args = parser.parse_args()
+
+    app, db = create_app()
+    app.db = db
+    if not db:
+        print("❌ No hay conexión a Firestore, no se puede reconstruir")
+        return 1
+
+    with app.app_context():
+        stats_service = StatsService(db)
+        total = 0
+        for user_uid in iter_user_ids(db, args.usuario, args.desde):
+            stats_service.rebuild_summary(user_uid)
+            total += 1
+            print(f"   ✅ Completado (reanudar con --desde {user_uid})")
+
+    print(f"🏁 Resúmenes reconstruidos: {total}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -64,6 +64,9 @@ function setupEventListeners() {
   window.addEventListener("beforeinstallprompt", handleInstallPrompt);
   window.addEventListener("appinstalled", handleAppInstalled);
 
+  // Exportaciones Excel/PDF como trabajos en segundo plano
+  document.addEventListener("click", handleExportClick);
+
   // Eventos globales de error
   window.addEventListener("error", handleGlobalError);
   window.addEventListener("unhandledrejection", handleUnhandledRejection);
@@ -434,12 +437,66 @@ async function apiRequest(endpoint, options = {}) {
 // SINCRONIZACIÓN DE DATOS
 // ================================
 
+// Clave de localStorage con las operaciones pendientes de sincronizar
+const PENDING_SYNC_KEY = "huerto_pending_sync";
+
+// Registros por petición a /api/production/batch
+const PRODUCTION_BATCH_SIZE = 500;
+
+function queuePendingProduction(cropId, kilos, unidades) {
+  // Guardar una producción para enviarla por lotes al recuperar la conexión
+  const pending = JSON.parse(localStorage.getItem(PENDING_SYNC_KEY) || "[]");
+  pending.push({
+    id: `produccion_${Date.now()}_${pending.length}`,
+    tipo: "produccion",
+    registro: {
+      crop_id: cropId,
+      kilos: kilos || null,
+      unidades: unidades || null,
+      fecha: new Date().toISOString(),
+    },
+  });
+  localStorage.setItem(PENDING_SYNC_KEY, JSON.stringify(pending));
+}
+
+async function syncPendingProductions(producciones) {
+  // Enviar las producciones por lotes; devuelve las que hay que reintentar
+  const pendientes = [];
+
+  for (let i = 0; i < producciones.length; i += PRODUCTION_BATCH_SIZE) {
+    const lote = producciones.slice(i, i + PRODUCTION_BATCH_SIZE);
+    try {
+      const respuesta = await apiRequest("/api/production/batch", {
+        method: "POST",
+        body: JSON.stringify({ registros: lote.map((item) => item.registro) }),
+      });
+
+      respuesta.resultados.forEach((resultado) => {
+        const item = lote[resultado.indice];
+        if (resultado.success) {
+          console.log("✅ Sincronizado:", item.id);
+        } else {
+          console.error("❌ Error sincronizando:", item.id, resultado.error);
+          if (resultado.reintentar) {
+            pendientes.push(item);
+          }
+        }
+      });
+    } catch (error) {
+      console.error("❌ Error sincronizando lote de producciones:", error);
+      pendientes.push(...lote);
+    }
+  }
+
+  return pendientes;
+}
+
 async function syncPendingData() {
   console.log("🔄 Sincronizando datos pendientes...");
 
   try {
     // Obtener datos pendientes del almacenamiento local
-    const pendingData = localStorage.getItem("huerto_pending_sync");
+    const pendingData = localStorage.getItem(PENDING_SYNC_KEY);
     if (!pendingData) {
       console.log("✅ No hay datos pendientes de sincronización");
       return;
@@ -448,8 +505,12 @@ async function syncPendingData() {
     const data = JSON.parse(pendingData);
     console.log("📦 Datos a sincronizar:", data.length, "elementos");
 
-    // Procesar cada elemento pendiente
-    for (const item of data) {
+    // Las producciones van juntas en /api/production/batch
+    const producciones = data.filter((item) => item.tipo === "produccion");
+    const pendientes = await syncPendingProductions(producciones);
+
+    // Procesar el resto de elementos pendientes uno a uno
+    for (const item of data.filter((item) => item.tipo !== "produccion")) {
       try {
         await apiRequest(item.endpoint, item.options);
         console.log("✅ Sincronizado:", item.id);
@@ -458,14 +519,83 @@ async function syncPendingData() {
       }
     }
 
-    // Limpiar datos sincronizados
-    localStorage.removeItem("huerto_pending_sync");
-    showNotification("Datos sincronizados correctamente", "success");
+    // Limpiar datos sincronizados, conservando los que hay que reintentar
+    if (pendientes.length > 0) {
+      localStorage.setItem(PENDING_SYNC_KEY, JSON.stringify(pendientes));
+      showNotification(
+        `${pendientes.length} registros pendientes de sincronizar`,
+        "warning"
+      );
+    } else {
+      localStorage.removeItem(PENDING_SYNC_KEY);
+      showNotification("Datos sincronizados correctamente", "success");
+    }
   } catch (error) {
     console.error("❌ Error en sincronización:", error);
   }
 }
 
+// ================================
+// EXPORTACIONES EN SEGUNDO PLANO
+// ================================
+
+function handleExportClick(event) {
+  // Enlaces con data-export-formato y data-export-jobs (URL de la cola)
+  const enlace = event.target.closest("a[data-export-formato]");
+  if (!enlace || !window.EventSource || enlace.classList.contains("disabled")) {
+    return;
+  }
+  event.preventDefault();
+  exportInBackground(enlace);
+}
+
+function exportInBackground(enlace) {
+  // Encolar el informe, seguir su progreso por SSE y descargarlo al terminar;
+  // si la cola no está disponible (modo demo) se sigue el enlace normal
+  const contenido = enlace.innerHTML;
+  const terminar = (url) => {
+    enlace.innerHTML = contenido;
+    enlace.classList.remove("disabled");
+    if (url) {
+      window.location.href = url;
+    }
+  };
+
+  enlace.classList.add("disabled");
+  fetch(enlace.dataset.exportJobs, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ formato: enlace.dataset.exportFormato }),
+  })
+    .then((response) => (response.ok ? response.json() : Promise.reject(response)))
+    .then((trabajo) => {
+      if (trabajo.estado === "completado") {
+        terminar(trabajo.url_descarga);
+        return;
+      }
+
+      const eventos = new EventSource(trabajo.url_eventos);
+      eventos.addEventListener("progreso", (e) => {
+        enlace.textContent = `Generando... ${JSON.parse(e.data).progreso}%`;
+      });
+      eventos.addEventListener("completado", (e) => {
+        eventos.close();
+        terminar(JSON.parse(e.data).url_descarga);
+      });
+      eventos.addEventListener("fallo", (e) => {
+        eventos.close();
+        terminar();
+        showNotification(JSON.parse(e.data).error || "No se pudo generar el informe", "danger");
+      });
+      eventos.onerror = () => {
+        // Conexión cortada: el enlace normal espera al mismo trabajo
+        eventos.close();
+        terminar(enlace.href);
+      };
+    })
+    .catch(() => terminar(enlace.href));
+}
+
 // ================================
 // EVENTOS DE CICLO DE VIDA
 // ================================
@@ -492,6 +622,7 @@ window.showNotification = showNotification;
 window.formatNumber = formatNumber;
 window.formatDate = formatDate;
 window.apiRequest = apiRequest;
+window.queuePendingProduction = queuePendingProduction;
 
 // ================================
 // SISTEMA DE ACTUALIZACIONES PWA